@@ -4,10 +4,13 @@
 from __future__ import unicode_literals
 
 from datetime import datetime
+from functools import partial
 import json
+import multiprocessing
 import os
 
 from onmt.evaluate.evaluator import build_evaluator
+from onmt.evaluate.metrics import EvaluationCorpus, corpus_rouge
 from onmt.utils.misc import read_lines_string, concate_level
 
 import onmt.opts as opts
@@ -16,63 +19,87 @@ from onmt.utils.parse import ArgumentParser
 from onmt.utils.logging import init_logger
 
 
+def _evaluate_level(opt, level):
+    """Scores one level, in a worker process."""
+    evaluator = build_evaluator(opt)
+    corpus = EvaluationCorpus.from_files(
+        concate_level(opt.src, level),
+        concate_level(opt.tgt, level),
+        concate_level(opt.pred, level))
+    return evaluator.compute(corpus)
+
+
 def main(opt):
     logger = init_logger(opt.log_file)
 
     evaluator = build_evaluator(opt, logger)
 
-    for level in opt.levels:
-        src_path = concate_level(opt.src, level)
-        tgt_path = concate_level(opt.tgt, level)
-        pred_path = concate_level(opt.pred, level)
-
-        logger.info("Evaluating level %d." % level)
-        evaluator.evaluate(
-            src_path=src_path,
-            tgt_path=tgt_path,
-            pred_path=pred_path)
+    num_workers = opt.eval_workers if opt.eval_workers > 0 \
+        else multiprocessing.cpu_count()
+    num_workers = min(num_workers, len(opt.levels))
+    pool = multiprocessing.Pool(num_workers) if num_workers > 1 else None
+    evaluate_level = partial(_evaluate_level, opt)
+    if pool is not None:
+        async_results = pool.map_async(evaluate_level, opt.levels)
 
+    # Unified files are written while the levels are being scored.
     src_unified_path, tgt_unified_path, pred_unified_path = postprocess(opt)
+
+    if pool is not None:
+        levels_results = async_results.get()
+        pool.close()
+        pool.join()
+    else:
+        levels_results = [evaluate_level(level) for level in opt.levels]
+
+    for level, results in zip(opt.levels, levels_results):
+        logger.info("Evaluating level %d." % level)
+        evaluator.log_results(results)
+
+    # The unified scores are obtained by merging the statistics of the
+    # levels, only ROUGE has to be computed on the unified corpus.
+    unified_results = evaluator.merge(levels_results)
+    if opt.report_rouge:
+        unified_corpus = EvaluationCorpus.from_files(
+            src_unified_path, tgt_unified_path, pred_unified_path)
+        unified_results["rouge"] = corpus_rouge(unified_corpus)
+        unified_results.move_to_end("rouge", last=False)
     logger.info("Evaluating unified levels")
-    evaluator.evaluate(
-        src_path=src_unified_path,
-        tgt_path=tgt_unified_path,
-        pred_path=pred_unified_path)
+    evaluator.log_results(unified_results)
 
 
 def postprocess(opt):
-    src_unified = []
-    tgt_unified = []
-    pred_unified = []
+    unified_paths = [os.path.join(opt.output, file_name) for file_name in
+                     ['src.unified', 'tgt.unified', 'pred.unified']]
+    unified_files = [open(path, mode='w+', encoding='utf-8')
+                     for path in unified_paths]
     unified_translations = {}
     for level in opt.levels:
         src_lines = read_lines_string(concate_level(opt.src, level))
         tgt_lines = read_lines_string(concate_level(opt.tgt, level))
         pred_lines = read_lines_string(concate_level(opt.pred, level))
 
-        src_unified = src_unified + src_lines
-        tgt_unified = tgt_unified + tgt_lines
-        pred_unified = pred_unified + pred_lines
+        for unified_file, lines in zip(
+                unified_files, [src_lines, tgt_lines, pred_lines]):
+            unified_file.writelines(lines)
 
         for (src_line, tgt_line, pred_line) in zip(src_lines, tgt_lines, pred_lines):
             level_pred_dict = {level: {'tgt': tgt_line, 'pred': pred_line}}
             unified_translations.setdefault(src_line, {}).update(level_pred_dict)
+    for unified_file in unified_files:
+        unified_file.close()
 
     unified_translations_sorted = dict(sorted(unified_translations.items(), key=lambda kv: len(kv[1]), reverse=True))  # sort by number of levels for source sentence
 
     write_to_file(opt, 'src_tgt_pred.unified', json.dumps(unified_translations_sorted))
-    src_unified_path = write_to_file(opt, 'src.unified', "".join(src_unified))
-    tgt_unified_path = write_to_file(opt, 'tgt.unified', "".join(tgt_unified))
-    pred_unified_path = write_to_file(opt, 'pred.unified', "".join(pred_unified))
 
-    return src_unified_path, tgt_unified_path, pred_unified_path
+    return unified_paths
 
 
 def write_to_file(opt, file_name, output_content):
-    file_name = file_name
     output_path = os.path.join(opt.output, file_name)
-    out_file = open(output_path, mode='w+', encoding='utf-8')
-    out_file.write(output_content)
+    with open(output_path, mode='w+', encoding='utf-8') as out_file:
+        out_file.write(output_content)
 
     return output_path
 
@@ -1,7 +1,11 @@
 #!/usr/bin/env python
 """ Evaluator Class and builder """
 from __future__ import print_function
-import os
+from collections import OrderedDict
+from copy import deepcopy
+
+from onmt.evaluate.metrics import EvaluationCorpus, corpus_bleu, \
+    corpus_sari, corpus_rouge, corpus_readability
 
 
 def build_evaluator(opt, logger=None):
@@ -35,7 +39,6 @@ class Evaluator(object):
             logger=None):
         self.report_rouge = report_rouge
         self.report_bleu = report_bleu
-        self.report_rouge = report_rouge
         self.report_sari = report_sari
         self.report_flesch_reading_ease = report_flesch_reading_ease
         self.report_flesch_kincaid_grade_level = report_flesch_kincaid_grade_level
@@ -76,81 +79,59 @@ class Evaluator(object):
         """Evaluates content of src, tgt and pred.
 
         Args:
+            src_path (str): Path to the source sentences.
+            tgt_path (str): Path to the reference sentences.
+            pred_path (str): Path to the predicted sentences.
 
         Returns:
-
+            OrderedDict[str, object]: the statistics object of every
+            reported metric (see :mod:`onmt.evaluate.metrics`).
         """
 
+        corpus = EvaluationCorpus.from_files(src_path, tgt_path, pred_path)
+        return self.evaluate_corpus(corpus)
+
+    def evaluate_corpus(self, corpus):
+        """Evaluates an :class:`EvaluationCorpus` and logs the results."""
+        results = self.compute(corpus)
+        self.log_results(results)
+        return results
+
+    def log_results(self, results):
+        for stats in results.values():
+            self._log(">> " + str(stats))
+
+    @staticmethod
+    def merge(results_list):
+        """Merges the results of several corpora into those of their union.
+
+        Only metrics with additive statistics (i.e. an ``update`` method)
+        are merged; the others (ROUGE) must be computed on the union.
+        """
+        merged = OrderedDict()
+        for results in results_list:
+            for name, stats in results.items():
+                if not hasattr(stats, "update"):
+                    continue
+                if name in merged:
+                    merged[name].update(stats)
+                else:
+                    merged[name] = deepcopy(stats)
+        return merged
+
+    def compute(self, corpus):
+        """Computes the reported metrics on ``corpus`` without logging."""
+        results = OrderedDict()
         if self.report_rouge:
-            msg = self._report_rouge(tgt_path, pred_path)
-            self._log(msg)
+            results["rouge"] = corpus_rouge(corpus)
         if self.report_bleu:
-            msg = self._report_bleu(tgt_path, pred_path)
-            self._log(msg)
+            results["bleu"] = corpus_bleu(corpus)
         if self.report_sari:
-            msg = self._report_sari(src_path, tgt_path, pred_path)
-            self._log(msg)
+            results["sari"] = corpus_sari(corpus)
         if self.report_flesch_reading_ease:
-            msg = self._report_flesch_reading_ease(pred_path)
-            self._log(msg)
+            results["flesch_reading_ease"] = corpus_readability(
+                corpus, "Flesch Reading Ease")
         if self.report_flesch_kincaid_grade_level:
-            msg = self._report_flesch_kincaid_grade_level(pred_path)
-            self._log(msg)
-
-    def _report_rouge(self, tgt_path, pred_path):
-        import subprocess
-        path = os.path.split(os.path.realpath(__file__))[0]
-        msg = subprocess.check_output(
-            "python %s/tools/test_rouge.py -r %s -c STDIN" % (path, tgt_path),
-            shell=True, stdin=open(pred_path, "r")
-        ).decode("utf-8").strip()
-        return msg
-
-    def _report_bleu(self, tgt_path, pred_path):
-        import subprocess
-        base_dir = os.path.abspath(__file__ + "/../../..")
-
-        res = subprocess.check_output(
-            "perl %s/tools/multi-bleu.perl %s" % (base_dir, os.path.abspath(tgt_path)),
-            stdin=open(pred_path, "r"), shell=True
-        ).decode("utf-8")
-
-        msg = ">> " + res.strip()
-        return msg
-
-    def _report_sari(self, src_path, tgt_path, pred_path):
-        import subprocess
-        base_dir = os.path.abspath(__file__ + "/../../..")
-
-        res = subprocess.check_output(
-            "python %s/tools/sari.py %s %s" % (
-                base_dir, os.path.abspath(src_path), os.path.abspath(tgt_path)),
-            stdin=open(pred_path, "r"), shell=True
-        ).decode("utf-8")
-
-        msg = ">> " + res.strip()
-        return msg
-
-    def _report_flesch_reading_ease(self, pred_path):
-        import subprocess
-        base_dir = os.path.abspath(__file__ + "/../../..")
-
-        res = subprocess.check_output(
-            "python %s/tools/readability/readability.py \"Flesch Reading Ease\"" % base_dir,
-            stdin=open(pred_path, "r"), shell=True
-        ).decode("utf-8")
-
-        msg = ">> " + res.strip()
-        return msg
-
-    def _report_flesch_kincaid_grade_level(self, pred_path):
-        import subprocess
-        base_dir = os.path.abspath(__file__ + "/../../..")
-
-        res = subprocess.check_output(
-            "python %s/tools/readability/readability.py \"Flesch-Kincaid Grade Level\"" % base_dir,
-            stdin=open(pred_path, "r"), shell=True
-        ).decode("utf-8")
-
-        msg = ">> " + res.strip()
-        return msg
+            results["flesch_kincaid_grade_level"] = corpus_readability(
+                corpus, "Flesch-Kincaid Grade Level")
+        return results
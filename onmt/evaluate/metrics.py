@@ -0,0 +1,275 @@
+""" In-process evaluation metrics """
+from __future__ import division
+import importlib
+import math
+import os
+import sys
+from collections import Counter
+
+
+def ngrams(tokens, n):
+    """Return the list of ``n``-grams (as tuples) of ``tokens``."""
+    return [tuple(tokens[i:i + n]) for i in range(len(tokens) - n + 1)]
+
+
+def ngram_counts(tokens, max_order=4):
+    """Count the 1- to ``max_order``-grams of ``tokens``.
+
+    Returns:
+        list[Counter]: counters for orders ``1`` to ``max_order``.
+    """
+    return [Counter(ngrams(tokens, n)) for n in range(1, max_order + 1)]
+
+
+def bleu_tokenize(line):
+    """Tokenization used by ``tools/multi-bleu.perl``."""
+    return line.split()
+
+
+def sari_tokenize(line):
+    """Tokenization used by ``tools/sari.py``."""
+    return line.lower().split(" ")
+
+
+class EvaluationCorpus(object):
+    """Source, target and predicted lines of one evaluation set.
+
+    Each file is read once. Tokenized lines and n-gram counts are cached
+    per side and per tokenizer so that every metric asking for the same
+    view of the data shares it.
+
+    Args:
+        src (list[str]): Source lines.
+        tgt (list[str]): Reference lines.
+        pred (list[str]): Predicted lines.
+    """
+
+    def __init__(self, src, tgt, pred):
+        self._lines = {"src": src, "tgt": tgt, "pred": pred}
+        self._tokens = {}
+        self._ngram_counts = {}
+
+    @classmethod
+    def from_files(cls, src_path, tgt_path, pred_path):
+        """Alternate constructor reading each path once."""
+        return cls(cls._read(src_path),
+                   cls._read(tgt_path),
+                   cls._read(pred_path))
+
+    @staticmethod
+    def _read(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return [line.strip() for line in f]
+
+    def __len__(self):
+        return len(self._lines["pred"])
+
+    def lines(self, side):
+        return self._lines[side]
+
+    def tokens(self, side, tokenize):
+        key = (side, tokenize)
+        if key not in self._tokens:
+            self._tokens[key] = [tokenize(line) for line in self.lines(side)]
+        return self._tokens[key]
+
+    def ngram_counts(self, side, tokenize, max_order=4):
+        key = (side, tokenize, max_order)
+        if key not in self._ngram_counts:
+            self._ngram_counts[key] = [
+                ngram_counts(toks, max_order)
+                for toks in self.tokens(side, tokenize)]
+        return self._ngram_counts[key]
+
+
+class BleuStatistics(object):
+    """Corpus BLEU sufficient statistics, as in ``tools/multi-bleu.perl``.
+
+    Statistics of several corpora can be merged with :func:`update()`;
+    the score of the merged statistics equals the score of the
+    concatenated corpora.
+    """
+
+    name = "BLEU"
+
+    def __init__(self, max_order=4):
+        self.max_order = max_order
+        self.correct = [0] * max_order
+        self.total = [0] * max_order
+        self.hyp_len = 0
+        self.ref_len = 0
+
+    def add_sentence(self, hyp_tokens, hyp_counts, refs_tokens, refs_counts):
+        """Accumulate one hypothesis against its references."""
+        hyp_len = len(hyp_tokens)
+        closest_diff, closest_len = 9999, 9999
+        for ref_tokens in refs_tokens:
+            diff = abs(hyp_len - len(ref_tokens))
+            if diff < closest_diff or \
+                    (diff == closest_diff and len(ref_tokens) < closest_len):
+                closest_diff, closest_len = diff, len(ref_tokens)
+        self.hyp_len += hyp_len
+        self.ref_len += closest_len
+
+        for n in range(self.max_order):
+            max_ref_counts = Counter()
+            for ref_counts in refs_counts:
+                max_ref_counts |= ref_counts[n]
+            for gram, count in hyp_counts[n].items():
+                self.total[n] += count
+                self.correct[n] += min(count, max_ref_counts[gram])
+
+    def update(self, stat):
+        for n in range(self.max_order):
+            self.correct[n] += stat.correct[n]
+            self.total[n] += stat.total[n]
+        self.hyp_len += stat.hyp_len
+        self.ref_len += stat.ref_len
+
+    def precisions(self):
+        return [c / t if t else 0 for c, t in zip(self.correct, self.total)]
+
+    def brevity_penalty(self):
+        if self.hyp_len >= self.ref_len:
+            return 1.0
+        if self.hyp_len == 0:
+            return 0.0
+        return math.exp(1 - self.ref_len / self.hyp_len)
+
+    def score(self):
+        if self.ref_len == 0:
+            return 0.0
+
+        def _log(p):
+            return math.log(p) if p else -9999999999
+
+        log_precision = sum(_log(p) for p in self.precisions())
+        return self.brevity_penalty() * math.exp(
+            log_precision / self.max_order)
+
+    def to_dict(self):
+        return {"bleu": 100 * self.score(),
+                "precisions": [100 * p for p in self.precisions()],
+                "bp": self.brevity_penalty(),
+                "hyp_len": self.hyp_len,
+                "ref_len": self.ref_len}
+
+    def __str__(self):
+        if self.ref_len == 0:
+            return "BLEU = 0, 0/0/0/0 (BP=0, ratio=0, hyp_len=0, ref_len=0)"
+        return ("BLEU = %.2f, %s (BP=%.3f, ratio=%.3f, hyp_len=%d, "
+                "ref_len=%d)" % (
+                    100 * self.score(),
+                    "/".join("%.1f" % (100 * p) for p in self.precisions()),
+                    self.brevity_penalty(),
+                    self.hyp_len / self.ref_len,
+                    self.hyp_len,
+                    self.ref_len))
+
+
+class MeanStatistics(object):
+    """Sum and count of a sentence-level metric averaged over a corpus.
+
+    Args:
+        name (str): Metric name used when printing.
+        scale (float): Factor applied to the average when printing.
+    """
+
+    def __init__(self, name, scale=1.0):
+        self.name = name
+        self.scale = scale
+        self.total = 0.0
+        self.count = 0
+
+    def add(self, value, count=1):
+        self.total += value
+        self.count += count
+
+    def update(self, stat):
+        self.total += stat.total
+        self.count += stat.count
+
+    def score(self):
+        return self.scale * self.total / self.count if self.count else 0.0
+
+    def to_dict(self):
+        return {self.name: self.score(), "count": self.count}
+
+    def __str__(self):
+        return "%s = %f" % (self.name, self.score())
+
+
+class RougeResult(object):
+    """ROUGE scores as returned by ``tools/test_rouge.py``.
+
+    ROUGE has no additive sufficient statistics; it has to be recomputed
+    on the whole corpus.
+    """
+
+    name = "ROUGE"
+
+    def __init__(self, results_dict, message):
+        self.results_dict = results_dict
+        self.message = message
+
+    def to_dict(self):
+        return dict(self.results_dict)
+
+    def __str__(self):
+        if self.message.startswith(">> "):
+            return self.message[len(">> "):]
+        return self.message
+
+
+def _tools_module(*path):
+    """Import a module living under ``tools/`` of the repository."""
+    base_dir = os.path.abspath(
+        os.path.join(os.path.dirname(__file__), "..", ".."))
+    module_dir = os.path.join(base_dir, "tools", *path[:-1])
+    if module_dir not in sys.path:
+        sys.path.insert(0, module_dir)
+    return importlib.import_module(path[-1])
+
+
+def corpus_bleu(corpus):
+    stats = BleuStatistics()
+    hyps = corpus.tokens("pred", bleu_tokenize)
+    hyps_counts = corpus.ngram_counts("pred", bleu_tokenize)
+    refs = corpus.tokens("tgt", bleu_tokenize)
+    refs_counts = corpus.ngram_counts("tgt", bleu_tokenize)
+    for hyp, hyp_counts, ref, ref_counts in zip(
+            hyps, hyps_counts, refs, refs_counts):
+        stats.add_sentence(hyp, hyp_counts, [ref], [ref_counts])
+    return stats
+
+
+def corpus_sari(corpus):
+    sari = _tools_module("sari")
+    scores = sari.SARIcorpus(
+        corpus.tokens("src", sari_tokenize),
+        corpus.tokens("pred", sari_tokenize),
+        [corpus.tokens("tgt", sari_tokenize)],
+        tokenized=True)
+    stats = MeanStatistics("SARI", scale=100)
+    stats.add(float(scores.sum()), count=len(scores))
+    return stats
+
+
+def corpus_readability(corpus, metric_name):
+    readability = _tools_module("readability", "readability")
+    methods = {"Flesch Reading Ease": "FleschReadingEase",
+               "Flesch-Kincaid Grade Level": "FleschKincaidGradeLevel"}
+    stats = MeanStatistics(metric_name)
+    for line in corpus.lines("pred"):
+        if len(line) > 0:
+            rd = readability.Readability(line)
+            stats.add(getattr(rd, methods[metric_name])())
+    return stats
+
+
+def corpus_rouge(corpus):
+    test_rouge = _tools_module("test_rouge")
+    results_dict = test_rouge.test_rouge(
+        corpus.lines("pred"), corpus.lines("tgt"))
+    return RougeResult(results_dict,
+                       test_rouge.rouge_results_to_str(results_dict))
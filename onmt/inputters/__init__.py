@@ -5,9 +5,11 @@ e.g., from a line of text to a sequence of embeddings.
 """
 from onmt.inputters.inputter import \
     load_old_vocab, get_fields, OrderedIterator, \
-    build_vocab, old_style_vocab, filter_example
+    build_vocab, count_tokens, old_style_vocab, filter_example, \
+    CompactIterator, load_dataset
 from onmt.inputters.dataset_base import Dataset
 from onmt.inputters.multi_level_dataset import MultiLevelDataset
+from onmt.inputters.compact_dataset import CompactDataset
 from onmt.inputters.text_dataset import text_sort_key, TextDataReader
 from onmt.inputters.image_dataset import img_sort_key, ImageDataReader
 from onmt.inputters.audio_dataset import audio_sort_key, AudioDataReader
@@ -20,8 +22,10 @@ str2sortkey = {
     'text': text_sort_key, 'img': img_sort_key, 'audio': audio_sort_key}
 
 
-__all__ = ['Dataset', 'MultiLevelDataset', 'load_old_vocab', 'get_fields', 'DataReaderBase',
+__all__ = ['Dataset', 'MultiLevelDataset', 'CompactDataset',
+           'load_old_vocab', 'get_fields', 'DataReaderBase',
            'filter_example', 'old_style_vocab',
-           'build_vocab', 'OrderedIterator',
+           'build_vocab', 'count_tokens', 'OrderedIterator',
+           'CompactIterator', 'load_dataset',
            'text_sort_key', 'img_sort_key', 'audio_sort_key',
            'TextDataReader', 'ImageDataReader', 'AudioDataReader']
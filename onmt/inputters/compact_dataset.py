@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+import os
+from array import array
+
+import torch
+from torchtext.data import Batch
+
+COMPACT_FORMAT = "onmt-compact"
+
+# offsets of the tensors in the data file are multiples of this, so that
+# a tensor of any type can be mapped from it
+_ALIGNMENT = 8
+
+_STORAGES = {
+    torch.int32: torch.IntStorage,
+    torch.int64: torch.LongStorage,
+}
+_DTYPES = {str(dtype): dtype for dtype in _STORAGES}
+
+
+def is_compact_header(obj):
+    return isinstance(obj, dict) and obj.get("format") == COMPACT_FORMAT
+
+
+def data_path(path):
+    return path + ".bin"
+
+
+class CompactDataset(object):
+    """Tensor-backed shard of a text :class:`MultiLevelDataset`.
+
+    Instead of one :class:`torchtext.data.Example` per sentence, each
+    side keeps the token ids of all its sentences in a single flat int32
+    tensor of shape ``(n_tokens, n_subfields)`` together with an int64
+    ``offsets`` tensor of shape ``(len(dataset) + 1,)``: sentence ``i``
+    is ``ids[offsets[i]:offsets[i + 1]]``. :func:`save()` writes these
+    tensors raw to ``<path>.bin`` next to a small header at ``<path>``,
+    and :func:`load()` maps them in memory: only the pages of the
+    sentences batched are read from disk, and :func:`unmap()` drops
+    them until the next access.
+
+    A shard is first built with a shard-local vocabulary (the fields
+    have no vocab yet while preprocessing), then remapped to the field
+    vocabularies with :func:`numericalize()`.
+
+    Args:
+        level (int): level of the dataset.
+        sides (dict[str, dict[str, torch.Tensor]]): ``"ids"`` and
+            ``"offsets"`` tensors of each side.
+        indices (torch.LongTensor): original index of each sentence.
+        vocabs (dict[str, List[List[str]]] or NoneType): shard-local
+            vocabulary of each subfield of each side, ``None`` once the
+            ids refer to the field vocabularies.
+    """
+
+    def __init__(self, level, sides, indices, vocabs=None):
+        self.level = level
+        self._sides = sides
+        self._indices = indices
+        self.vocabs = vocabs
+        # path and index of the saved tensors, for mapped datasets
+        self._path = None
+        self._index = None
+
+    @property
+    def sides(self):
+        if self._sides is None:
+            self._map()
+        return self._sides
+
+    @property
+    def indices(self):
+        if self._indices is None:
+            self._map()
+        return self._indices
+
+    @classmethod
+    def from_dataset(cls, dataset, fields):
+        """Collect the tokens of a text ``dataset`` built with
+        ``fields``."""
+        sides = {}
+        vocabs = {}
+        for side in ("src", "tgt"):
+            if side not in fields or not dataset.examples or \
+                    not hasattr(dataset.examples[0], side):
+                continue
+            n_subfields = len(fields[side].fields)
+            stoi = [{} for _ in range(n_subfields)]
+            ids = [array("i") for _ in range(n_subfields)]
+            offsets = array("q", [0])
+            for ex in dataset.examples:
+                for sub_stoi, sub_ids, tokens in zip(
+                        stoi, ids, getattr(ex, side)):
+                    sub_ids.extend(
+                        sub_stoi.setdefault(tok, len(sub_stoi))
+                        for tok in tokens)
+                offsets.append(len(ids[0]))
+            sides[side] = {
+                "ids": torch.stack(
+                    [torch.IntTensor(sub_ids) for sub_ids in ids], 1),
+                "offsets": torch.LongTensor(offsets)}
+            vocabs[side] = [sorted(sub_stoi, key=sub_stoi.get)
+                            for sub_stoi in stoi]
+        indices = torch.LongTensor([ex.indices for ex in dataset.examples])
+        return cls(dataset.level, sides, indices, vocabs)
+
+    def numericalize(self, fields):
+        """Remap the shard-local ids to the vocab of ``fields``."""
+        if self.vocabs is None:
+            return
+        for side, side_vocabs in self.vocabs.items():
+            ids = self.sides[side]["ids"]
+            for j, ((_, field), itos) in enumerate(
+                    zip(fields[side].fields, side_vocabs)):
+                unk = field.vocab.stoi[field.unk_token]
+                remap = torch.LongTensor(
+                    [field.vocab.stoi.get(tok, unk) for tok in itos])
+                if len(itos) > 0:
+                    ids[:, j] = remap[ids[:, j].long()].int()
+        self.vocabs = None
+
+    def __len__(self):
+        return self.indices.size(0)
+
+    def lengths(self, side):
+        offsets = self.sides[side]["offsets"]
+        return offsets[1:] - offsets[:-1]
+
+    def save(self, path):
+        """Write the tensors to ``<path>.bin`` and the header to ``path``.
+
+        The data file is replaced rather than overwritten, as it may be
+        mapped by this dataset.
+        """
+        tensors = [("indices", self.indices)] + [
+            ((side, name), tensor)
+            for side, side_tensors in self.sides.items()
+            for name, tensor in side_tensors.items()]
+        index = {}
+        offset = 0
+        tmp_path = data_path(path) + ".tmp"
+        with open(tmp_path, "wb") as f:
+            for key, tensor in tensors:
+                padding = -offset % _ALIGNMENT
+                f.write(b"\0" * padding)
+                offset += padding
+                index[key] = (str(tensor.dtype), tuple(tensor.size()), offset)
+                data = tensor.contiguous().numpy().tobytes()
+                f.write(data)
+                offset += len(data)
+        os.replace(tmp_path, data_path(path))
+        torch.save({"format": COMPACT_FORMAT,
+                    "level": self.level,
+                    "sides": list(self.sides),
+                    "index": index,
+                    "vocabs": self.vocabs}, path)
+
+    @classmethod
+    def load(cls, path, header=None):
+        """The dataset saved at ``path`` by :func:`save()`, whose tensors
+        are mapped from the data file on first access.
+
+        Args:
+            path (str): path of the header.
+            header (dict or NoneType): the header, as loaded by
+                :func:`torch.load`, if already loaded.
+        """
+        if header is None:
+            header = torch.load(path)
+        dataset = cls(header["level"], None, None, header["vocabs"])
+        dataset._path = path
+        dataset._index = header
+        return dataset
+
+    def _map(self):
+        """Map the tensors of the data file in memory, privately: the
+        file is left as it is when they are written."""
+        storages = {}
+        path = data_path(self._path)
+
+        def mapped(dtype, size, offset):
+            dtype = _DTYPES[dtype]
+            tensor = torch.empty(size, dtype=dtype)
+            if tensor.nelement() == 0:
+                return tensor
+            if dtype not in storages:
+                storages[dtype] = _STORAGES[dtype].from_file(
+                    path, False,
+                    os.path.getsize(path) // tensor.element_size())
+            return tensor.set_(storages[dtype],
+                               offset // tensor.element_size(),
+                               torch.Size(size))
+
+        index = self._index["index"]
+        self._indices = mapped(*index["indices"])
+        self._sides = {
+            side: {name: mapped(*index[side, name])
+                   for name in ("ids", "offsets")}
+            for side in self._index["sides"]}
+
+    def unmap(self):
+        """Drop the mapped tensors, they are mapped again when next
+        used. Datasets not loaded by :func:`load()` are kept as they
+        are."""
+        if self._path is not None:
+            self._sides = None
+            self._indices = None
+
+    def _pad(self, side, field, idx, device):
+        """Build the padded ``(seq_len, batch, n_subfields)`` tensor of
+        the sentences ``idx``, as :class:`TextMultiField` would."""
+        ids = self.sides[side]["ids"]
+        offsets = self.sides[side]["offsets"]
+        starts = offsets[idx]
+        lengths = offsets[idx + 1] - starts
+        max_len = int(lengths.max()) if len(idx) > 0 else 0
+
+        base_field = field.base_field
+        n_bos = int(base_field.init_token is not None)
+        n_eos = int(base_field.eos_token is not None)
+        specials = [[f.vocab.stoi[f.pad_token],
+                     f.vocab.stoi[f.init_token] if n_bos else 0,
+                     f.vocab.stoi[f.eos_token] if n_eos else 0]
+                    for _, f in field.fields]
+        pad, bos, eos = torch.LongTensor(specials).t()
+
+        steps = torch.arange(max_len)
+        mask = steps.unsqueeze(1) < lengths.unsqueeze(0)
+        positions = (starts.unsqueeze(0) + steps.unsqueeze(1)).masked_fill(
+            mask.eq(0), 0)
+        body = ids[positions.view(-1)].long().view(
+            max_len, len(idx), -1)
+        body = torch.where(mask.unsqueeze(2), body, pad.view(1, 1, -1))
+
+        data = pad.view(1, 1, -1).repeat(
+            max_len + n_bos + n_eos, len(idx), 1)
+        if n_bos:
+            data[0] = bos
+        data[n_bos:n_bos + max_len] = body
+        if n_eos:
+            data[lengths + n_bos, torch.arange(len(idx))] = eos
+        data = data.to(device)
+        if base_field.include_lengths:
+            return data, (lengths + n_bos + n_eos).to(device)
+        return data
+
+    def batch(self, idx, fields, device=None):
+        """Build the :class:`torchtext.data.Batch` of the sentences
+        ``idx`` (list of int), with the attributes a batch of the
+        equivalent :class:`MultiLevelDataset` would have."""
+        idx_tensor = torch.LongTensor(idx)
+        batch = Batch()
+        batch.batch_size = len(idx)
+        batch.dataset = self
+        batch.fields = list(self.sides) + ["indices", "levels"]
+        batch.input_fields = ["src"]
+        batch.target_fields = ["tgt"]
+        for side in self.sides:
+            setattr(batch, side,
+                    self._pad(side, fields[side], idx_tensor, device))
+        batch.indices = self.indices[idx_tensor].to(device)
+        batch.levels = torch.full(
+            (len(idx),), self.level, dtype=torch.long, device=device)
+        batch.level = self.level
+        return batch
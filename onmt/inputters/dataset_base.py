@@ -141,6 +141,15 @@ class Dataset(TorchtextDataset):
         else:
             raise AttributeError
 
+    def example(self, index):
+        """The example whose ``indices`` field is ``index``, i.e. the
+        ``index``-th one read, even if ``filter_pred`` left some out."""
+        positions = vars(self).get('_positions')
+        if positions is None:
+            positions = {ex.indices: i for i, ex in enumerate(self.examples)}
+            self._positions = positions
+        return self.examples[positions[index]]
+
     def save(self, path, remove_fields=True):
         if remove_fields:
             self.fields = []
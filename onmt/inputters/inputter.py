@@ -3,9 +3,13 @@ import glob
 import os
 import codecs
 import math
+import queue
+import random
+import threading
 
-from collections import Counter, defaultdict
-from itertools import chain, cycle
+from collections import Counter, OrderedDict, defaultdict
+from copy import copy
+from itertools import chain, cycle, repeat, tee
 
 import torch
 import torchtext.data
@@ -13,6 +17,8 @@ from torchtext.data import Field
 from torchtext.vocab import Vocab
 
 from onmt.inputters.text_dataset import text_fields, TextMultiField
+from onmt.inputters.compact_dataset import CompactDataset, \
+    is_compact_header
 from onmt.inputters.image_dataset import image_fields
 from onmt.inputters.audio_dataset import audio_fields
 from onmt.utils.logging import logger
@@ -311,10 +317,38 @@ def _build_fv_from_multifield(multifield, counters, build_fv_args,
         logger.info(" * %s vocab size: %d." % (name, len(field.vocab)))
 
 
+def count_tokens(dataset, fields):
+    """Count the tokens of every sequential field of ``dataset``.
+
+    Args:
+        dataset (Dataset): a dataset built with ``fields``.
+        fields (dict[str, Field]): fields of the dataset.
+
+    Returns:
+        defaultdict(Counter) keyed by (sub)field name.
+    """
+
+    counters = defaultdict(Counter)
+    for ex in dataset.examples:
+        for name, field in fields.items():
+            try:
+                f_iter = iter(field)
+            except TypeError:
+                f_iter = [(name, field)]
+                all_data = [getattr(ex, name, None)]
+            else:
+                all_data = getattr(ex, name)
+            for (sub_n, sub_f), fd in zip(
+                    f_iter, all_data):
+                if sub_f.sequential:
+                    counters[sub_n].update(fd)
+    return counters
+
+
 def build_vocab(train_dataset_files, fields, data_type, share_vocab,
                 src_vocab_path, src_vocab_size, src_words_min_frequency,
                 tgt_vocab_path, tgt_vocab_size, tgt_words_min_frequency,
-                vocab_size_multiple=1):
+                vocab_size_multiple=1, dataset_counters=None):
     """Build the fields for all data sides.
 
     Args:
@@ -332,6 +366,9 @@ def build_vocab(train_dataset_files, fields, data_type, share_vocab,
             include a target word in the vocabulary.
         vocab_size_multiple (int): ensure that the vocabulary size is a
             multiple of this value.
+        dataset_counters (dict[str, Counter] or NoneType): token counts
+            of the train datasets, as returned by :func:`count_tokens()`.
+            If given, ``train_dataset_files`` are not reloaded.
 
     Returns:
         Dict of Fields
@@ -352,35 +389,25 @@ def build_vocab(train_dataset_files, fields, data_type, share_vocab,
     else:
         tgt_vocab = None
 
-    for i, path in enumerate(train_dataset_files):
-        dataset = torch.load(path)
-        logger.info(" * reloading %s." % path)
-        for ex in dataset.examples:
-            for name, field in fields.items():
-                try:
-                    f_iter = iter(field)
-                except TypeError:
-                    f_iter = [(name, field)]
-                    all_data = [getattr(ex, name, None)]
-                else:
-                    all_data = getattr(ex, name)
-                for (sub_n, sub_f), fd in zip(
-                        f_iter, all_data):
-                    has_vocab = (sub_n == 'src' and src_vocab) or \
-                                (sub_n == 'tgt' and tgt_vocab)
-                    if sub_f.sequential and not has_vocab:
-                        val = fd
-                        counters[sub_n].update(val)
-
-        # Drop the none-using from memory but keep the last
-        if i < len(train_dataset_files) - 1:
+    if dataset_counters is None:
+        dataset_counters = defaultdict(Counter)
+        for path in train_dataset_files:
+            dataset = torch.load(path)
+            logger.info(" * reloading %s." % path)
+            for sub_n, counter in count_tokens(dataset, fields).items():
+                dataset_counters[sub_n].update(counter)
+
+            # Drop the dataset from memory before loading the next one
             dataset.examples = None
-            gc.collect()
-            del dataset.examples
-            gc.collect()
             del dataset
             gc.collect()
 
+    for sub_n, counter in dataset_counters.items():
+        has_vocab = (sub_n == 'src' and src_vocab) or \
+                    (sub_n == 'tgt' and tgt_vocab)
+        if not has_vocab:
+            counters[sub_n].update(counter)
+
     build_fv_args = defaultdict(dict)
     build_fv_args["src"] = dict(
         max_size=src_vocab_size, min_freq=src_words_min_frequency)
@@ -496,6 +523,15 @@ class OrderedIterator(torchtext.data.Iterator):
         super(OrderedIterator, self).__init__(dataset, batch_size, **kwargs)
         self.batch_size_multiple = batch_size_multiple
 
+    def __iter__(self):
+        # all the examples of a MultiLevelDataset share its level: attach
+        # it to the batch as a python int, so that selecting the decoder
+        # does not need to read the ``levels`` tensor back from the device
+        level = getattr(self.dataset, "level", None)
+        for batch in super(OrderedIterator, self).__iter__():
+            batch.level = level
+            yield batch
+
     def create_batches(self):
         if self.train:
             def _pool(data, random_shuffler):
@@ -519,6 +555,211 @@ class OrderedIterator(torchtext.data.Iterator):
                 self.batches.append(sorted(b, key=self.sort_key))
 
 
+class CompactIterator(object):
+    """Batch iterator over a :class:`CompactDataset`.
+
+    Same batching scheme as :class:`onmt.inputters.OrderedIterator`
+    (pools of ``100 * batch_size`` shuffled sentences sorted by length
+    when training, sorted within each batch by decreasing length), but
+    working on sentence indices and lengths only.
+
+    Args:
+        dataset (CompactDataset): numericalized dataset.
+        fields (dict[str, Field]): fields with their vocabularies.
+        batch_size (int): batch size.
+        batch_size_fn: ``fn(src_len, tgt_len, count, sofar)`` returning
+            the size of a batch of ``count`` sentences after adding one
+            of lengths ``src_len``, ``tgt_len``; ``None`` counts
+            sentences.
+        batch_size_multiple (int): see :func:`batch_iter()`.
+        device: device of the batch tensors.
+        train (bool): shuffle the data.
+        repeat (bool): iterate forever.
+    """
+
+    def __init__(self, dataset, fields, batch_size, batch_size_fn=None,
+                 batch_size_multiple=1, device=None, train=True,
+                 repeat=False):
+        assert dataset.vocabs is None, "the dataset is not numericalized"
+        self.dataset = dataset
+        self.fields = fields
+        self.batch_size = batch_size
+        self.batch_size_fn = batch_size_fn
+        self.batch_size_multiple = batch_size_multiple
+        self.device = device
+        self.train = train
+        self.repeat = repeat
+        self._epoch_seed = None
+        self._iterations_this_epoch = 0
+        self._restored_from_state = False
+
+    def state_dict(self):
+        """Position in the current pass, see :func:`load_state_dict()`."""
+        return {"iterations_this_epoch": self._iterations_this_epoch,
+                "epoch_seed": self._epoch_seed}
+
+    def load_state_dict(self, state_dict):
+        """Resume iterating where :func:`state_dict()` was taken, possibly
+        on a freshly loaded copy of the dataset."""
+        self._iterations_this_epoch = state_dict["iterations_this_epoch"]
+        self._epoch_seed = state_dict["epoch_seed"]
+        self._restored_from_state = True
+
+    def _sort_key_lengths(self):
+        src_lengths = self.dataset.lengths("src").tolist()
+        if "tgt" in self.dataset.sides:
+            tgt_lengths = self.dataset.lengths("tgt").tolist()
+        else:
+            tgt_lengths = [0] * len(src_lengths)
+        return src_lengths, tgt_lengths
+
+    def create_batches(self):
+        src_lengths, tgt_lengths = self._sort_key_lengths()
+        if self.batch_size_fn is None:
+            batch_size_fn = None
+        else:
+            def batch_size_fn(i, count, sofar):
+                return self.batch_size_fn(
+                    src_lengths[i], tgt_lengths[i], count, sofar)
+
+        def sort_key(i):
+            return src_lengths[i], tgt_lengths[i]
+
+        def _batches(data):
+            return batch_iter(
+                data, self.batch_size,
+                batch_size_fn=batch_size_fn,
+                batch_size_multiple=self.batch_size_multiple)
+
+        if self.train:
+            # the pass only depends on its seed, so that it can be replayed
+            generator = torch.Generator()
+            generator.manual_seed(self._epoch_seed)
+            shuffler = random.Random(self._epoch_seed)
+            order = torch.randperm(len(self.dataset), generator=generator)
+            for pool in order.split(self.batch_size * 100):
+                p_batch = list(_batches(sorted(pool.tolist(), key=sort_key)))
+                shuffler.shuffle(p_batch)
+                for b in p_batch:
+                    yield sorted(b, key=sort_key, reverse=True)
+        else:
+            for b in _batches(range(len(self.dataset))):
+                yield sorted(b, key=sort_key, reverse=True)
+
+    def __iter__(self):
+        while True:
+            if self._restored_from_state:
+                self._restored_from_state = False
+            else:
+                self._epoch_seed = random.getrandbits(31)
+                self._iterations_this_epoch = 0
+            for i, idx in enumerate(self.create_batches()):
+                # fast-forward if loaded from state
+                if i < self._iterations_this_epoch:
+                    continue
+                self._iterations_this_epoch += 1
+                yield self.dataset.batch(idx, self.fields, self.device)
+            if not self.repeat:
+                return
+
+
+def load_dataset(path):
+    """Load a dataset shard saved by ``preprocess.py``. The tensors of
+    :class:`CompactDataset` shards are memory-mapped, see
+    :func:`CompactDataset.load()`."""
+    dataset = torch.load(path)
+    if is_compact_header(dataset):
+        return CompactDataset.load(path, dataset)
+    return dataset
+
+
+def _pad_to(data, length, pad):
+    """Pad the ``(seq_len, batch, n_subfields)`` tensor ``data`` with the
+    ``pad`` index of each subfield up to ``length`` steps."""
+    if data.size(0) == length:
+        return data
+    padded = pad.to(data.device).view(1, 1, -1).repeat(
+        length, data.size(1), 1)
+    padded[:data.size(0)] = data
+    return padded
+
+
+def merge_batches(batches, fields):
+    """Merge text batches of possibly different levels into one batch.
+
+    Sequences are padded to the longest one and the merged batch is
+    sorted by decreasing source length, as the encoder expects. Besides
+    the usual attributes, the merged batch has a ``level_index``
+    :class:`OrderedDict` mapping each level to the positions of its
+    sentences in the merged batch (a LongTensor on the batch device);
+    ``batch.level`` is ``None`` unless all the batches share a level.
+
+    Args:
+        batches (list[torchtext.data.Batch]): batches with ``src`` (with
+            lengths), ``tgt``, ``indices``, ``levels`` and ``level``.
+        fields (dict[str, Field]): fields with their vocabularies.
+    """
+    merged = torchtext.data.Batch()
+    merged.batch_size = sum(b.batch_size for b in batches)
+    merged.dataset = batches[0].dataset
+    merged.fields = batches[0].fields
+    merged.input_fields = ["src"]
+    merged.target_fields = ["tgt"]
+    for name in merged.fields:
+        values = [getattr(b, name) for b in batches]
+        if isinstance(values[0], tuple):
+            data, lengths = zip(*values)
+        else:
+            data, lengths = values, None
+        if data[0].dim() == 1:
+            value = torch.cat(data, 0)
+        else:
+            pad = torch.LongTensor(
+                [f.vocab.stoi[f.pad_token] for _, f in fields[name].fields])
+            max_len = max(d.size(0) for d in data)
+            value = torch.cat([_pad_to(d, max_len, pad) for d in data], 1)
+        if lengths is not None:
+            value = (value, torch.cat(lengths, 0))
+        setattr(merged, name, value)
+
+    _, order = merged.src[1].sort(0, descending=True)
+    for name in merged.fields:
+        value = getattr(merged, name)
+        if isinstance(value, tuple):
+            value = (value[0].index_select(1, order),
+                     value[1].index_select(0, order))
+        elif value.dim() == 1:
+            value = value.index_select(0, order)
+        else:
+            value = value.index_select(1, order)
+        setattr(merged, name, value)
+
+    # position in the merged batch of each sentence of each batch
+    position = torch.empty_like(order)
+    position[order] = torch.arange(
+        order.size(0), dtype=order.dtype, device=order.device)
+    level_positions = OrderedDict()
+    start = 0
+    for b in batches:
+        level_positions.setdefault(b.level, []).append(
+            position[start:start + b.batch_size])
+        start += b.batch_size
+    merged.level_index = OrderedDict(
+        (level, torch.cat(positions, 0))
+        for level, positions in level_positions.items())
+    merged.level = batches[0].level if len(level_positions) == 1 else None
+    return merged
+
+
+def batch_levels(batch):
+    """The ``levels`` argument of
+    :class:`onmt.models.MultiDecodersNMTModel` for ``batch``: its level,
+    or the ``level_index`` of a batch mixing several levels."""
+    if batch.level is None:
+        return batch.level_index
+    return batch.level
+
+
 class DatasetLazyIter(object):
     """Yield data from sharded dataset files.
 
@@ -530,15 +771,18 @@ class DatasetLazyIter(object):
         batch_size_fn: custom batch process function.
         device: See :class:`OrderedIterator` ``device``.
         is_train (bool): train or valid?
+        compact_batch_size_fn: ``batch_size_fn`` of the
+            :class:`CompactIterator` of compact shards.
     """
 
     def __init__(self, dataset_paths, fields, batch_size, batch_size_fn,
                  batch_size_multiple, device, is_train, repeat=True,
-                 num_batches_multiple=1):
+                 num_batches_multiple=1, compact_batch_size_fn=None):
         self._paths = dataset_paths
         self.fields = fields
         self.batch_size = batch_size
         self.batch_size_fn = batch_size_fn
+        self.compact_batch_size_fn = compact_batch_size_fn
         self.batch_size_multiple = batch_size_multiple
         self.device = device
         self.is_train = is_train
@@ -546,9 +790,26 @@ class DatasetLazyIter(object):
         self.num_batches_multiple = num_batches_multiple
 
     def _iter_dataset(self, path):
-        cur_dataset = torch.load(path)
+        cur_dataset = load_dataset(path)
         # logger.info('Loading dataset from %s, number of examples: %d' %
         #             (path, len(cur_dataset)))
+        if isinstance(cur_dataset, CompactDataset):
+            cur_iter = CompactIterator(
+                dataset=cur_dataset,
+                fields=self.fields,
+                batch_size=self.batch_size,
+                batch_size_fn=self.compact_batch_size_fn,
+                batch_size_multiple=self.batch_size_multiple,
+                device=self.device,
+                train=self.is_train,
+                repeat=False
+            )
+            for batch in cur_iter:
+                yield batch
+            del cur_dataset
+            gc.collect()
+            return
+
         cur_dataset.fields = self.fields
         cur_iter = OrderedIterator(
             dataset=cur_dataset,
@@ -605,26 +866,108 @@ class DatasetLazyMixerIter(object):
         fixed_shard_batches: number of batches from fixed shard, before moving to the next
         device: See :class:`OrderedIterator` ``device``.
         is_train (bool): train or valid?
+        compact_batch_size_fn: ``batch_size_fn`` of the
+            :class:`CompactIterator` of compact shards.
+        max_open_shards (int): maximum number of shards kept mapped in
+            memory, for :class:`CompactDataset` shards only. When
+            another one is needed, the mapped shard whose next turn in
+            the schedule comes last is unmapped: its iterator goes on
+            where it stopped, mapping its tensors again on the next
+            access. 0 keeps every shard mapped.
+        shard_levels (list[int]): level of each of ``dataset_paths``,
+            required by ``level_batches``.
+        level_batches (int): number of consecutive batches taken from
+            the shards of one level, i.e. trained by the same decoder,
+            before moving to the next level. Within a level, the shards
+            still take turns every ``fixed_shard_batches`` batches.
+            0 moves to the next shard every ``fixed_shard_batches``
+            batches, whatever its level.
+        mix_levels (bool): yield batches made of the next batch of
+            every level (see :func:`merge_batches()`), each level
+            moving to its next shard every ``fixed_shard_batches``
+            steps. Keeps at least one shard of each level open.
     """
 
     def __init__(self, dataset_paths, fields, batch_size, batch_size_fn,
                  batch_size_multiple, fixed_shard_batches, device, is_train, repeat=True,
-                 num_batches_multiple=1):
+                 num_batches_multiple=1, compact_batch_size_fn=None,
+                 max_open_shards=0, shard_levels=None, level_batches=0,
+                 mix_levels=False):
         self._paths = dataset_paths
         self.fields = fields
         self.batch_size = batch_size
         self.batch_size_fn = batch_size_fn
+        self.compact_batch_size_fn = compact_batch_size_fn
         self.batch_size_multiple = batch_size_multiple
         self.fixed_shard_batches = fixed_shard_batches
         self.device = device
         self.is_train = is_train
         self.repeat = repeat
         self.num_batches_multiple = num_batches_multiple
+        self.max_open_shards = max_open_shards
+        assert (level_batches == 0 and not mix_levels) \
+            or shard_levels is not None, \
+            "level_batches and mix_levels need the level of each shard"
+        self.shard_levels = shard_levels
+        self.level_batches = level_batches
+        self.mix_levels = mix_levels
+        if mix_levels and max_open_shards > 0:
+            self.max_open_shards = max(
+                max_open_shards, len(set(shard_levels)))
+
+    def _level_paths(self):
+        level_paths = OrderedDict()
+        for path, level in zip(self._paths, self.shard_levels):
+            level_paths.setdefault(level, []).append(path)
+        return level_paths
+
+    def _schedule(self):
+        """Yield forever the next shard to take batches from, and how
+        many."""
+        if self.level_batches <= 0:
+            for path in cycle(self._paths):
+                yield path, self.fixed_shard_batches
+            return
+        level_paths = [cycle(paths)
+                       for paths in self._level_paths().values()]
+        for paths in cycle(level_paths):
+            remaining = self.level_batches
+            while remaining > 0:
+                n_batches = min(self.fixed_shard_batches, remaining)
+                yield next(paths), n_batches
+                remaining -= n_batches
+
+    def _mixed_schedule(self):
+        """Yield forever the shards of every level to take the next
+        batch from."""
+        level_paths = [
+            chain.from_iterable(
+                repeat(path, self.fixed_shard_batches)
+                for path in cycle(paths))
+            for paths in self._level_paths().values()]
+        return zip(*level_paths)
 
     def _load_iterator(self, path, repeat):
-        dataset = torch.load(path)
+        dataset = load_dataset(path)
         # logger.info('Loading dataset from %s, number of examples: %d' %
         #             (path, len(cur_dataset)))
+        if self.max_open_shards > 0 and \
+                not isinstance(dataset, CompactDataset):
+            raise ValueError(
+                "-max_open_shards needs shards preprocessed with "
+                "-shard_format compact, %s is not" % path)
+        if isinstance(dataset, CompactDataset):
+            return CompactIterator(
+                dataset=dataset,
+                fields=self.fields,
+                batch_size=self.batch_size,
+                batch_size_fn=self.compact_batch_size_fn,
+                batch_size_multiple=self.batch_size_multiple,
+                device=self.device,
+                train=self.is_train,
+                repeat=repeat
+            )
+
         dataset.fields = self.fields
         cur_iter = OrderedIterator(
             dataset=dataset,
@@ -638,16 +981,145 @@ class DatasetLazyMixerIter(object):
             repeat=repeat
         )
 
-        return iter(cur_iter)
+        return cur_iter
+
+    @staticmethod
+    def _furthest_used(open_shards, upcoming):
+        """The open shard whose next use in ``upcoming``, the paths of the
+        next turns of the schedule, comes last."""
+        unseen = set(open_shards)
+        upcoming = iter(upcoming)
+        while len(unseen) > 1:
+            unseen.discard(next(upcoming))
+        return unseen.pop()
+
+    def _next_batch(self, path, shards, mapped, upcoming):
+        if path not in shards:
+            cur_iter = self._load_iterator(path, self.repeat)
+            shards[path] = (cur_iter, iter(cur_iter))
+        if path not in mapped:
+            if len(mapped) >= self.max_open_shards > 0:
+                unmapped = self._furthest_used(mapped, upcoming)
+                mapped.discard(unmapped)
+                shards[unmapped][0].dataset.unmap()
+            mapped.add(path)
+        return next(shards[path][1])
 
     def __iter__(self):
-        paths = self._paths
-        iterators = [self._load_iterator(path, self.repeat) for path in paths]
-        cycle_iterators = cycle(iterators)
-        for iterator in cycle_iterators:
-            for _ in range(self.fixed_shard_batches):
-                batch = next(iterator)
-                yield batch
+        # path -> (iterator, batch generator)
+        shards = {}
+        # the shards whose tensors may be mapped
+        mapped = set()
+        # the schedules are endless, ``ahead`` is a copy of what follows
+        # the current turn to pick the shard to unmap
+        if self.mix_levels:
+            schedule = self._mixed_schedule()
+            while True:
+                paths = next(schedule)
+                schedule, ahead = tee(schedule)
+                yield merge_batches(
+                    [self._next_batch(
+                        path, shards, mapped,
+                        chain(paths[i + 1:], chain.from_iterable(copy(ahead))))
+                     for i, path in enumerate(paths)],
+                    self.fields)
+        schedule = self._schedule()
+        while True:
+            path, n_batches = next(schedule)
+            schedule, ahead = tee(schedule)
+            for _ in range(n_batches):
+                yield self._next_batch(
+                    path, shards, mapped,
+                    (next_path for next_path, _ in ahead))
+
+
+class BatchPrefetcher(object):
+    """Build the next batches of an iterator on a background thread.
+
+    While the training step runs, a daemon thread keeps up to
+    ``num_batches`` batches ready: it sorts, pads and numericalizes them
+    and, for a cuda ``device``, copies them to the GPU through pinned
+    memory. Each call to ``__iter__`` starts a new pass over ``iterable``,
+    so the same prefetcher can serve repeated validations.
+
+    Args:
+        iterable: batch iterable (e.g. :class:`DatasetLazyMixerIter`)
+            building its batches on the cpu.
+        num_batches (int): number of batches prepared ahead.
+        device (str or torch.device): device of the yielded batches.
+    """
+
+    _END = object()
+
+    def __init__(self, iterable, num_batches, device="cpu"):
+        self.iterable = iterable
+        self.num_batches = num_batches
+        self.device = torch.device(device)
+        if self.device.type == "cuda" and self.device.index is None:
+            # the producer thread does not share the current device
+            self.device = torch.device("cuda", torch.cuda.current_device())
+
+    def _move(self, tensor):
+        return tensor.pin_memory().to(self.device, non_blocking=True)
+
+    def _to_device(self, batch):
+        if self.device.type == "cpu":
+            return batch
+        for name in batch.fields:
+            value = getattr(batch, name, None)
+            if isinstance(value, tuple):
+                value = tuple(self._move(v) for v in value)
+            elif torch.is_tensor(value):
+                value = self._move(value)
+            else:
+                continue
+            setattr(batch, name, value)
+        # batches mixing levels, see merge_batches()
+        level_index = getattr(batch, "level_index", None)
+        if level_index is not None:
+            batch.level_index = OrderedDict(
+                (level, self._move(index))
+                for level, index in level_index.items())
+        return batch
+
+    @staticmethod
+    def _put(batches, item, stop):
+        """Put ``item`` in ``batches`` unless ``stop`` is set first, and
+        return whether it was put."""
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self, batches, stop):
+        try:
+            for batch in self.iterable:
+                if not self._put(batches, self._to_device(batch), stop):
+                    return
+        except Exception as e:
+            self._put(batches, e, stop)
+            return
+        self._put(batches, self._END, stop)
+
+    def __iter__(self):
+        batches = queue.Queue(self.num_batches)
+        stop = threading.Event()
+        producer = threading.Thread(
+            target=self._produce, args=(batches, stop), daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = batches.get()
+                if item is self._END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
 
 
 def max_tok_len(new, count, sofar):
@@ -656,6 +1128,13 @@ def max_tok_len(new, count, sofar):
     such that the total number of src/tgt tokens (including padding)
     in a batch <= batch_size
     """
+    return max_tok_len_of_lengths(
+        len(new.src[0]), len(new.tgt[0]), count, sofar)
+
+
+def max_tok_len_of_lengths(src_len, tgt_len, count, sofar):
+    """:func:`max_tok_len()` given the src and tgt lengths of the new
+    example, as used by :class:`CompactIterator`."""
     # Maintains the longest src and tgt length in the current batch
     global max_src_in_batch, max_tgt_in_batch  # this is a hack
     # Reset current longest length at a new batch (count=1)
@@ -663,9 +1142,9 @@ def max_tok_len(new, count, sofar):
         max_src_in_batch = 0
         max_tgt_in_batch = 0
     # Src: [<bos> w1 ... wN <eos>]
-    max_src_in_batch = max(max_src_in_batch, len(new.src[0]) + 2)
+    max_src_in_batch = max(max_src_in_batch, src_len + 2)
     # Tgt: [w1 ... wM <eos>]
-    max_tgt_in_batch = max(max_tgt_in_batch, len(new.tgt[0]) + 1)
+    max_tgt_in_batch = max(max_tgt_in_batch, tgt_len + 1)
     src_elements = count * max_src_in_batch
     tgt_elements = count * max_tgt_in_batch
     return max(src_elements, tgt_elements)
@@ -681,30 +1160,47 @@ def build_dataset_iter(corpus_type, fields, opt, is_train=True):
         glob.glob(opt.data + '.' + corpus_type + '*.pt')))
     if not dataset_paths:
         return None
+    # shards are saved as <data>.<corpus_type>.<level>[.<shard>].pt
+    prefix_len = len(opt.data + '.' + corpus_type + '.')
+    shard_levels = [int(path[prefix_len:].split('.')[0])
+                    for path in dataset_paths]
     batch_size = opt.batch_size if is_train else opt.valid_batch_size
     batch_fn = max_tok_len if is_train and opt.batch_type == "tokens" else None
+    compact_batch_fn = max_tok_len_of_lengths \
+        if is_train and opt.batch_type == "tokens" else None
     batch_size_multiple = 8 if opt.model_dtype == "fp16" else 1
 
     device = "cuda" if opt.gpu_ranks else "cpu"
+    # with prefetching, batches are moved to the gpu by the prefetcher
+    data_device = "cpu" if opt.prefetch_batches > 0 else device
 
-    return DatasetLazyMixerIter(
+    data_iter = DatasetLazyMixerIter(
         dataset_paths,
         fields,
         batch_size,
         batch_fn,
         batch_size_multiple,
         opt.fixed_shard_batches,
-        device,
+        data_device,
         is_train,
         repeat=not opt.single_pass,
-        num_batches_multiple=opt.accum_count * opt.world_size) \
+        num_batches_multiple=opt.accum_count * opt.world_size,
+        compact_batch_size_fn=compact_batch_fn,
+        max_open_shards=opt.max_open_shards,
+        shard_levels=shard_levels,
+        level_batches=opt.level_batches,
+        mix_levels=opt.mix_levels) \
         if is_train else DatasetLazyIter(
         dataset_paths,
         fields,
         batch_size,
         batch_fn,
         batch_size_multiple,
-        device,
+        data_device,
         is_train,
         repeat=not opt.single_pass,
-        num_batches_multiple=opt.accum_count * opt.world_size)
+        num_batches_multiple=opt.accum_count * opt.world_size,
+        compact_batch_size_fn=compact_batch_fn)
+    if opt.prefetch_batches > 0:
+        return BatchPrefetcher(data_iter, opt.prefetch_batches, device)
+    return data_iter
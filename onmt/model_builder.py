@@ -3,6 +3,10 @@ This file is for models creation, which consults options
 and creates each encoder and decoder accordingly.
 """
 import re
+import threading
+from contextlib import contextmanager
+from itertools import chain
+
 import torch
 import torch.nn as nn
 from torch.nn.init import xavier_uniform_
@@ -15,6 +19,8 @@ from onmt.decoders import str2dec
 
 from onmt.modules import Embeddings, CopyGenerator
 from onmt.modules.util_class import Cast
+from onmt.models.inference_checkpoint import is_inference_checkpoint, \
+    load_inference_checkpoint
 from onmt.utils.misc import use_gpu
 from onmt.utils.logging import logger
 from onmt.utils.parse import ArgumentParser
@@ -82,6 +88,97 @@ def build_decoders(model_opt, tgt_emb):
     return nn.ModuleDict([[str(level), build_decoder(model_opt, tgt_emb)] for level in model_opt.levels])
 
 
+def fix_key(s):
+    """Rename the keys of models using customed layernorm."""
+    s = re.sub(r'(.*)\.layer_norm((_\d+)?)\.b_2',
+               r'\1.layer_norm\2.bias', s)
+    s = re.sub(r'(.*)\.layer_norm((_\d+)?)\.a_2',
+               r'\1.layer_norm\2.weight', s)
+    return s
+
+
+def fix_state_dict(state_dict, model_opt):
+    """Make the model state dict of a training checkpoint loadable in
+    the current model."""
+    # This preserves backward-compat for models using customed layernorm
+    state_dict = {fix_key(k): v for k, v in state_dict.items()}
+    # end of patch for backward compatibility
+
+    if model_opt.model_architecture == "encoder_multi_decoders":
+        # _nmt_model.decoder aliases the decoder of the last trained
+        # level, loading it would overwrite the first level decoder
+        state_dict = {k: v for k, v in state_dict.items()
+                      if not k.startswith('_nmt_model.decoder.')}
+    return state_dict
+
+
+def assign_state_dict(module, state_dict):
+    """Make the parameters and buffers of `module` the tensors of
+    `state_dict` rather than copying them, keys matching no parameter
+    are ignored.
+
+    Raises:
+        ValueError: if a parameter or buffer of `module` is not in
+            `state_dict`, it would keep uninitialized memory.
+    """
+    modules = dict(module.named_modules())
+    assigned = set()
+    for key, tensor in state_dict.items():
+        prefix, _, name = key.rpartition('.')
+        owner = modules.get(prefix)
+        if owner is None:
+            continue
+        if name in owner._parameters:
+            owner._parameters[name] = nn.Parameter(
+                tensor, requires_grad=False)
+        elif name in owner._buffers:
+            owner._buffers[name] = tensor
+        else:
+            continue
+        # modules may be reachable under several names
+        assigned.add((id(owner), name))
+    missing = [
+        prefix + ('.' if prefix else '') + name
+        for prefix, owner in modules.items()
+        for name, tensor in chain(owner._parameters.items(),
+                                  owner._buffers.items())
+        if tensor is not None and (id(owner), name) not in assigned]
+    if missing:
+        raise ValueError("Weights missing from the checkpoint: %s"
+                         % ", ".join(missing))
+
+
+# skip_init() patches torch.nn.init for the whole process
+_init_lock = threading.Lock()
+
+
+@contextmanager
+def skip_init(skip=True):
+    """Turn the :mod:`torch.nn.init` functions into no-ops, for models
+    whose weights are all replaced once built.
+
+    As the functions are patched for every thread, this holds a lock
+    that the models built concurrently with their initialization must
+    take too, by building them in ``skip_init(False)``.
+    """
+    with _init_lock:
+        if not skip:
+            yield
+            return
+        names = ["uniform_", "normal_", "constant_", "ones_", "zeros_",
+                 "xavier_uniform_", "xavier_normal_", "kaiming_uniform_",
+                 "kaiming_normal_", "orthogonal_"]
+        saved = {name: getattr(torch.nn.init, name) for name in names}
+        for name in names:
+            setattr(torch.nn.init, name,
+                    lambda tensor, *args, **kwargs: tensor)
+        try:
+            yield
+        finally:
+            for name, func in saved.items():
+                setattr(torch.nn.init, name, func)
+
+
 def load_test_model(opt, model_path=None):
     if model_path is None:
         model_path = opt.models[0]
@@ -91,6 +188,24 @@ def load_test_model(opt, model_path=None):
     model_opt = ArgumentParser.ckpt_model_opts(checkpoint['opt'])
     ArgumentParser.update_model_opts(model_opt)
     ArgumentParser.validate_model_opts(model_opt)
+
+    levels = getattr(opt, 'levels', None)
+    if levels and \
+            model_opt.model_architecture == "encoder_multi_decoders":
+        missing = set(levels) - set(model_opt.levels)
+        if missing:
+            raise ValueError("No decoder for levels %s in %s" % (
+                " ".join(str(level) for level in sorted(missing)),
+                model_path))
+        # only build the decoders of the requested levels
+        model_opt.levels = [level for level in model_opt.levels
+                            if level in levels]
+    if is_inference_checkpoint(checkpoint):
+        kept = set(str(level) for level in model_opt.levels)
+        checkpoint = load_inference_checkpoint(
+            checkpoint, model_path,
+            keep=lambda k: not k.startswith('decoders.')
+            or k.split('.')[1] in kept)
     vocab = checkpoint['vocab']
     if inputters.old_style_vocab(vocab):
         fields = inputters.load_old_vocab(
@@ -99,8 +214,11 @@ def load_test_model(opt, model_path=None):
     else:
         fields = vocab
 
-    model = build_base_model(model_opt, fields, use_gpu(opt), checkpoint,
-                             opt.gpu)
+    # every weight of an inference checkpoint is in it, don't initialize
+    # them
+    with skip_init(is_inference_checkpoint(checkpoint)):
+        model = build_base_model(model_opt, fields, use_gpu(opt),
+                                 checkpoint, opt.gpu)
     if opt.fp32:
         model.float()
     model.eval()
@@ -177,19 +295,12 @@ def build_base_model(model_opt, fields, gpu, checkpoint=None, gpu_id=None):
         generator = CopyGenerator(model_opt.dec_rnn_size, vocab_size, pad_idx)
 
     # Load the model states from checkpoint or initialize them.
-    if checkpoint is not None:
-        # This preserves backward-compat for models using customed layernorm
-        def fix_key(s):
-            s = re.sub(r'(.*)\.layer_norm((_\d+)?)\.b_2',
-                       r'\1.layer_norm\2.bias', s)
-            s = re.sub(r'(.*)\.layer_norm((_\d+)?)\.a_2',
-                       r'\1.layer_norm\2.weight', s)
-            return s
-
-        checkpoint['model'] = {fix_key(k): v
-                               for k, v in checkpoint['model'].items()}
-        # end of patch for backward compatibility
-
+    if checkpoint is not None and is_inference_checkpoint(checkpoint):
+        # keys were fixed on export, the mapped weights are not copied
+        assign_state_dict(model, checkpoint['model'])
+        assign_state_dict(generator, checkpoint['generator'])
+    elif checkpoint is not None:
+        checkpoint['model'] = fix_state_dict(checkpoint['model'], model_opt)
         model.load_state_dict(checkpoint['model'], strict=False)
         generator.load_state_dict(checkpoint['generator'], strict=False)
     else:
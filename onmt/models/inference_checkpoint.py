@@ -0,0 +1,117 @@
+"""Checkpoint format for translation only.
+
+An inference checkpoint is made of two files: ``<path>``, a small
+:func:`torch.save` header holding the options, the vocab and the index of
+the weights, and ``<path>.bin`` holding the raw weights. The optimizer
+state is not kept. Loading maps ``<path>.bin`` in memory instead of
+reading it, so only the weights a model actually uses are read from
+disk.
+"""
+import os
+
+import torch
+
+INFERENCE_FORMAT = "onmt-inference"
+
+# offsets of the weights are multiples of this, so that a weight of any
+# type can be mapped from the data file
+_ALIGNMENT = 64
+
+_STORAGES = {
+    torch.float64: torch.DoubleStorage,
+    torch.float32: torch.FloatStorage,
+    torch.float16: torch.HalfStorage,
+    torch.int64: torch.LongStorage,
+    torch.int32: torch.IntStorage,
+    torch.int16: torch.ShortStorage,
+    torch.int8: torch.CharStorage,
+    torch.uint8: torch.ByteStorage,
+}
+_DTYPES = {str(dtype): dtype for dtype in _STORAGES}
+
+
+def is_inference_checkpoint(checkpoint):
+    return checkpoint.get("format") == INFERENCE_FORMAT
+
+
+def data_path(path):
+    return path + ".bin"
+
+
+def save_inference_checkpoint(checkpoint, path):
+    """Save the ``model`` and ``generator`` state dicts, ``vocab`` and
+    ``opt`` of `checkpoint` as an inference checkpoint at `path`.
+
+    Weights shared by several keys are saved once.
+    """
+    index = {}
+    offsets = {}
+    offset = 0
+    with open(data_path(path), "wb") as f:
+        for part in ["model", "generator"]:
+            index[part] = []
+            for key, tensor in checkpoint[part].items():
+                # `checkpoint` keeps the tensor, and so its address, alive
+                shared_key = (tensor.device, tensor.data_ptr(), tensor.dtype,
+                              tuple(tensor.size()), tensor.stride())
+                tensor = tensor.detach().cpu().contiguous()
+                if shared_key not in offsets:
+                    padding = -offset % _ALIGNMENT
+                    f.write(b"\0" * padding)
+                    offset += padding
+                    offsets[shared_key] = offset
+                    data = tensor.numpy().tobytes()
+                    f.write(data)
+                    offset += len(data)
+                index[part].append((key, str(tensor.dtype),
+                                    tuple(tensor.size()),
+                                    offsets[shared_key]))
+    header = {"format": INFERENCE_FORMAT,
+              "vocab": checkpoint["vocab"],
+              "opt": checkpoint["opt"],
+              "index": index,
+              "nbytes": offset}
+    torch.save(header, path)
+
+
+def load_inference_checkpoint(header, path, keep=None):
+    """Map the weights of the inference checkpoint `path` in memory.
+
+    Args:
+        header (dict): the header of `path`, as loaded by
+            :func:`torch.load`.
+        path (str): path of the checkpoint.
+        keep (callable or NoneType): predicate on the keys of the model
+            state dict, the weights it rejects are left out.
+
+    Returns:
+        a checkpoint dict with ``model`` and ``generator`` state dicts
+        whose tensors are backed by the mapped data file.
+    """
+    storages = {}
+
+    def storage(dtype):
+        if dtype not in storages:
+            element_size = torch.tensor([], dtype=dtype).element_size()
+            storages[dtype] = _STORAGES[dtype].from_file(
+                data_path(path), False,
+                os.path.getsize(data_path(path)) // element_size)
+        return storages[dtype]
+
+    checkpoint = {"format": INFERENCE_FORMAT,
+                  "vocab": header["vocab"],
+                  "opt": header["opt"]}
+    for part, entries in header["index"].items():
+        state_dict = {}
+        for key, dtype, size, offset in entries:
+            if part == "model" and keep is not None and not keep(key):
+                continue
+            dtype = _DTYPES[dtype]
+            tensor = torch.empty(size, dtype=dtype)
+            if tensor.nelement() > 0:
+                tensor.set_(storage(dtype),
+                            offset // tensor.element_size(),
+                            torch.Size(size))
+            state_dict[key] = tensor
+        checkpoint[part] = state_dict
+    return checkpoint
@@ -3,11 +3,21 @@ from onmt.models import NMTModel
 
 
 def _get_level(levels):
+    if isinstance(levels, int):
+        # level attached to the batch by the iterator, no device sync
+        return levels
     levels_list = levels.tolist()
     assert (len(set(levels_list)) == 1)  # assert all examples in the same level
     return levels_list[0]
 
 
+def _select(value, index):
+    """Select the batch entries ``index`` of an encoder output."""
+    if isinstance(value, tuple):
+        return tuple(_select(v, index) for v in value)
+    return value.index_select(1, index)
+
+
 class MultiDecodersNMTModel(nn.Module):
     def __init__(self, encoder, decoders):
         super(MultiDecodersNMTModel, self).__init__()
@@ -24,7 +34,40 @@ class MultiDecodersNMTModel(nn.Module):
         self._nmt_model.decoder = self.decoders[str(level)]
 
     def forward(self, src, tgt, levels, lengths, bptt=False):
-        level = _get_level(levels)
-        self._nmt_model.decoder = self.decoders[str(level)]
+        """``levels`` is either the level of the whole batch (int, see
+        ``batch.level``), the ``level_index`` of a batch mixing several
+        levels (see :func:`onmt.inputters.inputter.merge_batches()`) or
+        the ``levels`` tensor of the batch."""
+        if isinstance(levels, dict):
+            return self._forward_levels(src, tgt, levels, lengths, bptt)
+        self.set_level(_get_level(levels))
 
         return self._nmt_model(src, tgt, lengths, bptt)
+
+    def _forward_levels(self, src, tgt, level_index, lengths, bptt=False):
+        """Run the encoder once over the whole batch, then the decoder of
+        each level over the sentences of that level, and scatter their
+        outputs back to the batch order."""
+        tgt = tgt[:-1]  # exclude last target from inputs
+
+        enc_state, memory_bank, lengths = self.encoder()(src, lengths)
+        dec_out, attns = None, {}
+        for level, index in level_index.items():
+            decoder = self.decoders[str(level)]
+            level_memory_bank = _select(memory_bank, index)
+            if bptt is False:
+                decoder.init_state(_select(src, index), level_memory_bank,
+                                   _select(enc_state, index))
+            level_out, level_attns = decoder(
+                _select(tgt, index), level_memory_bank,
+                memory_lengths=lengths.index_select(0, index))
+            if dec_out is None:
+                dec_out = level_out.new_zeros(
+                    level_out.size(0), tgt.size(1), level_out.size(2))
+            dec_out = dec_out.index_copy(1, index, level_out)
+            for k, attn in level_attns.items():
+                if k not in attns:
+                    attns[k] = attn.new_zeros(
+                        attn.size(0), tgt.size(1), attn.size(2))
+                attns[k] = attns[k].index_copy(1, index, attn)
+        return dec_out, attns
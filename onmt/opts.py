@@ -231,6 +231,18 @@ def preprocess_opts(parser):
                    "shard_size=0 means no segmentation "
                    "shard_size>0 means segment dataset into multiple shards, "
                    "each shard has shard_size samples")
+    group.add('--shard_format', '-shard_format', default="examples",
+              choices=["examples", "compact"],
+              help="Format of the saved shards. 'examples' pickles the "
+                   "torchtext examples; 'compact' stores the token ids "
+                   "in flat int32 tensors that are memory-mapped at "
+                   "training time (text data without -dynamic_dict "
+                   "only).")
+    group.add('--split_line_index', '-split_line_index',
+              action='store_true',
+              help="When splitting each level into train / valid / test, "
+                   "also write a .idx file of int64 line byte offsets "
+                   "next to every split file.")
 
     # Dictionary options, for text corpus
 
@@ -278,6 +290,12 @@ def preprocess_opts(parser):
     group.add('--filter_valid', '-filter_valid', action='store_true',
               help='Filter validation data by src and/or tgt length')
 
+    group = parser.add_argument_group('Efficiency')
+    group.add('--num_workers', '-num_workers', type=int, default=1,
+              help="Number of processes used to split the levels and "
+                   "to build their shards in parallel. Each worker holds "
+                   "one shard in memory. 1 processes them sequentially.")
+
     # Data processing options
     group = parser.add_argument_group('Random')
     group.add('--shuffle', '-shuffle', type=int, default=0,
@@ -394,6 +412,30 @@ def train_opts(parser):
               help='Maximum batch size for training')
     group.add('--fixed_shard_batches', '-fixed_shard_batches', type=int, default=10,
               help='Number of batches from fixed shard, before moving to the next. Used only in DatasetLazyMixerIter.')
+    group.add('--level_batches', '-level_batches', type=int, default=0,
+              help="Number of consecutive batches taken from the shards "
+                   "of one level (i.e. trained by the same decoder) before "
+                   "moving to the next level. Shards of that level still "
+                   "take turns every -fixed_shard_batches. A multiple of "
+                   "-accum_count makes every update go through a single "
+                   "decoder. 0 moves to the next shard every "
+                   "-fixed_shard_batches batches, whatever its level.")
+    group.add('--mix_levels', '-mix_levels', action='store_true',
+              help="Make every training batch of one batch of each "
+                   "level: the encoder runs once over the whole batch and "
+                   "the decoder of each level over its sentences. "
+                   "-batch_size is then per level. Text data only.")
+    group.add('--prefetch_batches', '-prefetch_batches', type=int, default=0,
+              help="Number of batches built ahead on a background thread "
+                   "(and copied to the GPU through pinned memory) while "
+                   "the current step runs. 0 builds them in the training "
+                   "loop.")
+    group.add('--max_open_shards', '-max_open_shards', type=int, default=0,
+              help="Maximum number of training shards kept mapped in "
+                   "memory while mixing them, for shards preprocessed "
+                   "with -shard_format compact. The mapped shard needed "
+                   "again the latest is unmapped, and mapped again when "
+                   "its turn comes. 0 keeps all shards mapped.")
     group.add('--batch_type', '-batch_type', default='sents',
               choices=["sents", "tokens"],
               help="Batch grouping for batch_size. Standard "
@@ -566,6 +608,19 @@ def translate_opts(parser):
               help='Source directory for image or audio files')
     group.add('--tgt', '-tgt',
               help='True target sequence (optional)')
+    group.add('--shared_src', '-shared_src', action='store_true',
+              help="Translate the same source file -src (without level "
+                   "suffix) to all the -levels in a single pass: each "
+                   "batch is encoded once and decoded by every level's "
+                   "decoder. -tgt is not used.")
+    group.add('--stream', '-stream', action='store_true',
+              help="Translate -src window by window, writing the "
+                   "predictions of each window in input order, so that "
+                   "memory does not grow with the input. -src - reads "
+                   "stdin. -tgt is not used.")
+    group.add('--stream_window', '-stream_window', type=int, default=10000,
+              help="Number of source lines read at a time with -stream, "
+                   "they are sorted by length to be batched.")
     group.add('--shard_size', '-shard_size', type=int, default=10000,
               help="Divide src and tgt (if applicable) into "
                    "smaller multiple src and tgt files, then "
@@ -622,6 +677,11 @@ def translate_opts(parser):
     group.add('--coverage_penalty', '-coverage_penalty', default='none',
               choices=['none', 'wu', 'summary'],
               help="Coverage Penalty to use.")
+    group.add('--early_stopping', '-early_stopping', action='store_true',
+              help="Finish a sentence as soon as none of its live beams "
+                   "can beat its n_best finished hypotheses under the "
+                   "length penalty. The translations are unchanged. "
+                   "Not supported with a coverage penalty.")
     group.add('--alpha', '-alpha', type=float, default=0.,
               help="Google NMT length penalty parameter "
                    "(higher = longer generation)")
@@ -665,6 +725,14 @@ def translate_opts(parser):
     group = parser.add_argument_group('Efficiency')
     group.add('--batch_size', '-batch_size', type=int, default=30,
               help='Batch size')
+    group.add('--continuous_batching', '-continuous_batching',
+              action="store_true",
+              help="Beam search only: decode at most batch_size "
+                   "sentences at once, starting the next sentences as "
+                   "soon as others finish rather than batch by batch. "
+                   "Only supported by RNN decoders without copy or "
+                   "coverage attention, and without -early_stopping, "
+                   "batches are translated as usual otherwise.")
     group.add('--gpu', '-gpu', type=int, default=-1,
               help="Device to run on")
 
@@ -699,24 +767,30 @@ def evaluate_opts(parser):
     group.add('--pred', '-pred',
               help='Predicted sequence')
     group.add('--report_rouge', '-report_rouge', action='store_true',
-              help="Report rouge 1/2/3/L/SU4 score after translation "
-                   "call tools/test_rouge.py on command line")
+              help="Report rouge 1/2/3/L/SU4 score after translation, "
+                   "computed in-process with tools/test_rouge.py")
     group.add('--report_bleu', '-report_bleu', action='store_true',
               help="Report bleu score after translation, "
-                   "call tools/multi-bleu.perl on command line")
+                   "computed in-process as in tools/multi-bleu.perl")
     group.add('--report_sari', '-report_sari', action='store_true',
               help="Report sari score after translation, "
-                   "call tools/sari.py on command line")
+                   "computed in-process as in tools/sari.py")
     group.add('--report_flesch_reading_ease', '-report_flesch_reading_ease', action='store_true',
               help="Report Flesch reading ease after translation, "
-                   "call tools/readability/readability.py on command line")
+                   "computed in-process with tools/readability")
     group.add('--report_flesch_kincaid_grade_level', '-report_flesch_kincaid_grade_level', action='store_true',
               help="Report Flesch-Kincaid grade level after translation, "
-                   "call tools/readability/readability.py on command line")
+                   "computed in-process with tools/readability")
     group.add('--output', '-output',
               help="Path to output the predictions (each line will "
                    "be the decoded sequence")
 
+    group = parser.add_argument_group('Efficiency')
+    group.add('--eval_workers', '-eval_workers', type=int, default=0,
+              help="Number of processes scoring the levels in parallel. "
+                   "0 uses one process per CPU, 1 scores the levels "
+                   "sequentially in the main process.")
+
     group = parser.add_argument_group('Logging')
     group.add('--verbose', '-verbose', action="store_true",
               help='Print scores and predictions for each sentence')
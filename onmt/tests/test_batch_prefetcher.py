@@ -0,0 +1,94 @@
+import queue
+import threading
+import unittest
+from collections import OrderedDict
+
+import torch
+from torchtext.data import Batch
+
+from onmt.inputters.inputter import BatchPrefetcher
+
+
+def make_batches(n):
+    for i in range(n):
+        batch = Batch()
+        batch.fields = ["src", "tgt"]
+        batch.src = (torch.full((3, 2, 1), i), torch.LongTensor([3, 3]))
+        batch.tgt = torch.full((4, 2, 1), i)
+        yield batch
+
+
+class Batches(object):
+    def __init__(self, n, make=make_batches):
+        self.n = n
+        self.make = make
+
+    def __iter__(self):
+        return self.make(self.n)
+
+
+def make_merged_batches(n):
+    # as built by merge_batches() for sentences of levels 1 and 2
+    for batch in make_batches(n):
+        batch.level = None
+        batch.level_index = OrderedDict(
+            [(1, torch.LongTensor([1])), (2, torch.LongTensor([0]))])
+        yield batch
+
+
+class Failing(object):
+    def __iter__(self):
+        yield next(make_batches(1))
+        raise ValueError("broken shard")
+
+
+def make_no_batches(n):
+    raise ValueError("broken shard")
+    yield
+
+
+class TestBatchPrefetcher(unittest.TestCase):
+    def test_yields_batches_in_order(self):
+        prefetcher = BatchPrefetcher(Batches(20), 3)
+        values = [int(b.tgt[0, 0, 0]) for b in prefetcher]
+        self.assertEqual(values, list(range(20)))
+
+    def test_can_be_iterated_again_after_break(self):
+        prefetcher = BatchPrefetcher(Batches(20), 2)
+        for i, _ in enumerate(prefetcher):
+            if i == 4:
+                break
+        values = [int(b.src[0][0, 0, 0]) for b in prefetcher]
+        self.assertEqual(values, list(range(20)))
+
+    def test_propagates_producer_errors(self):
+        batches = iter(BatchPrefetcher(Failing(), 2))
+        next(batches)
+        with self.assertRaises(ValueError):
+            next(batches)
+
+    def test_producer_ends_when_the_consumer_stopped(self):
+        # the consumer stopped with a full queue
+        batches = queue.Queue(1)
+        batches.put(None)
+        stop = threading.Event()
+        stop.set()
+        for iterable in [Batches(0), Batches(1, make_no_batches)]:
+            prefetcher = BatchPrefetcher(iterable, 1)
+            producer = threading.Thread(
+                target=prefetcher._produce, args=(batches, stop),
+                daemon=True)
+            producer.start()
+            producer.join(5)
+            self.assertFalse(producer.is_alive())
+
+    if torch.cuda.is_available():
+        def test_moves_merged_batches_to_the_device(self):
+            prefetcher = BatchPrefetcher(
+                Batches(4, make_merged_batches), 2, "cuda")
+            for batch in prefetcher:
+                self.assertEqual(batch.src[0].device, prefetcher.device)
+                self.assertEqual(batch.tgt.device, prefetcher.device)
+                self.assertEqual(list(batch.level_index), [1, 2])
+                for index in batch.level_index.values():
+                    self.assertEqual(index.device, prefetcher.device)
@@ -158,6 +158,68 @@ class TestBeamSearch(unittest.TestCase):
                             torch.tensor(self.BLOCKED_SCORE)
                             .repeat(batch_sz, beam_sz - 2)))
 
+    def test_repeated_ngram_follows_reordered_paths(self):
+        beam = BeamSearch(
+            2, 1, 0, 1, 2, 1,
+            torch.device("cpu"), GlobalScorerStub(), 0, 30,
+            False, 2, set(), torch.tensor([5]), False)
+        # path 0 repeats the bigram (3, 4), path 1 doesn't
+        beam.alive_seq = torch.tensor([[1, 3, 4, 3, 4], [1, 3, 4, 5, 6]])
+        word_probs = torch.zeros(2, 10)
+        beam.block_ngram_repeats(word_probs)
+        self.assertTrue(word_probs[0].eq(self.BLOCKED_SCORE).all())
+        self.assertFalse(word_probs[1].eq(self.BLOCKED_SCORE).any())
+        # swap the paths, the new last bigrams don't repeat
+        swap = torch.tensor([1, 0])
+        beam.alive_seq = torch.cat(
+            [beam.alive_seq.index_select(0, swap), torch.tensor([[7], [8]])],
+            -1)
+        beam.select_repeated_ngram(swap)
+        word_probs = torch.zeros(2, 10)
+        beam.block_ngram_repeats(word_probs)
+        self.assertFalse(word_probs[0].eq(self.BLOCKED_SCORE).any())
+        self.assertTrue(word_probs[1].eq(self.BLOCKED_SCORE).all())
+
+    def test_early_stopping_when_live_beams_cant_improve(self):
+        for early_stopping in [False, True]:
+            beam = BeamSearch(
+                2, 1, 0, 1, 2, 1,
+                torch.device("cpu"), GlobalScorerStub(), 0, 30,
+                False, 0, set(), torch.tensor([5]), False,
+                early_stopping=early_stopping)
+            # the top beam goes on, the second one finishes
+            word_probs = torch.full((2, 10), -float('inf'))
+            word_probs[0, 5] = -0.5
+            word_probs[0, 2] = -1.
+            beam.advance(word_probs, None)
+            beam.update_finished()
+            self.assertFalse(beam.done)
+            # the live beam falls below the finished hypothesis
+            word_probs = torch.full((2, 10), -float('inf'))
+            word_probs[0, 6] = -1.
+            beam.advance(word_probs, None)
+            if beam.is_finished.any():
+                beam.update_finished()
+            self.assertEqual(beam.done, early_stopping)
+            self.assertEqual(int(beam.n_stopped_early), int(early_stopping))
+        self.assertTrue(beam.predictions[0][0].equal(torch.tensor([2])))
+        self.assertAlmostEqual(float(beam.scores[0][0]), -1.)
+
+    def test_best_scores_of_missing_hypotheses_are_inf(self):
+        beam = BeamSearch(
+            3, 1, 0, 1, 2, 2,
+            torch.device("cpu"), GlobalScorerStub(), 0, 30,
+            False, 0, set(), torch.tensor([5]), False)
+        # a single beam finishes, between two live ones
+        word_probs = torch.full((3, 10), -float('inf'))
+        word_probs[0, 5] = -0.5
+        word_probs[0, 2] = -1.
+        word_probs[0, 6] = -2.
+        beam.advance(word_probs, None)
+        beam.update_finished()
+        self.assertFalse(beam.done)
+        self.assertEqual(beam.best_scores.tolist(), [[-1., -float('inf')]])
+
     def test_doesnt_predict_eos_if_shorter_than_min_len(self):
         # beam 0 will always predict EOS. The other beams will predict
         # non-eos scores.
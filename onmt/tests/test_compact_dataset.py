@@ -0,0 +1,156 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import torch
+
+import onmt.inputters as inputters
+from onmt.inputters.compact_dataset import data_path
+from onmt.inputters.inputter import OrderedIterator, CompactIterator, \
+    count_tokens, merge_batches, load_dataset
+
+
+SRC = [b"the cat sat on the mat", b"a dog", b"one two three four",
+       b"to be or not to be , that is it", b"hi"]
+TGT = [b"cat sat", b"a small dog barks", b"one", b"to be", b"hello there"]
+
+
+class TestCompactDataset(unittest.TestCase):
+    def build(self, n_feats=0, vocab_size=100, level=3, path=None):
+        fields = inputters.get_fields("text", n_feats, n_feats)
+        if n_feats:
+            src = [b" ".join(tok + u"￨X".encode("utf-8")
+                             for tok in line.split()) for line in SRC]
+            tgt = [b" ".join(tok + u"￨Y".encode("utf-8")
+                             for tok in line.split()) for line in TGT]
+        else:
+            src, tgt = SRC, TGT
+        reader = inputters.TextDataReader()
+        dataset = inputters.MultiLevelDataset(
+            fields, readers=[reader, reader],
+            data=[("src", src), ("tgt", tgt)], dirs=[None, None],
+            sort_key=inputters.str2sortkey["text"], level=level)
+        compact = inputters.CompactDataset.from_dataset(dataset, fields)
+        if path is not None:
+            compact.save(path)
+            compact = load_dataset(path)
+        # build the vocab after compacting, as preprocess.py does
+        inputters.build_vocab(
+            [], fields, "text", False, "", vocab_size, 1, "", vocab_size, 1,
+            dataset_counters=count_tokens(dataset, fields))
+        compact.numericalize(fields)
+        if path is not None:
+            # saved in place of the mapped shard
+            compact.save(path)
+            compact = load_dataset(path)
+        dataset.fields = fields
+        return dataset, compact, fields
+
+    def assert_same_batches(self, dataset, compact, fields, batch_size):
+        expected = [b for b in OrderedIterator(
+            dataset, batch_size, train=False, sort=False,
+            sort_within_batch=True, repeat=False, device="cpu")]
+        actual = [b for b in CompactIterator(
+            compact, fields, batch_size, train=False)]
+        self.assertEqual(len(expected), len(actual))
+        for exp, act in zip(expected, actual):
+            self.assertEqual(exp.batch_size, act.batch_size)
+            self.assertTrue(exp.src[0].equal(act.src[0]))
+            self.assertTrue(exp.src[1].equal(act.src[1]))
+            self.assertTrue(exp.tgt.equal(act.tgt))
+            self.assertTrue(exp.indices.equal(act.indices))
+            self.assertTrue(exp.levels.equal(act.levels))
+            self.assertEqual(exp.level, 3)
+            self.assertEqual(act.level, 3)
+
+    def test_batches_match_examples(self):
+        dataset, compact, fields = self.build()
+        self.assertEqual(len(compact), len(SRC))
+        self.assertEqual(compact.sides["src"]["ids"].dtype, torch.int32)
+        for batch_size in [1, 2, 5]:
+            self.assert_same_batches(dataset, compact, fields, batch_size)
+
+    def test_batches_match_examples_with_unknown_tokens(self):
+        dataset, compact, fields = self.build(vocab_size=3)
+        self.assert_same_batches(dataset, compact, fields, 5)
+
+    def test_batches_match_examples_with_feats(self):
+        dataset, compact, fields = self.build(n_feats=1)
+        self.assertEqual(compact.sides["src"]["ids"].size(1), 2)
+        self.assert_same_batches(dataset, compact, fields, 2)
+
+    def test_saved_batches_match_examples(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, "data.train.3.0.pt")
+            dataset, compact, fields = self.build(n_feats=1, path=path)
+            self.assertIsInstance(compact, inputters.CompactDataset)
+            self.assertIsNone(compact.vocabs)
+            self.assert_same_batches(dataset, compact, fields, 2)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    @unittest.skipUnless(os.path.exists("/proc/self/maps"),
+                         "needs the memory maps of the process")
+    def test_saved_tensors_are_mapped(self):
+        def mapped():
+            with open("/proc/self/maps") as f:
+                return os.path.realpath(data_path(path)) in f.read()
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, "data.train.3.0.pt")
+            dataset, compact, fields = self.build(path=path)
+            compact.unmap()
+            self.assertFalse(mapped())
+            batch = compact.batch([0, 1], fields)
+            self.assertTrue(mapped())
+            # the batch tensors are not backed by the data file
+            compact.unmap()
+            self.assertFalse(mapped())
+            self.assertTrue(batch.src[0].equal(
+                compact.batch([0, 1], fields).src[0]))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_train_batches_cover_dataset(self):
+        _, compact, fields = self.build()
+        indices = []
+        for batch in CompactIterator(compact, fields, 2, train=True):
+            lengths = batch.src[1]
+            self.assertTrue((lengths[:-1] >= lengths[1:]).all())
+            indices += batch.indices.tolist()
+        self.assertEqual(sorted(indices), list(range(len(SRC))))
+
+    def test_resume_from_state_dict(self):
+        _, compact, fields = self.build()
+        expected = CompactIterator(compact, fields, 1, train=True)
+        batches = iter(expected)
+        next(batches)
+        next(batches)
+        resumed = CompactIterator(compact, fields, 1, train=True)
+        resumed.load_state_dict(expected.state_dict())
+        for exp, act in zip(batches, resumed):
+            self.assertTrue(exp.indices.equal(act.indices))
+
+    def test_merge_batches_of_two_levels(self):
+        _, compact, fields = self.build()
+        other = inputters.CompactDataset(
+            4, compact.sides, compact.indices + 10)
+        batches = [compact.batch([0, 1], fields),
+                   other.batch([2, 3, 4], fields)]
+        merged = merge_batches(batches, fields)
+        self.assertIsNone(merged.level)
+        self.assertEqual(merged.batch_size, 5)
+        lengths = merged.src[1]
+        self.assertTrue((lengths[:-1] >= lengths[1:]).all())
+        self.assertEqual(list(merged.level_index), [3, 4])
+        for batch, index in zip(batches, merged.level_index.values()):
+            self.assertTrue(merged.indices[index].equal(batch.indices))
+            self.assertTrue(
+                merged.levels[index].eq(batch.level).all())
+            src = merged.src[0].index_select(1, index)
+            self.assertTrue(src[:batch.src[0].size(0)].equal(batch.src[0]))
+            tgt = merged.tgt.index_select(1, index)
+            self.assertTrue(tgt[:batch.tgt.size(0)].equal(batch.tgt))
@@ -0,0 +1,82 @@
+import unittest
+from onmt.translate.beam import GNMTGlobalScorer
+from onmt.translate.beam_search import BeamSearch
+from onmt.translate.continuous_beam_search import ContinuousBeamSearch
+
+import torch
+
+
+class TestContinuousBeamSearch(unittest.TestCase):
+    BEAM_SZ = 3
+    N_WORDS = 12
+    MAX_LENGTH = 8
+    PAD, BOS, EOS = 0, 1, 2
+
+    def setUp(self):
+        torch.manual_seed(1)
+        # log probs of each sentence given its step and last token, so
+        # that both searches see the same model whatever the rows
+        self.log_probs = torch.randn(
+            4, self.MAX_LENGTH + 1, self.N_WORDS, self.N_WORDS) \
+            .log_softmax(-1)
+        self.scorer = GNMTGlobalScorer(0.7, 0., "wu", "none")
+
+    def step_log_probs(self, sents, steps, predictions):
+        # one row per path, ``sents`` and ``steps`` are per path
+        return self.log_probs[sents, steps, predictions].clone()
+
+    def beam_search(self, sent):
+        beam = BeamSearch(
+            self.BEAM_SZ, 1, self.PAD, self.BOS, self.EOS, 2,
+            torch.device("cpu"), self.scorer, 1, self.MAX_LENGTH,
+            True, 2, set(), torch.tensor([5]), False)
+        for step in range(self.MAX_LENGTH):
+            attn = torch.randn(1, self.BEAM_SZ, 5)
+            beam.advance(self.step_log_probs(
+                torch.full([self.BEAM_SZ], sent, dtype=torch.long),
+                torch.full([self.BEAM_SZ], step, dtype=torch.long),
+                beam.current_predictions), attn)
+            if beam.is_finished.any():
+                beam.update_finished()
+                if beam.done:
+                    break
+        return beam.scores[0], beam.predictions[0]
+
+    def test_same_as_beam_search_with_late_sentences(self):
+        beam = ContinuousBeamSearch(
+            self.BEAM_SZ, self.PAD, self.BOS, self.EOS, 2,
+            torch.device("cpu"), self.scorer, 1, self.MAX_LENGTH,
+            True, 2, set())
+        beam.add([0, 1], torch.tensor([5, 4]))
+        started = {0: 0, 1: 0}
+        for step in range(4 * self.MAX_LENGTH):
+            if step == 2:
+                beam.add([2], torch.tensor([3]))
+                started[2] = step
+            if step == 5:
+                beam.add([3], torch.tensor([5]))
+                started[3] = step
+            if len(beam) == 0:
+                break
+            sents = torch.tensor(beam.sent_ids).repeat_interleave(
+                self.BEAM_SZ)
+            steps = torch.tensor([step - started[s] for s in
+                                  sents.tolist()])
+            attn = torch.randn(1, len(beam) * self.BEAM_SZ, 5)
+            beam.advance(self.step_log_probs(
+                sents, steps, beam.current_predictions), attn)
+            if beam.is_finished.any():
+                beam.update_finished()
+
+        self.assertEqual(sorted(beam.results), [0, 1, 2, 3])
+        for sent in range(4):
+            scores, predictions, attention = beam.results[sent]
+            expected_scores, expected_predictions = self.beam_search(sent)
+            self.assertEqual(len(predictions), 2)
+            for pred, attn, expected in zip(
+                    predictions, attention, expected_predictions):
+                self.assertTrue(pred.equal(expected))
+                self.assertEqual(attn.size(0), pred.size(0))
+            for score, expected in zip(scores, expected_scores):
+                self.assertAlmostEqual(float(score), float(expected),
+                                       places=4)
@@ -0,0 +1,72 @@
+import unittest
+from itertools import islice
+
+from onmt.inputters.inputter import DatasetLazyMixerIter
+
+
+class FakeDataset(object):
+    def __init__(self, path, unmapped):
+        self.path = path
+        self.unmapped = unmapped
+
+    def unmap(self):
+        self.unmapped.append(self.path)
+
+
+class FakeShard(object):
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __iter__(self):
+        n_batches = 0
+        while True:
+            n_batches += 1
+            yield self.dataset.path, n_batches
+
+
+class FakeShardsMixer(DatasetLazyMixerIter):
+    """Records the loads of its shards and the shards unmapped."""
+
+    def __init__(self, *args, **kwargs):
+        super(FakeShardsMixer, self).__init__(*args, **kwargs)
+        self.loads = []
+        self.unmapped = []
+
+    def _load_iterator(self, path, repeat):
+        self.loads.append(path)
+        return FakeShard(FakeDataset(path, self.unmapped))
+
+
+class TestDatasetLazyMixerIter(unittest.TestCase):
+    PATHS = ["d.train.1.0.pt", "d.train.1.1.pt", "d.train.2.pt"]
+
+    def schedule(self, n_turns, **kwargs):
+        mixer = DatasetLazyMixerIter(
+            self.PATHS, {}, 2, None, 1, 3, "cpu", True, **kwargs)
+        return list(islice(mixer._schedule(), n_turns))
+
+    def test_shards_take_turns(self):
+        self.assertEqual(self.schedule(4), [
+            ("d.train.1.0.pt", 3), ("d.train.1.1.pt", 3),
+            ("d.train.2.pt", 3), ("d.train.1.0.pt", 3)])
+
+    def test_levels_take_turns(self):
+        self.assertEqual(
+            self.schedule(8, shard_levels=[1, 1, 2], level_batches=8), [
+                ("d.train.1.0.pt", 3), ("d.train.1.1.pt", 3),
+                ("d.train.1.0.pt", 2),
+                ("d.train.2.pt", 3), ("d.train.2.pt", 3), ("d.train.2.pt", 2),
+                ("d.train.1.1.pt", 3), ("d.train.1.0.pt", 3)])
+
+    def test_unmaps_the_shard_needed_last(self):
+        mixer = FakeShardsMixer(
+            self.PATHS, {}, 2, None, 1, 1, "cpu", True, max_open_shards=2)
+        batches = list(islice(mixer, 9))
+        # every shard goes on where it stopped, loaded once
+        self.assertEqual(batches, [
+            (path, turn) for turn in (1, 2, 3) for path in self.PATHS])
+        self.assertEqual(mixer.loads, self.PATHS)
+        # a least recently used shard would be unmapped at every turn
+        self.assertEqual(mixer.unmapped, [
+            "d.train.1.1.pt", "d.train.1.0.pt", "d.train.2.pt",
+            "d.train.1.1.pt"])
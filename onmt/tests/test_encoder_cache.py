@@ -0,0 +1,49 @@
+import unittest
+
+import torch
+
+from onmt.translate.encoder_cache import EncoderCache
+
+
+def outputs(n):
+    # 4 bytes per float
+    return (torch.zeros(n), (torch.zeros(n), torch.zeros(n)))
+
+
+class TestEncoderCache(unittest.TestCase):
+    def test_hits_and_misses(self):
+        cache = EncoderCache(1000)
+        self.assertIsNone(cache.get((0, ("a b",))))
+        value = outputs(10)
+        cache.put((0, ("a b",)), value)
+        self.assertIs(cache.get((0, ("a b",))), value)
+        self.assertIsNone(cache.get((1, ("a b",))))
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 2)
+        self.assertEqual(cache.nbytes, 120)
+
+    def test_evicts_least_recently_used(self):
+        cache = EncoderCache(300)
+        for key in ["a", "b"]:
+            cache.put((0, key), outputs(10))
+        cache.get((0, "a"))
+        cache.put((0, "c"), outputs(10))
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get((0, "b")))
+        self.assertIsNotNone(cache.get((0, "a")))
+        self.assertLessEqual(cache.nbytes, 300)
+
+    def test_skips_values_larger_than_budget(self):
+        cache = EncoderCache(100)
+        cache.put((0, "a"), outputs(10))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.nbytes, 0)
+
+    def test_discard_model(self):
+        cache = EncoderCache(1000)
+        cache.put((0, "a"), outputs(1))
+        cache.put((1, "a"), outputs(1))
+        cache.discard(0)
+        self.assertIsNone(cache.get((0, "a")))
+        self.assertIsNotNone(cache.get((1, "a")))
+        self.assertEqual(cache.nbytes, 12)
@@ -0,0 +1,34 @@
+import unittest
+
+from onmt.evaluate.metrics import EvaluationCorpus, BleuStatistics, \
+    corpus_bleu, corpus_sari
+
+
+SRC = ["the cat sat on the mat .", "a quick brown fox jumps ."]
+TGT = ["the cat sat on a mat .", "a fox jumps ."]
+PRED = ["the cat sat on the mat .", "a brown fox jumps ."]
+
+
+class TestMetrics(unittest.TestCase):
+    def test_identical_prediction_has_perfect_bleu(self):
+        corpus = EvaluationCorpus(SRC, TGT, TGT)
+        stats = corpus_bleu(corpus)
+        self.assertAlmostEqual(stats.score(), 1.0)
+        self.assertEqual(stats.hyp_len, stats.ref_len)
+
+    def test_bleu_statistics_merge_like_concatenation(self):
+        merged = BleuStatistics()
+        for i in range(len(SRC)):
+            part = EvaluationCorpus(SRC[i:i + 1], TGT[i:i + 1],
+                                    PRED[i:i + 1])
+            merged.update(corpus_bleu(part))
+        whole = corpus_bleu(EvaluationCorpus(SRC, TGT, PRED))
+        self.assertEqual(merged.correct, whole.correct)
+        self.assertEqual(merged.total, whole.total)
+        self.assertAlmostEqual(merged.score(), whole.score())
+
+    def test_sari_is_averaged_over_sentences(self):
+        corpus = EvaluationCorpus(SRC, TGT, PRED)
+        stats = corpus_sari(corpus)
+        self.assertEqual(stats.count, len(PRED))
+        self.assertTrue(0 < stats.score() <= 100)
@@ -0,0 +1,117 @@
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import torch
+
+import onmt.inputters as inputters
+import onmt.opts
+from onmt.model_builder import build_base_model, fix_state_dict, \
+    load_test_model, skip_init
+from onmt.models.inference_checkpoint import save_inference_checkpoint
+from onmt.utils.parse import ArgumentParser
+
+parser = ArgumentParser(description='train.py')
+onmt.opts.general_opts(parser)
+onmt.opts.model_opts(parser)
+onmt.opts.train_opts(parser)
+
+# -data option is required, but not used in this test, so dummy.
+opt = parser.parse_known_args(
+    ['-data', 'dummy', '-levels', '1', '2', '3', '-rnn_size', '16',
+     '-word_vec_size', '8', '-share_embeddings'])[0]
+ArgumentParser.update_model_opts(opt)
+ArgumentParser.validate_model_opts(opt)
+
+
+class TestInferenceCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        fields = inputters.get_fields("text", 0, 0)
+        fields["tgt"].base_field.build_vocab([["a", "b", "c"]])
+        # -share_embeddings needs a shared vocab
+        fields["src"].base_field.vocab = fields["tgt"].base_field.vocab
+        model = build_base_model(opt, fields, False)
+        model_state_dict = {k: v for k, v in model.state_dict().items()
+                            if 'generator' not in k}
+        checkpoint = {'model': model_state_dict,
+                      'generator': model.generator.state_dict(),
+                      'vocab': fields,
+                      'opt': opt,
+                      'optim': None}
+        self.train_path = os.path.join(self.dir, "model.pt")
+        torch.save(checkpoint, self.train_path)
+        checkpoint['model'] = fix_state_dict(checkpoint['model'], opt)
+        self.inference_path = os.path.join(self.dir, "inference.pt")
+        save_inference_checkpoint(checkpoint, self.inference_path)
+        self.checkpoint = checkpoint
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def load(self, path, levels=None):
+        test_opt = argparse.Namespace(models=[path], data_type="text",
+                                      gpu=-1, fp32=False, levels=levels)
+        return load_test_model(test_opt)[1]
+
+    def test_same_weights(self):
+        expected = self.load(self.train_path)
+        actual = self.load(self.inference_path)
+        expected_state = expected.state_dict()
+        actual_state = actual.state_dict()
+        self.assertEqual(set(expected_state), set(actual_state))
+        for key, value in expected_state.items():
+            self.assertTrue(value.equal(actual_state[key]), key)
+        # tied weights are still tied
+        self.assertEqual(
+            actual.encoder().embeddings.word_lut.weight.data_ptr(),
+            actual.decoders["3"].embeddings.word_lut.weight.data_ptr())
+
+    def test_only_requested_levels(self):
+        model = self.load(self.inference_path, levels=[2])
+        self.assertEqual(list(model.decoders), ["2"])
+        full = self.load(self.train_path)
+        for key, value in full.decoders["2"].state_dict().items():
+            self.assertTrue(
+                value.equal(model.decoders["2"].state_dict()[key]), key)
+
+    def test_unknown_level_fails(self):
+        with self.assertRaises(ValueError):
+            self.load(self.inference_path, levels=[4])
+
+    def test_missing_weight_fails(self):
+        del self.checkpoint['generator']['0.bias']
+        save_inference_checkpoint(self.checkpoint, self.inference_path)
+        with self.assertRaises(ValueError) as ctx:
+            self.load(self.inference_path)
+        self.assertIn("0.bias", str(ctx.exception))
+
+    def test_concurrent_builds_are_initialized(self):
+        entered = threading.Event()
+        release = threading.Event()
+
+        def build_skipping_init():
+            with skip_init():
+                entered.set()
+                release.wait()
+        skipping = threading.Thread(target=build_skipping_init)
+        skipping.start()
+        entered.wait()
+        initialized = []
+
+        def build():
+            with skip_init(False):
+                initialized.append(
+                    torch.nn.init.constant_(torch.zeros(1), 1.).item())
+        building = threading.Thread(target=build)
+        building.start()
+        building.join(0.1)
+        # waits for the other build
+        self.assertEqual(initialized, [])
+        release.set()
+        skipping.join()
+        building.join()
+        self.assertEqual(initialized, [1.])
@@ -140,6 +140,50 @@ class TestModel(unittest.TestCase):
         self.assertEqual(outputs.size(), outputsize.size())
         self.assertEqual(type(outputs), torch.Tensor)
 
+    def multidecodersmodel_forward(self, opt, source_l=5, bsize=4):
+        """
+        Forwards a batch mixing two levels through a
+        MultiDecodersNMTModel and checks that each level gets the output
+        of its own decoder.
+        """
+        if opt.rnn_size > 0:
+            opt.enc_rnn_size = opt.rnn_size
+            opt.dec_rnn_size = opt.rnn_size
+        word_field = self.get_field()
+
+        embeddings = build_embeddings(opt, word_field)
+        enc = build_encoder(opt, embeddings)
+
+        embeddings = build_embeddings(opt, word_field, for_encoder=False)
+        decs = torch.nn.ModuleDict(
+            [[str(level), build_decoder(opt, embeddings)]
+             for level in [1, 2]])
+
+        model = onmt.models.MultiDecodersNMTModel(enc, decs)
+        model.eval()
+
+        test_src = torch.zeros(source_l, bsize, 1).long()
+        test_tgt = torch.zeros(source_l, bsize, 1).long()
+        test_length = torch.arange(source_l, source_l - bsize, -1)
+        level_index = {1: torch.LongTensor([0, 2]),
+                       2: torch.LongTensor([1, 3])}
+        outputs, attns = model(test_src, test_tgt, level_index, test_length)
+        self.assertEqual(outputs.size(),
+                         torch.Size([source_l - 1, bsize, opt.dec_rnn_size]))
+        for level, index in level_index.items():
+            level_outputs, level_attns = model(
+                test_src.index_select(1, index),
+                test_tgt.index_select(1, index),
+                level, test_length.index_select(0, index))
+            self.assertTrue(torch.allclose(
+                outputs.index_select(1, index), level_outputs, atol=1e-6))
+            # the memory bank of a sub-batch can be shorter
+            level_src_l = level_attns["std"].size(2)
+            attn = attns["std"].index_select(1, index)
+            self.assertTrue(torch.allclose(
+                attn[:, :, :level_src_l], level_attns["std"], atol=1e-6))
+            self.assertTrue(attn[:, :, level_src_l:].eq(0).all())
+
     def imagemodel_forward(self, opt, tgt_l=2, bsize=1, h=15, w=17):
         """
         Creates an image-to-text nmtmodel with a custom opt function.
@@ -305,6 +349,19 @@ if onmt.models.sru.check_sru_requirement():
 for p in tests_nmtmodel:
     _add_test(p, 'nmtmodel_forward')
 
+tests_multidecodersmodel = [[],
+                            [('decoder_type', 'transformer'),
+                             ('encoder_type', 'transformer'),
+                             ('src_word_vec_size', 16),
+                             ('tgt_word_vec_size', 16),
+                             ('rnn_size', 16)],
+                            [('encoder_type', "brnn")],
+                            [('encoder_type', 'mean')],
+                            ]
+
+for p in tests_multidecodersmodel:
+    _add_test(p, 'multidecodersmodel_forward')
+
 for p in tests_nmtmodel:
     _add_test(p, 'imagemodel_forward')
 
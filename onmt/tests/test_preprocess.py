@@ -49,10 +49,10 @@ class TestData(unittest.TestCase):
 
         src_reader = onmt.inputters.str2reader[opt.data_type].from_opt(opt)
         tgt_reader = onmt.inputters.str2reader["text"].from_opt(opt)
-        train_data_files = preprocess.build_save_dataset(
+        train_data_files, counters = preprocess.build_save_dataset(
             'train', fields, src_reader, tgt_reader, opt)
 
-        preprocess.build_save_vocab(train_data_files, fields, opt)
+        preprocess.build_save_vocab(train_data_files, fields, opt, counters)
 
         preprocess.build_save_dataset(
             'valid', fields, src_reader, tgt_reader, opt)
@@ -0,0 +1,49 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from onmt.utils.misc import read_line_index, read_line_range
+from preprocess import append_prefix, split_file, train_prefix
+
+
+class TestSplitLineIndex(unittest.TestCase):
+    LINES = [b"a b\n", b"c\n", b"d e f\n", b"g h\n", b"i\n", b"j k\n"]
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "src.1")
+        self.train_path = append_prefix(self.path, train_prefix)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def split(self, lines, line_index):
+        with open(self.path, "wb") as f:
+            f.write(b"".join(lines))
+        split_file(self.path, [4, 1], line_index=line_index)
+
+    def test_read_with_line_index(self):
+        self.split(self.LINES, True)
+        self.assertEqual(read_line_index(self.train_path, 2), 6)
+        self.assertEqual(read_line_index(self.train_path, 4), 16)
+        self.assertIsNone(read_line_index(self.train_path, 5))
+        self.assertEqual(read_line_range(self.train_path, 1, 3),
+                         self.LINES[1:3])
+
+    def test_out_of_date_line_index_is_ignored(self):
+        self.split(self.LINES, True)
+        index_path = self.train_path + ".idx"
+        shutil.copy(index_path, index_path + ".old")
+        self.split(self.LINES[1:], True)
+        os.replace(index_path + ".old", index_path)
+        self.assertIsNone(read_line_index(self.train_path, 1))
+        self.assertEqual(read_line_range(self.train_path, 1, 3),
+                         self.LINES[2:4])
+
+    def test_split_without_line_index_removes_it(self):
+        self.split(self.LINES, True)
+        self.split(self.LINES[:2] + self.LINES[3:], False)
+        self.assertFalse(os.path.exists(self.train_path + ".idx"))
+        self.assertEqual(read_line_range(self.train_path, 1, 3),
+                         self.LINES[1:2] + self.LINES[3:4])
@@ -0,0 +1,142 @@
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from argparse import Namespace
+
+import torch
+
+import onmt.inputters as inputters
+import onmt.opts
+from onmt.model_builder import build_base_model
+from onmt.translate.translator import build_translator
+from onmt.utils.logging import logger
+from onmt.utils.parse import ArgumentParser
+from translate import stream
+
+parser = ArgumentParser(description='train.py')
+onmt.opts.general_opts(parser)
+onmt.opts.model_opts(parser)
+onmt.opts.train_opts(parser)
+
+# -data option is required, but not used in this test, so dummy. Large
+# weights make the predictions depend on the source.
+opt = parser.parse_known_args(
+    ['-data', 'dummy', '-levels', '1', '2', '-rnn_size', '16',
+     '-word_vec_size', '8', '-share_embeddings', '-param_init', '2'])[0]
+ArgumentParser.update_model_opts(opt)
+ArgumentParser.validate_model_opts(opt)
+
+WORDS = ["a", "b", "c", "d", "e", "f", "g", "h"]
+
+
+class TestTranslateStream(unittest.TestCase):
+    # 7 lines in windows of 3
+    SRC = ["a b c", "d e", "f g h a", "b", "c d e f g", "h a", "e f g"]
+    WINDOW = 3
+
+    def setUp(self):
+        torch.manual_seed(1)
+        self.dir = tempfile.mkdtemp()
+        fields = inputters.get_fields("text", 0, 0)
+        fields["tgt"].base_field.build_vocab([WORDS])
+        fields["src"].base_field.vocab = fields["tgt"].base_field.vocab
+        model = build_base_model(opt, fields, False)
+        checkpoint = {'model': {k: v for k, v in model.state_dict().items()
+                                if 'generator' not in k},
+                      'generator': model.generator.state_dict(),
+                      'vocab': fields,
+                      'opt': opt,
+                      'optim': None}
+        self.model_path = os.path.join(self.dir, "model.pt")
+        torch.save(checkpoint, self.model_path)
+        self.src_path = os.path.join(self.dir, "src.txt")
+        with open(self.src_path, "w") as f:
+            f.write("\n".join(self.SRC) + "\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def translator(self, filter_pred=None):
+        translate_parser = ArgumentParser()
+        onmt.opts.translate_opts(translate_parser)
+        translate_opt = translate_parser.parse_args(
+            ['-model', self.model_path, '-src', self.src_path,
+             '-beam_size', '2', '-max_length', '6'])
+        translator = build_translator(
+            translate_opt, report_score=False, out_file=io.StringIO())
+        translator.out_files = {1: io.StringIO(), 2: io.StringIO()}
+        translator._filter_pred = filter_pred
+        return translator
+
+    def translate(self, filter_pred=None):
+        """Predictions of each level by :func:`Translator.translate()`."""
+        translator = self.translator(filter_pred)
+        for level in (1, 2):
+            translator.translate(src=self.src_path, level=level,
+                                 batch_size=2)
+        return {level: out_file.getvalue()
+                for level, out_file in translator.out_files.items()}
+
+    def stream(self, src, filter_pred=None):
+        """Predictions of each level by
+        :func:`Translator.translate_stream()`, and the stats reported."""
+        translator = self.translator(filter_pred)
+        reported = []
+        translator._report = lambda stats, *args: reported.append(stats)
+        n_lines = translator.translate_stream(
+            src, level=[1, 2], batch_size=2, window=self.WINDOW)
+        self.assertEqual(n_lines, len(self.SRC))
+        return ({level: out_file.getvalue()
+                 for level, out_file in translator.out_files.items()},
+                reported[0])
+
+    def test_same_as_translate_in_input_order(self):
+        expected = self.translate()
+        # distinct predictions, so that their order is checked
+        for predictions in expected.values():
+            self.assertEqual(len(set(predictions.splitlines())),
+                             len(self.SRC))
+        actual, stats = self.stream(self.src_path)
+        self.assertEqual(actual, expected)
+        for level_stats in stats.values():
+            self.assertEqual(level_stats["n_sents"], len(self.SRC))
+            # nothing grows with the input
+            self.assertEqual(level_stats["scores"], [])
+            self.assertEqual(level_stats["predictions"], [])
+
+    def test_filtered_examples(self):
+        def filter_pred(ex):
+            return len(ex.src[0]) != 2
+        expected = self.translate(filter_pred)
+        self.assertEqual(len(expected[1].splitlines()),
+                         len([src for src in self.SRC
+                              if len(src.split()) != 2]))
+        actual, stats = self.stream(self.src_path, filter_pred)
+        self.assertEqual(actual, expected)
+        self.assertEqual(stats[1]["n_sents"], len(expected[1].splitlines()))
+
+    def test_stdin_with_shared_src(self):
+        expected = self.translate()
+        translator = self.translator()
+        stream_opt = Namespace(
+            shared_src=True, src="-", levels=[1, 2], src_dir="",
+            batch_size=2, stream_window=self.WINDOW, attn_debug=False)
+        stdin = sys.stdin
+        sys.stdin = Namespace(
+            buffer=io.BytesIO(("\n".join(self.SRC) + "\n").encode("utf-8")))
+        try:
+            stream(stream_opt, translator, logger)
+        finally:
+            sys.stdin = stdin
+        self.assertEqual({level: out_file.getvalue() for level, out_file
+                          in translator.out_files.items()}, expected)
+
+    def test_stdin_to_several_levels_needs_shared_src(self):
+        stream_opt = Namespace(
+            shared_src=False, src="-", levels=[1, 2], src_dir="",
+            batch_size=2, stream_window=self.WINDOW, attn_debug=False)
+        with self.assertRaises(ValueError):
+            stream(stream_opt, self.translator(), logger)
@@ -0,0 +1,66 @@
+import unittest
+from argparse import Namespace
+from collections import Counter
+
+import torch
+from torchtext.vocab import Vocab
+
+import onmt.inputters as inputters
+from onmt.translate.translation import TranslationBuilder
+
+
+class TestTranslationBuilder(unittest.TestCase):
+    def setUp(self):
+        self.fields = inputters.get_fields("text", 0, 0)
+        # itos: <unk> <blank> <s> </s> a b c
+        self.fields["tgt"].base_field.build_vocab([["a", "b", "c"]])
+        srcs = [["x", "y"], ["a", "z", "w"]]
+        # itos: <unk> <blank> then the source words in alphabetical order
+        self.data = Namespace(
+            src_vocabs=[Vocab(Counter(src), specials=["<unk>", "<blank>"])
+                        for src in srcs],
+            example=lambda i: Namespace(src=[srcs[i]]))
+
+    def translation_batch(self):
+        # the batch holds the second sentence first
+        batch = Namespace(
+            batch_size=2,
+            indices=torch.tensor([1, 0]),
+            src=(torch.zeros([3, 2, 1], dtype=torch.long),
+                 torch.tensor([3, 2])),
+            tgt=torch.tensor([[2, 2], [5, 4], [6, 3], [3, 1]]).unsqueeze(2))
+        attns = [torch.zeros([4, 3]), torch.zeros([3, 2])]
+        # the unknown tokens attend to the last source word
+        attns[0][2, 2] = 1
+        attns[1][1, 1] = 1
+        return {
+            "batch": batch,
+            "predictions": [
+                # a, copied z, <unk>, </s>
+                [torch.tensor([4, 11, 0, 3])],
+                # copied y, copied <unk>, b and no EOS
+                [torch.tensor([10, 7, 5])]],
+            "scores": [[-1.0], [-2.0]],
+            "attention": [[attns[0]], [attns[1]]],
+            "gold_score": [-3.0, -4.0]}
+
+    def test_tokens_in_dataset_order(self):
+        builder = TranslationBuilder(
+            self.data, self.fields, has_tgt=True)
+        first, second = builder.from_batch(self.translation_batch())
+        self.assertEqual(first.src_raw, ["x", "y"])
+        self.assertEqual(first.pred_sents, [["y", "<unk>", "b"]])
+        self.assertEqual(first.pred_scores, [-2.0])
+        self.assertEqual(first.gold_sent, ["a"])
+        self.assertEqual(first.gold_score, -4.0)
+        self.assertEqual(second.pred_sents, [["a", "z", "<unk>"]])
+        self.assertEqual(second.gold_sent, ["b", "c"])
+
+    def test_replace_unk(self):
+        builder = TranslationBuilder(
+            self.data, self.fields, replace_unk=True, has_tgt=True)
+        first, second = builder.from_batch(self.translation_batch())
+        self.assertEqual(first.pred_sents, [["y", "y", "b"]])
+        self.assertEqual(second.pred_sents, [["a", "z", "w"]])
+        # the gold targets are left as they are
+        self.assertEqual(first.gold_sent, ["a"])
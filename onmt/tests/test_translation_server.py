@@ -1,23 +1,78 @@
 import unittest
-from onmt.translate.translation_server import ServerModel, TranslationServer
+from onmt.translate.translation_server import ServerModel, \
+    TranslationServer, ServerModelError, ServerModelLoading, BatchingQueue, \
+    ModelPool
 
 import os
+import logging
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from six import string_types
 from textwrap import dedent
 
 import torch
 
+import onmt.inputters as inputters
+import onmt.opts
+from onmt.model_builder import build_base_model
 from onmt.translate.translator import Translator
+from onmt.utils.parse import ArgumentParser
 
 
 TEST_DIR = os.path.dirname(os.path.abspath(__file__))
 
+parser = ArgumentParser(description='train.py')
+onmt.opts.general_opts(parser)
+onmt.opts.model_opts(parser)
+onmt.opts.train_opts(parser)
 
-class TestServerModel(unittest.TestCase):
+# -data option is required, but not used in this test, so dummy.
+opt = parser.parse_known_args(
+    ['-data', 'dummy', '-levels', '1', '2', '-rnn_size', '16',
+     '-word_vec_size', '8', '-share_embeddings'])[0]
+ArgumentParser.update_model_opts(opt)
+ArgumentParser.validate_model_opts(opt)
+
+
+def save_test_model(path):
+    """Save a random model with a decoder per level to `path`."""
+    torch.manual_seed(1)
+    fields = inputters.get_fields("text", 0, 0)
+    fields["tgt"].base_field.build_vocab(
+        [["hello", "how", "are", "you", "today", "good", "morning", "to",
+          "."]])
+    # -share_embeddings needs a shared vocab
+    fields["src"].base_field.vocab = fields["tgt"].base_field.vocab
+    model = build_base_model(opt, fields, False)
+    checkpoint = {'model': {k: v for k, v in model.state_dict().items()
+                            if 'generator' not in k},
+                  'generator': model.generator.state_dict(),
+                  'vocab': fields,
+                  'opt': opt,
+                  'optim': None}
+    torch.save(checkpoint, path)
+
+
+class ServerTestCase(unittest.TestCase):
+    """Saves test_model.pt to ``model_root`` for the tests of the class."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.model_root = tempfile.mkdtemp()
+        save_test_model(os.path.join(cls.model_root, "test_model.pt"))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.model_root)
+
+
+class TestServerModel(ServerTestCase):
     def test_deferred_loading_model_and_unload(self):
         model_id = 0
         opt = {"models": ["test_model.pt"]}
-        model_root = TEST_DIR
+        model_root = self.model_root
         sm = ServerModel(opt, model_id, model_root=model_root, load=False)
         self.assertFalse(sm.loaded)
         sm.load()
@@ -29,7 +84,7 @@ class TestServerModel(unittest.TestCase):
     def test_load_model_on_init_and_unload(self):
         model_id = 0
         opt = {"models": ["test_model.pt"]}
-        model_root = TEST_DIR
+        model_root = self.model_root
         sm = ServerModel(opt, model_id, model_root=model_root, load=True)
         self.assertTrue(sm.loaded)
         self.assertIsInstance(sm.translator, Translator)
@@ -39,7 +94,7 @@ class TestServerModel(unittest.TestCase):
     def test_tokenizing_with_no_tokenizer_fails(self):
         model_id = 0
         opt = {"models": ["test_model.pt"]}
-        model_root = TEST_DIR
+        model_root = self.model_root
         sm = ServerModel(opt, model_id, model_root=model_root, load=True)
         with self.assertRaises(ValueError):
             sm.tokenize("hello world")
@@ -47,7 +102,7 @@ class TestServerModel(unittest.TestCase):
     def test_detokenizing_with_no_tokenizer_fails(self):
         model_id = 0
         opt = {"models": ["test_model.pt"]}
-        model_root = TEST_DIR
+        model_root = self.model_root
         sm = ServerModel(opt, model_id, model_root=model_root, load=True)
         with self.assertRaises(ValueError):
             sm.detokenize("hello world")
@@ -57,7 +112,7 @@ class TestServerModel(unittest.TestCase):
             torch.cuda.set_device(torch.device("cuda", 0))
             model_id = 0
             opt = {"models": ["test_model.pt"]}
-            model_root = TEST_DIR
+            model_root = self.model_root
             sm = ServerModel(opt, model_id, model_root=model_root, load=True)
             for p in sm.translator.model.parameters():
                 self.assertEqual(p.device.type, "cpu")
@@ -73,7 +128,7 @@ class TestServerModel(unittest.TestCase):
             torch.cuda.set_device(torch.device("cuda", 0))
             model_id = 0
             opt = {"models": ["test_model.pt"], "gpu": 0}
-            model_root = TEST_DIR
+            model_root = self.model_root
             sm = ServerModel(opt, model_id, model_root=model_root, load=True)
             for p in sm.translator.model.parameters():
                 self.assertEqual(p.device.type, "cuda")
@@ -91,7 +146,7 @@ class TestServerModel(unittest.TestCase):
                 torch.cuda.set_device(torch.device("cuda", 1))
                 model_id = 0
                 opt = {"models": ["test_model.pt"], "gpu": 1}
-                model_root = TEST_DIR
+                model_root = self.model_root
                 sm = ServerModel(opt, model_id, model_root=model_root,
                                  load=True)
                 for p in sm.translator.model.parameters():
@@ -108,7 +163,7 @@ class TestServerModel(unittest.TestCase):
     def test_run(self):
         model_id = 0
         opt = {"models": ["test_model.pt"]}
-        model_root = TEST_DIR
+        model_root = self.model_root
         sm = ServerModel(opt, model_id, model_root=model_root, load=True)
         inp = [{"src": "hello how are you today"},
                {"src": "good morning to you ."}]
@@ -126,15 +181,247 @@ class TestServerModel(unittest.TestCase):
         self.assertIsInstance(time, dict)
         self.assertIn("translation", time)
 
+    def test_run_levels(self):
+        model_id = 0
+        opt = {"models": ["test_model.pt"]}
+        model_root = self.model_root
+        sm = ServerModel(opt, model_id, model_root=model_root, load=True)
+        srcs = ["hello how are you today", "good morning to you ."]
+        inp = [{"src": src, "level": level}
+               for src in srcs for level in reversed(sm.levels)]
+        results, scores, _, _ = sm.run(inp)
+        self.assertEqual(len(results), len(inp))
+        for item, result, score in zip(inp, results, scores):
+            alone, alone_scores, _, _ = sm.run([item])
+            self.assertEqual(alone, [result])
+            self.assertAlmostEqual(alone_scores[0], score, places=4)
+
+    def test_run_unknown_level_fails(self):
+        model_id = 0
+        opt = {"models": ["test_model.pt"]}
+        model_root = self.model_root
+        sm = ServerModel(opt, model_id, model_root=model_root, load=True)
+        with self.assertRaises(ServerModelError):
+            sm.run([{"src": "hello", "level": max(sm.levels) + 1}])
+
+    def test_load_in_background_and_wait(self):
+        model_id = 0
+        opt = {"models": ["test_model.pt"]}
+        model_root = self.model_root
+        loader = ThreadPoolExecutor(max_workers=1)
+        sm = ServerModel(opt, model_id, model_root=model_root, load=True,
+                         loader=loader)
+        results, _, _, _ = sm.run([{"src": "hello how are you today"}])
+        self.assertTrue(sm.loaded)
+        self.assertFalse(sm.loading)
+        self.assertEqual(len(results), 1)
+        loader.shutdown()
+
+    def test_reject_while_loading(self):
+        model_id = 0
+        opt = {"models": ["test_model.pt"]}
+        model_root = self.model_root
+        loader = ThreadPoolExecutor(max_workers=1)
+        # keep the loader busy so that the model stays in its queue
+        release = threading.Event()
+        loader.submit(release.wait)
+        sm = ServerModel(opt, model_id, model_root=model_root, load=True,
+                         loader=loader, on_loading="reject")
+        self.assertTrue(sm.loading)
+        self.assertTrue(sm.to_dict()["loading"])
+        with self.assertRaises(ServerModelLoading) as ctx:
+            sm.run([{"src": "hello"}])
+        self.assertGreaterEqual(ctx.exception.retry_after, 1)
+        sm.loading_future.cancel()
+        release.set()
+        loader.shutdown()
+
+    def test_clone_shares_weights(self):
+        opt = {"models": ["test_model.pt"]}
+        model_root = self.model_root
+        sm = ServerModel(opt, 0, model_root=model_root, load=True)
+        clone = ServerModel({"models": ["test_model.pt"], "beam_size": 2},
+                            1, model_root=model_root, load=True,
+                            shared_from=sm)
+        self.assertIsNot(clone.translator, sm.translator)
+        self.assertIs(clone.translator.model, sm.translator.model)
+        self.assertIs(clone.translator.fields, sm.translator.fields)
+        self.assertEqual(clone.translator.beam_size, 2)
+        self.assertEqual(clone.nbytes, 0)
+        self.assertTrue(sm.shared)
+        self.assertFalse(sm.try_unload())
+        self.assertTrue(clone.try_unload())
+        self.assertFalse(sm.shared)
+
+    def test_clone_runs_concurrently_with_its_source(self):
+        opt = {"models": ["test_model.pt"]}
+        model_root = self.model_root
+        sm = ServerModel(opt, 0, model_root=model_root, load=True)
+        clone = ServerModel({"models": ["test_model.pt"], "beam_size": 2},
+                            1, model_root=model_root, load=True,
+                            shared_from=sm)
+        srcs = ["hello how are you today", "good morning to you ."]
+        # each model translates to another level, which the shared model
+        # switches to
+        requests = [(model, [{"src": src, "level": level} for src in srcs])
+                    for model, level in zip([sm, clone], sm.levels[::-1])]
+        expected = [model.run(inp)[:2] for model, inp in requests]
+        results = [[] for _ in requests]
+
+        def translate(i):
+            model, inp = requests[i]
+            for _ in range(5):
+                results[i].append(model.run(inp)[:2])
+        threads = [threading.Thread(target=translate, args=(i,))
+                   for i in range(len(requests))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for model_results, (exp_results, exp_scores) in zip(
+                results, expected):
+            self.assertEqual(len(model_results), 5)
+            for model_result, scores in model_results:
+                self.assertEqual(model_result, exp_results)
+                for score, exp_score in zip(scores, exp_scores):
+                    self.assertAlmostEqual(score, exp_score, places=4)
+
+    def test_shared_weights_stay_in_place(self):
+        opt = {"models": ["test_model.pt"]}
+        model_root = self.model_root
+        sm = ServerModel(opt, 0, model_root=model_root, load=True)
+        clone = ServerModel({"models": ["test_model.pt"], "beam_size": 2},
+                            1, model_root=model_root, load=True,
+                            shared_from=sm)
+        for model in [sm, clone]:
+            with self.assertRaises(ServerModelError):
+                model.to_cpu()
+        with self.assertRaises(ServerModelError):
+            sm.unload()
+        self.assertTrue(sm.loaded)
+        clone.unload()
+        sm.unload()
+        self.assertFalse(sm.loaded)
+
+    def test_clone_with_other_gpu_loads_weights(self):
+        opt = {"models": ["test_model.pt"]}
+        model_root = self.model_root
+        sm = ServerModel(opt, 0, model_root=model_root, load=True)
+        clone = ServerModel({"models": ["test_model.pt"], "fp32": True},
+                            1, model_root=model_root, load=True,
+                            shared_from=sm)
+        self.assertIsNot(clone.translator.model, sm.translator.model)
+        self.assertGreater(clone.nbytes, 0)
+
     def test_nbest_init_fails(self):
         model_id = 0
         opt = {"models": ["test_model.pt"], "n_best": 2}
-        model_root = TEST_DIR
+        model_root = self.model_root
         with self.assertRaises(ValueError):
             ServerModel(opt, model_id, model_root=model_root, load=True)
 
 
-class TestTranslationServer(unittest.TestCase):
+class TestBatchingQueue(unittest.TestCase):
+    @staticmethod
+    def upper(inputs):
+        if any(inp["src"] == "fail" for inp in inputs):
+            raise ServerModelError("failed")
+        results = [inp["src"].upper() for inp in inputs]
+        return results, [float(len(r)) for r in results], 1, {}
+
+    def submit_concurrently(self, queue, requests):
+        outputs = [None] * len(requests)
+
+        def submit(i):
+            outputs[i] = queue.submit(requests[i])
+        threads = [threading.Thread(target=submit, args=(i,))
+                   for i in range(len(requests))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return outputs
+
+    def test_merges_concurrent_requests(self):
+        queue = BatchingQueue(self.upper, max_wait=0.2)
+        requests = [[{"src": "a b %d" % i}, {"src": "c %d" % i}]
+                    for i in range(8)]
+        outputs = self.submit_concurrently(queue, requests)
+        for request, (results, scores, n_best, _) in zip(requests, outputs):
+            self.assertEqual(results, [inp["src"].upper() for inp in request])
+            self.assertEqual(scores, [float(len(r)) for r in results])
+        self.assertLess(queue.n_batches, len(requests))
+        self.assertEqual(queue.stats()["inputs"], 16)
+        self.assertEqual(queue.depth, 0)
+
+    def test_token_budget(self):
+        queue = BatchingQueue(self.upper, max_tokens=3, max_wait=0.2)
+        requests = [[{"src": "a b"}] for _ in range(4)]
+        self.submit_concurrently(queue, requests)
+        self.assertEqual(queue.n_batches, 4)
+
+    def test_errors_reach_callers(self):
+        queue = BatchingQueue(self.upper, max_wait=0)
+        with self.assertRaises(ServerModelError):
+            queue.submit([{"src": "fail"}])
+        self.assertEqual(queue.submit([{"src": "ok"}])[0], ["OK"])
+
+
+class FakeModel(object):
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, model_id, pool, busy=False):
+        self.model_id = model_id
+        self.pool = pool
+        self.busy = busy
+        self.loaded = False
+
+    def load(self, nbytes):
+        self.pool.reserve(self, nbytes)
+        self.loaded = True
+        self.pool.add(self, nbytes)
+
+    def try_unload(self):
+        if self.busy:
+            return False
+        self.loaded = False
+        self.pool.release(self.model_id)
+        return True
+
+
+class TestModelPool(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        pool = ModelPool(100)
+        models = [FakeModel(i, pool) for i in range(3)]
+        models[0].load(40)
+        models[1].load(40)
+        pool.touch(0)
+        models[2].load(40)
+        self.assertEqual([m.loaded for m in models], [True, False, True])
+        self.assertEqual(pool.nbytes, 80)
+        self.assertEqual(pool.stats()["models"], [0, 2])
+        self.assertEqual(
+            [e["model_id"] for e in pool.stats()["evictions"]], [1])
+
+    def test_skips_busy_models(self):
+        pool = ModelPool(100)
+        models = [FakeModel(0, pool, busy=True), FakeModel(1, pool),
+                  FakeModel(2, pool)]
+        models[0].load(40)
+        models[1].load(40)
+        models[2].load(40)
+        self.assertEqual([m.loaded for m in models], [True, False, True])
+
+    def test_over_budget_when_nothing_to_evict(self):
+        pool = ModelPool(100)
+        model = FakeModel(0, pool)
+        model.load(150)
+        self.assertTrue(model.loaded)
+        self.assertEqual(pool.nbytes, 150)
+        self.assertEqual(len(pool.evictions), 0)
+
+
+class TestTranslationServer(ServerTestCase):
     # this could be considered an integration test because it touches
     # the filesystem for the config file (and the models)
 
@@ -147,7 +434,7 @@ class TestTranslationServer(unittest.TestCase):
 
     def write(self, cfg):
         with open(self.CFG_F, "w") as f:
-            f.write(cfg)
+            f.write(cfg % self.model_root)
 
     CFG_NO_LOAD = dedent("""\
         {
@@ -165,7 +452,7 @@ class TestTranslationServer(unittest.TestCase):
                 }
             ]
         }
-        """ % TEST_DIR)
+        """)
 
     def test_start_without_initial_loading(self):
         self.write(self.CFG_NO_LOAD)
@@ -190,7 +477,7 @@ class TestTranslationServer(unittest.TestCase):
                 }
             ]
         }
-        """ % TEST_DIR)
+        """)
 
     def test_start_with_initial_loading(self):
         self.write(self.CFG_LOAD)
@@ -199,6 +486,18 @@ class TestTranslationServer(unittest.TestCase):
         self.assertTrue(sv.models[100].loaded)
         self.assertEqual(set(sv.models.keys()), {100})
 
+    def test_clone_model(self):
+        self.write(self.CFG_LOAD)
+        sv = TranslationServer()
+        sv.start(self.CFG_F)
+        model_id, load_time = sv.clone_model(100, {"beam_size": 2})
+        self.assertNotEqual(model_id, 100)
+        self.assertIsNotNone(load_time)
+        clone = sv.models[model_id]
+        self.assertIs(clone.translator.model, sv.models[100].translator.model)
+        self.assertEqual(clone.translator.beam_size, 2)
+        self.assertEqual(sv.models[100].translator.beam_size, 5)
+
     CFG_2_MODELS = dedent("""\
         {
             "models_root": "%s",
@@ -225,7 +524,7 @@ class TestTranslationServer(unittest.TestCase):
                 }
             ]
         }
-        """ % TEST_DIR)
+        """)
 
     def test_start_with_two_models(self):
         self.write(self.CFG_2_MODELS)
@@ -11,9 +11,11 @@
 
 from copy import deepcopy
 import itertools
+import time
 import torch
 
 import onmt.utils
+from onmt.inputters.inputter import batch_levels
 from onmt.utils.logging import logger
 
 
@@ -122,9 +124,23 @@ class Trainer(object):
         self.model.train()
 
     def _accum_batches(self, iterator):
+        """Group the batches of ``iterator`` by ``grad_accum_count``.
+
+        Yields:
+            the batches, their normalization and the time spent waiting
+            for them.
+        """
         batches = []
         normalization = 0
-        for batch in iterator:
+        data_time = 0
+        iterator = iter(iterator)
+        while True:
+            start = time.time()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                break
+            data_time += time.time() - start
             batches.append(batch)
             if self.norm_method == "tokens":
                 num_tokens = batch.tgt[1:, :, 0].ne(
@@ -133,11 +149,12 @@ class Trainer(object):
             else:
                 normalization += batch.batch_size
             if len(batches) == self.grad_accum_count:
-                yield batches, normalization
+                yield batches, normalization, data_time
                 batches = []
                 normalization = 0
+                data_time = 0
         if batches:
-            yield batches, normalization
+            yield batches, normalization, data_time
 
     def _update_average(self, step):
         if self.moving_average is None:
@@ -188,9 +205,11 @@ class Trainer(object):
             train_iter = itertools.islice(
                 train_iter, self.gpu_rank, None, self.n_gpu)
 
-        for i, (batches, normalization) in enumerate(
+        for i, (batches, normalization, data_time) in enumerate(
                 self._accum_batches(train_iter)):
             step = self.optim.training_step
+            total_stats.data_time += data_time
+            report_stats.data_time += data_time
 
             if self.gpu_verbose_level > 1:
                 logger.info("GpuRank %d: index: %d", self.gpu_rank, i)
@@ -271,7 +290,8 @@ class Trainer(object):
                 tgt = batch.tgt
 
                 # F-prop through the model.
-                outputs, attns = valid_model(src, tgt, batch.levels, src_lengths)
+                outputs, attns = valid_model(
+                    src, tgt, batch_levels(batch), src_lengths)
 
                 # Compute loss.
                 _, batch_stats = self.valid_loss(batch, outputs, attns)
@@ -315,7 +335,8 @@ class Trainer(object):
                 # 2. F-prop all but generator.
                 if self.grad_accum_count == 1:
                     self.optim.zero_grad()
-                outputs, attns = self.model(src, tgt, batch.levels, src_lengths, bptt=bptt)
+                outputs, attns = self.model(
+                    src, tgt, batch_levels(batch), src_lengths, bptt=bptt)
                 bptt = True
 
                 # 3. Compute loss.
@@ -7,9 +7,10 @@ from onmt.translate.decode_strategy import DecodeStrategy
 from onmt.translate.random_sampling import RandomSampling
 from onmt.translate.penalties import PenaltyBuilder
 from onmt.translate.translation_server import TranslationServer, \
-    ServerModelError
+    ServerModelError, ServerModelLoading
 
 __all__ = ['Translator', 'Translation', 'Beam', 'BeamSearch',
            'GNMTGlobalScorer', 'TranslationBuilder',
            'PenaltyBuilder', 'TranslationServer', 'ServerModelError',
+           'ServerModelLoading',
            "DecodeStrategy", "RandomSampling"]
@@ -1,6 +1,6 @@
 import torch
 
-from onmt.translate.decode_strategy import DecodeStrategy
+from onmt.translate.decode_strategy import DecodeStrategy, compact_buffer
 
 
 class BeamSearch(DecodeStrategy):
@@ -26,8 +26,12 @@ class BeamSearch(DecodeStrategy):
         return_attention (bool): See base.
         block_ngram_repeat (int): See base.
         exclusion_tokens (set[int]): See base.
-        memory_lengths (LongTensor): Lengths of encodings. Used for
-            masking attentions.
+        memory_lengths (LongTensor): Shape ``(batch_size,)``, lengths of
+            encodings. Used for masking attentions.
+        stepwise_penalty (bool): Apply the coverage penalty at every step.
+        early_stopping (bool): Finish a sentence as soon as none of its
+            live beams can make it into its ``n_best`` hypotheses, see
+            :func:`stop_early()`. Not used with a coverage penalty.
 
     Attributes:
         top_beam_finished (ByteTensor): Shape ``(B,)``.
@@ -49,14 +53,24 @@ class BeamSearch(DecodeStrategy):
             ``(B, beam_size)``. Initialized to ``None``.
         _coverage (FloatTensor or NoneType): Shape
             ``(1, B x beam_size, inp_seq_len)``.
-        hypotheses (list[list[Tuple[Tensor]]]): Contains a tuple
-            of score (float), sequence (long), and attention (float or None).
+        n_stopped_early (LongTensor): Number of sentences finished by
+            ``early_stopping``.
+        steps_saved (LongTensor): Upper bound on the steps of beam rows
+            saved by ``early_stopping``: the steps left until
+            ``max_length`` for each beam of these sentences.
+        best_scores (FloatTensor): Shape ``(B, n_best)``, scores of the
+            best finished hypotheses of each sentence, ``-inf`` for the
+            missing ones. Their predictions and attention are kept in
+            the ``_best_slots`` of ``_best_seq`` and ``_best_attn``, with
+            shapes
+            ``(max_length, B, n_best)`` and
+            ``(max_length, B, n_best, inp_seq_len)``.
     """
 
     def __init__(self, beam_size, batch_size, pad, bos, eos, n_best, mb_device,
                  global_scorer, min_length, max_length, return_attention,
                  block_ngram_repeat, exclusion_tokens, memory_lengths,
-                 stepwise_penalty):
+                 stepwise_penalty, early_stopping=False):
         super(BeamSearch, self).__init__(
             pad, bos, eos, batch_size, mb_device, beam_size, min_length,
             block_ngram_repeat, exclusion_tokens, return_attention,
@@ -67,21 +81,43 @@ class BeamSearch(DecodeStrategy):
         self.n_best = n_best
         self.batch_size = batch_size
 
-        # result caching
-        self.hypotheses = [[] for _ in range(batch_size)]
+        # best finished hypotheses of each sentence, time major
+        self.best_scores = torch.full(
+            [batch_size, n_best], float("-inf"), device=mb_device)
+        self._best_lengths = torch.zeros(
+            [batch_size, n_best], dtype=torch.long, device=mb_device)
+        self._best_seq = torch.full(
+            [max_length, batch_size, n_best], pad, dtype=torch.long,
+            device=mb_device)
+        self._best_attn = None
+        # expanded rather than repeated, older torch versions can't
+        # repeat 0 times (for ContinuousBeamSearch)
+        self._best_slots = torch.arange(
+            n_best, device=mb_device).expand(batch_size, n_best).contiguous()
+        self._n_finished = torch.zeros(
+            [batch_size], dtype=torch.long, device=mb_device)
 
         # beam state
-        self.top_beam_finished = torch.zeros([batch_size], dtype=torch.uint8)
+        self.top_beam_finished = torch.zeros(
+            [batch_size], dtype=torch.uint8, device=mb_device)
         self._batch_offset = torch.arange(batch_size, dtype=torch.long)
         self._beam_offset = torch.arange(
             0, batch_size * beam_size, step=beam_size, dtype=torch.long,
             device=mb_device)
         self.topk_log_probs = torch.tensor(
             [0.0] + [float("-inf")] * (beam_size - 1), device=mb_device
-        ).repeat(batch_size)
+        ).expand(batch_size, beam_size).contiguous().view(-1)
         self.select_indices = None
         self._memory_lengths = memory_lengths
 
+        # preallocated buffers of alive_seq and alive_attn, the paths
+        # are gathered from the first to the second one at each step
+        self._seq_buffers = [
+            self.seq_buffer(batch_size * beam_size, mb_device)
+            for _ in range(2)]
+        self.alive_seq = self._seq_buffers[0][:1].t()
+        self._attn_buffers = None
+
         # buffers for the topk scores and 'backpointer'
         self.topk_scores = torch.empty((batch_size, beam_size),
                                        dtype=torch.float, device=mb_device)
@@ -99,6 +135,11 @@ class BeamSearch(DecodeStrategy):
         self._vanilla_cov_pen = (
             not stepwise_penalty and self.global_scorer.has_cov_pen)
         self._cov_pen = self.global_scorer.has_cov_pen
+        # the coverage penalty of a hypothesis may decrease with its length
+        self.early_stopping = early_stopping and not self._cov_pen
+        self.n_stopped_early = torch.zeros(
+            [], dtype=torch.long, device=mb_device)
+        self.steps_saved = torch.zeros([], dtype=torch.long, device=mb_device)
 
     @property
     def current_predictions(self):
@@ -155,25 +196,36 @@ class BeamSearch(DecodeStrategy):
         torch.div(self.topk_ids, vocab_size, out=self._batch_index)
         self._batch_index += self._beam_offset[:_B].unsqueeze(1)
         self.select_indices = self._batch_index.view(_B * self.beam_size)
+        self.select_repeated_ngram(self.select_indices)
 
         self.topk_ids.fmod_(vocab_size)  # resolve true word ids
 
         # Append last prediction.
-        self.alive_seq = torch.cat(
-            [self.alive_seq.index_select(0, self.select_indices),
-             self.topk_ids.view(_B * self.beam_size, 1)], -1)
+        seq, next_seq = self._seq_buffers
+        torch.index_select(seq[:step], 1, self.select_indices,
+                           out=next_seq[:step])
+        next_seq[step] = self.topk_ids.view(_B * self.beam_size)
+        self._seq_buffers = [next_seq, seq]
+        self.alive_seq = next_seq[:step + 1].t()
         if self.return_attention or self._cov_pen:
             current_attn = attn.index_select(1, self.select_indices)
             if step == 1:
-                self.alive_attn = current_attn
+                self._attn_buffers = [
+                    current_attn.new_empty(
+                        (self.max_length,) + current_attn.shape[1:])
+                    for _ in range(2)]
+            attn_buffer, next_attn = self._attn_buffers
+            torch.index_select(attn_buffer[:step - 1], 1,
+                               self.select_indices, out=next_attn[:step - 1])
+            next_attn[step - 1] = current_attn[0]
+            self._attn_buffers = [next_attn, attn_buffer]
+            self.alive_attn = next_attn[:step]
+            if step == 1:
                 # update global state (step == 1)
                 if self._cov_pen:  # coverage penalty
                     self._prev_penalty = torch.zeros_like(self.topk_log_probs)
                     self._coverage = current_attn
             else:
-                self.alive_attn = self.alive_attn.index_select(
-                    1, self.select_indices)
-                self.alive_attn = torch.cat([self.alive_attn, current_attn], 0)
                 # update global state (step > 1)
                 if self._cov_pen:
                     self._coverage = self._coverage.index_select(
@@ -192,48 +244,46 @@ class BeamSearch(DecodeStrategy):
 
         self.is_finished = self.topk_ids.eq(self.eos)
         self.ensure_max_length()
+        if self.early_stopping:
+            self.stop_early(step)
+
+    def stop_early(self, step):
+        """Finish the sentences whose live beams can no longer make it
+        into their ``n_best`` hypotheses.
+
+        The log probs of a hypothesis only decrease as it grows, so the
+        score of any hypothesis continuing a live beam is at most the log
+        prob of the beam under the highest length penalty it may get
+        (the length penalty being monotonic in the length). Once the
+        ``n_best``-th best finished hypothesis of a sentence scores at
+        least this bound for each of its live beams, the sentence is
+        marked as finished: its live beams then rank after its ``n_best``
+        hypotheses, so the results are the same as without stopping.
+        """
+        length_penalty = max(
+            self.global_scorer.length_penalty(
+                length, alpha=self.global_scorer.alpha)
+            for length in [step + 2, self.max_length + 1])
+        live_log_probs = self.topk_log_probs.view(
+            -1, self.beam_size).masked_fill(self.is_finished, float("-inf"))
+        bound = live_log_probs.max(1)[0] / length_penalty
+        stop = self._n_finished.ge(self.n_best) \
+            & bound.le(self.best_scores[:, -1]) \
+            & self.is_finished.all(1).eq(0)
+        self.is_finished |= stop.unsqueeze(1)
+        n_stopped = stop.sum()
+        self.n_stopped_early += n_stopped
+        self.steps_saved += n_stopped * self.beam_size * (
+            self.max_length - step)
 
     def update_finished(self):
         # Penalize beams that finished.
         _B_old = self.topk_log_probs.shape[0]
         step = self.alive_seq.shape[-1]  # 1 greater than the step in advance
         self.topk_log_probs.masked_fill_(self.is_finished, -1e10)
-        # on real data (newstest2017) with the pretrained transformer,
-        # it's faster to not move this back to the original device
-        self.is_finished = self.is_finished.to('cpu')
-        self.top_beam_finished |= self.is_finished[:, 0].eq(1)
-        predictions = self.alive_seq.view(_B_old, self.beam_size, step)
-        attention = (
-            self.alive_attn.view(
-                step - 1, _B_old, self.beam_size, self.alive_attn.size(-1))
-            if self.alive_attn is not None else None)
-        non_finished_batch = []
-        for i in range(self.is_finished.size(0)):
-            b = self._batch_offset[i]
-            finished_hyp = self.is_finished[i].nonzero().view(-1)
-            # Store finished hypotheses for this batch.
-            for j in finished_hyp:
-                self.hypotheses[b].append((
-                    self.topk_scores[i, j],
-                    predictions[i, j, 1:],  # Ignore start_token.
-                    attention[:, i, j, :self._memory_lengths[i]]
-                    if attention is not None else None))
-            # End condition is the top beam finished and we can return
-            # n_best hypotheses.
-            if self.top_beam_finished[i] and len(
-                    self.hypotheses[b]) >= self.n_best:
-                best_hyp = sorted(
-                    self.hypotheses[b], key=lambda x: x[0], reverse=True)
-                for n, (score, pred, attn) in enumerate(best_hyp):
-                    if n >= self.n_best:
-                        break
-                    self.scores[b].append(score)
-                    self.predictions[b].append(pred)
-                    self.attention[b].append(
-                        attn if attn is not None else [])
-            else:
-                non_finished_batch.append(i)
-        non_finished = torch.tensor(non_finished_batch)
+        self.top_beam_finished |= self.is_finished[:, 0]
+        self._update_best(step - 1)
+        non_finished = self._store_finished()
         # If all sentences are translated, no need to go further.
         if len(non_finished) == 0:
             self.done = True
@@ -241,22 +291,30 @@ class BeamSearch(DecodeStrategy):
 
         _B_new = non_finished.shape[0]
         # Remove finished batches for the next step.
-        self.top_beam_finished = self.top_beam_finished.index_select(
-            0, non_finished)
-        self._batch_offset = self._batch_offset.index_select(0, non_finished)
-        non_finished = non_finished.to(self.topk_ids.device)
+        self._select_sentences(non_finished, step - 1)
         self.topk_log_probs = self.topk_log_probs.index_select(0,
                                                                non_finished)
         self._batch_index = self._batch_index.index_select(0, non_finished)
         self.select_indices = self._batch_index.view(_B_new * self.beam_size)
-        self.alive_seq = predictions.index_select(0, non_finished) \
-            .view(-1, self.alive_seq.size(-1))
+        paths = self._paths(non_finished)
+        if _B_new < _B_old:
+            self._seq_buffers = [
+                compact_buffer(self._seq_buffers[0], step, paths),
+                self._seq_buffers[1].new_empty(
+                    self._seq_buffers[1].size(0), paths.size(0))]
+            self.alive_seq = self._seq_buffers[0][:step].t()
+        self.select_repeated_ngram(paths)
         self.topk_scores = self.topk_scores.index_select(0, non_finished)
         self.topk_ids = self.topk_ids.index_select(0, non_finished)
         if self.alive_attn is not None:
             inp_seq_len = self.alive_attn.size(-1)
-            self.alive_attn = attention.index_select(1, non_finished) \
-                .view(step - 1, _B_new * self.beam_size, inp_seq_len)
+            if _B_new < _B_old:
+                self._attn_buffers = [
+                    compact_buffer(self._attn_buffers[0], step - 1, paths),
+                    self._attn_buffers[1].new_empty(
+                        (self._attn_buffers[1].size(0), paths.size(0),
+                         inp_seq_len))]
+                self.alive_attn = self._attn_buffers[0][:step - 1]
             if self._cov_pen:
                 self._coverage = self._coverage \
                     .view(1, _B_old, self.beam_size, inp_seq_len) \
@@ -265,3 +323,122 @@ class BeamSearch(DecodeStrategy):
                 if self._stepwise_cov_pen:
                     self._prev_penalty = self._prev_penalty.index_select(
                         0, non_finished)
+
+    def _paths(self, index):
+        """The rows of the beams of the sentences ``index``."""
+        return (index.unsqueeze(1) * self.beam_size
+                + torch.arange(self.beam_size, device=index.device)).view(-1)
+
+    def _store_finished(self):
+        """Move the ``n_best`` hypotheses of the finished sentences to
+        ``scores``, ``predictions`` and ``attention``, and return the
+        index of the other sentences.
+
+        A sentence is finished once its top beam finished and it has
+        ``n_best`` hypotheses.
+        """
+        finished = self.top_beam_finished & self._n_finished.ge(self.n_best)
+        finished_batch = finished.nonzero().view(-1).tolist()
+        if finished_batch:
+            batch_offset = self._batch_offset.tolist()
+            best_lengths = self._best_lengths.tolist()
+            best_slots = self._best_slots.tolist()
+            memory_lengths = self._memory_lengths.tolist()
+        for i in finished_batch:
+            b = batch_offset[i]
+            for n, slot in enumerate(best_slots[i]):
+                length = best_lengths[i][slot]
+                self.scores[b].append(self.best_scores[i, n])
+                self.predictions[b].append(
+                    self._best_seq[:length, i, slot].clone())
+                self.attention[b].append(
+                    self._best_attn[:length, i, slot, :memory_lengths[i]]
+                    .clone() if self._best_attn is not None else [])
+        return finished.eq(0).nonzero().view(-1)
+
+    def _select_sentences(self, index, length):
+        """Keep the per sentence state of the sentences ``index``, the
+        finished hypotheses having at most ``length`` tokens."""
+        self.top_beam_finished = self.top_beam_finished.index_select(
+            0, index)
+        self._n_finished = self._n_finished.index_select(0, index)
+        self.best_scores = self.best_scores.index_select(0, index)
+        self._best_lengths = self._best_lengths.index_select(0, index)
+        self._best_slots = self._best_slots.index_select(0, index)
+        self._batch_offset = self._batch_offset.index_select(0, index.cpu())
+        self._memory_lengths = self._memory_lengths.index_select(0, index)
+        if index.size(0) < self._best_seq.size(1):
+            self._best_seq = compact_buffer(self._best_seq, length, index)
+            if self._best_attn is not None:
+                self._best_attn = compact_buffer(
+                    self._best_attn, length, index)
+
+    def _hypotheses(self, rows, beams, length):
+        """The lengths, predictions and attention (or ``None``) of the
+        hypotheses of the beams ``beams`` of the sentences ``rows``,
+        finished at this step with ``length`` tokens.
+
+        The predictions and attention are time major, with at least as
+        many steps as the longest hypothesis.
+        """
+        _B = self.topk_scores.size(0)
+        # skip BOS
+        seq = self._seq_buffers[0][1:length + 1].view(
+            length, _B, self.beam_size)[:, rows, beams]
+        attn = None
+        if self.alive_attn is not None:
+            attn = self.alive_attn.view(
+                length, _B, self.beam_size,
+                self.alive_attn.size(-1))[:, rows, beams]
+        return seq.new_full([rows.size(0)], length), seq, attn
+
+    def _update_best(self, length):
+        """Merge the hypotheses finished at this step into the ``n_best``
+        best hypotheses of each sentence, ``length`` being their number
+        of tokens as given to :func:`_hypotheses()`.
+
+        Each sentence keeps its best hypotheses in ``n_best`` slots, only
+        those entering the best ones are copied, to the slots of those
+        they push out.
+        """
+        _B = self.topk_scores.size(0)
+        scores = torch.cat([self.best_scores, self.topk_scores], 1)
+        valid = torch.cat([
+            torch.arange(self.n_best, device=scores.device).unsqueeze(0)
+            .lt(self._n_finished.unsqueeze(1)),
+            self.is_finished], 1)
+        # Rank the hypotheses like a stable sort on the scores, the kept
+        # ones before those of this step and each before the missing
+        # ones: ``better[:, l, k]`` is whether l goes before k.
+        order = torch.arange(scores.size(1), device=scores.device)
+        same_valid = valid.unsqueeze(2).eq(valid.unsqueeze(1))
+        same_score = scores.unsqueeze(2).eq(scores.unsqueeze(1))
+        better = valid.unsqueeze(2).gt(valid.unsqueeze(1)) | (same_valid & (
+            scores.unsqueeze(2).gt(scores.unsqueeze(1))
+            | (same_score & order.unsqueeze(1).lt(order.unsqueeze(0)))))
+        best = better.sum(1).sort(1)[1][:, :self.n_best]
+        self.best_scores = scores.gather(1, best).masked_fill(
+            valid.gather(1, best).eq(0), float("-inf"))
+        self._n_finished += self.is_finished.sum(1)
+
+        entering = best.ge(self.n_best)
+        kept = torch.zeros_like(valid).scatter_(1, best, 1)[:, :self.n_best]
+        # the slots of the pushed out hypotheses first
+        free_slots = self._best_slots.gather(1, kept.sort(1)[1])
+        entering_idx = (entering.long().cumsum(1) - 1).clamp(min=0)
+        self._best_slots = torch.where(
+            entering, free_slots.gather(1, entering_idx),
+            self._best_slots.gather(1, best.clamp(max=self.n_best - 1)))
+        rows, ranks = entering.nonzero().t()
+        if rows.numel() == 0:
+            return
+        slots = self._best_slots[rows, ranks]
+        beams = best[rows, ranks] - self.n_best
+        lengths, seq, attn = self._hypotheses(rows, beams, length)
+        self._best_lengths[rows, slots] = lengths
+        self._best_seq[:seq.size(0), rows, slots] = seq
+        if attn is not None:
+            if self._best_attn is None:
+                self._best_attn = attn.new_zeros(
+                    [self.max_length, _B, self.n_best, attn.size(-1)])
+            self._best_attn[:attn.size(0), rows, slots] = attn
@@ -0,0 +1,268 @@
+from collections import defaultdict
+
+import torch
+
+from onmt.translate.beam_search import BeamSearch
+from onmt.utils.misc import pad_or_narrow
+
+
+class ContinuousBeamSearch(BeamSearch):
+    """Beam search over a set of sentences that changes while decoding.
+
+    Unlike :class:`onmt.translate.BeamSearch`, the sentences are not all
+    started at once: :func:`add()` starts new sentences at any step, e.g.
+    to take the rows freed by finished ones. Each sentence keeps its own
+    step count for the length constraints and penalty. Sentences are
+    identified by the ids given to :func:`add()` and their results are
+    stored in ``self.results`` once finished. The finished hypotheses
+    are ranked and stored as in :class:`onmt.translate.BeamSearch`.
+
+    The rows of the live sentences are those of the beams added and not
+    finished yet, in the order they were added. ``alive_seq`` holds the
+    predictions of all of them, aligned on the current step: a sentence
+    started at column ``c`` of ``alive_seq`` has padding before ``c``
+    and its BOS at ``c``.
+
+    Args:
+        beam_size (int): Number of beams to use (see base
+            ``parallel_paths``).
+        pad (int): See base.
+        bos (int): See base.
+        eos (int): See base.
+        n_best (int): Don't stop until at least this many beams have
+            reached EOS.
+        mb_device (torch.device or str): See base ``device``.
+        global_scorer (onmt.translate.GNMTGlobalScorer): Scorer instance,
+            without coverage penalty.
+        min_length (int): See base.
+        max_length (int): See base.
+        return_attention (bool): See base.
+        block_ngram_repeat (int): See base.
+        exclusion_tokens (set[int]): See base.
+
+    Attributes:
+        sent_ids (list): Shape ``(B,)``, ids of the live sentences.
+        start (LongTensor): Shape ``(B,)``, column of the BOS of each
+            live sentence in ``alive_seq``.
+        memory_lengths (LongTensor): Shape ``(B x beam_size,)``.
+        results (dict): Maps the ids of the finished sentences to their
+            ``(scores, predictions, attention)`` lists of ``n_best``
+            entries.
+    """
+
+    def __init__(self, beam_size, pad, bos, eos, n_best, mb_device,
+                 global_scorer, min_length, max_length, return_attention,
+                 block_ngram_repeat, exclusion_tokens):
+        assert not global_scorer.has_cov_pen
+        super(ContinuousBeamSearch, self).__init__(
+            beam_size, 0, pad, bos, eos, n_best, mb_device, global_scorer,
+            min_length, max_length, return_attention, block_ngram_repeat,
+            exclusion_tokens,
+            torch.zeros([0], dtype=torch.long, device=mb_device), False)
+        self.device = mb_device
+        # alive_seq grows with the steps rather than in preallocated
+        # buffers, the sentences not being aligned
+        self._seq_buffers = None
+        # the finished hypotheses are kept by sentence id until moved to
+        # the results
+        self.scores = defaultdict(list)
+        self.predictions = defaultdict(list)
+        self.attention = defaultdict(list)
+        self.results = {}
+        self.start = torch.zeros([0], dtype=torch.long, device=mb_device)
+
+    def __len__(self):
+        return self._batch_offset.size(0)
+
+    @property
+    def sent_ids(self):
+        return self._batch_offset.tolist()
+
+    @property
+    def memory_lengths(self):
+        return self._memory_lengths.repeat_interleave(self.beam_size)
+
+    def add(self, sent_ids, memory_lengths):
+        """Start new sentences on new rows after the live ones.
+
+        Args:
+            sent_ids (list): ids of the new sentences.
+            memory_lengths (LongTensor): Shape ``(len(sent_ids),)``.
+        """
+        n_new = len(sent_ids)
+        n_paths = n_new * self.beam_size
+        n_steps = self.alive_seq.size(1)
+        new_seq = self.alive_seq.new_full([n_paths, n_steps], self.pad)
+        new_seq[:, -1] = self.bos
+        self.alive_seq = torch.cat([self.alive_seq, new_seq], 0)
+        if self.repeated_ngram is not None:
+            self.repeated_ngram = torch.cat([
+                self.repeated_ngram,
+                self.repeated_ngram.new_zeros([n_paths])])
+        if self.alive_attn is not None:
+            self.alive_attn = torch.cat([
+                self.alive_attn,
+                self.alive_attn.new_zeros(
+                    n_steps - 1, n_paths, self.alive_attn.size(-1))], 1)
+        self.topk_log_probs = torch.cat([
+            self.topk_log_probs,
+            torch.tensor([0.0] + [float("-inf")] * (self.beam_size - 1),
+                         device=self.device).repeat(n_new)])
+
+        # per sentence state, as set up by BeamSearch
+        self._batch_offset = torch.cat([
+            self._batch_offset, torch.tensor(sent_ids, dtype=torch.long)])
+        self.start = torch.cat([
+            self.start,
+            self.start.new_full([n_new], n_steps - 1)])
+        self._memory_lengths = torch.cat([
+            self._memory_lengths, memory_lengths])
+        self.top_beam_finished = torch.cat([
+            self.top_beam_finished,
+            self.top_beam_finished.new_zeros([n_new])])
+        self._n_finished = torch.cat([
+            self._n_finished, self._n_finished.new_zeros([n_new])])
+        self.best_scores = torch.cat([
+            self.best_scores,
+            self.best_scores.new_full([n_new, self.n_best], float("-inf"))])
+        self._best_lengths = torch.cat([
+            self._best_lengths,
+            self._best_lengths.new_zeros([n_new, self.n_best])])
+        self._best_slots = torch.cat([
+            self._best_slots,
+            torch.arange(self.n_best, device=self.device).repeat(n_new, 1)])
+        self._best_seq = torch.cat([
+            self._best_seq,
+            self._best_seq.new_full(
+                [self.max_length, n_new, self.n_best], self.pad)], 1)
+        if self._best_attn is not None:
+            self._best_attn = torch.cat([
+                self._best_attn,
+                self._best_attn.new_zeros(
+                    [self.max_length, n_new, self.n_best,
+                     self._best_attn.size(-1)])], 1)
+        self.done = False
+
+    def ensure_min_length(self, log_probs, steps):
+        too_short = steps.le(self.min_length)
+        if too_short.any():
+            log_probs[too_short.repeat_interleave(self.beam_size),
+                      self.eos] = -1e20
+
+    def advance(self, log_probs, attn):
+        vocab_size = log_probs.size(-1)
+        _B = len(self)
+
+        # tokens of each sentence so far, BOS included
+        steps = self.alive_seq.size(1) - self.start
+
+        # force the output to be longer than self.min_length
+        self.ensure_min_length(log_probs, steps)
+
+        # Multiply probs by the beam probability.
+        log_probs += self.topk_log_probs.view(_B * self.beam_size, 1)
+
+        self.block_ngram_repeats(
+            log_probs, start=self.start.repeat_interleave(self.beam_size))
+
+        # if the sequence ends now, then the penalty is the current
+        # length + 1, to include the EOS token
+        length_penalty = self.global_scorer.length_penalty(
+            (steps + 1).float(), alpha=self.global_scorer.alpha)
+        if not torch.is_tensor(length_penalty):
+            length_penalty = torch.full(
+                [_B], length_penalty, device=log_probs.device)
+        length_penalty = length_penalty.view(_B, 1)
+
+        # Flatten probs into a list of possibilities.
+        curr_scores = log_probs.view(_B, self.beam_size * vocab_size) \
+            / length_penalty
+        self.topk_scores, self.topk_ids = torch.topk(
+            curr_scores, self.beam_size, dim=-1)
+
+        # Recover log probs.
+        self.topk_log_probs = (self.topk_scores * length_penalty).view(-1)
+
+        # Resolve beam origin and map to batch index flat representation.
+        beam_offset = torch.arange(
+            0, _B * self.beam_size, step=self.beam_size, dtype=torch.long,
+            device=self.topk_ids.device)
+        self.select_indices = (self.topk_ids // vocab_size
+                               + beam_offset.unsqueeze(1)).view(-1)
+        self.select_repeated_ngram(self.select_indices)
+
+        self.topk_ids.fmod_(vocab_size)  # resolve true word ids
+
+        # Append last prediction.
+        self.alive_seq = torch.cat(
+            [self.alive_seq.index_select(0, self.select_indices),
+             self.topk_ids.view(_B * self.beam_size, 1)], -1)
+        if self.return_attention:
+            current_attn = attn.index_select(1, self.select_indices)
+            if self.alive_attn is None:
+                self.alive_attn = current_attn.new_zeros(
+                    self.alive_seq.size(1) - 2, _B * self.beam_size,
+                    current_attn.size(-1))
+            # the memory bank may have grown or shrunk
+            self.alive_attn = pad_or_narrow(self.alive_attn.index_select(
+                1, self.select_indices), current_attn.size(-1), 2)
+            self.alive_attn = torch.cat([self.alive_attn, current_attn], 0)
+            if self._best_attn is not None:
+                self._best_attn = pad_or_narrow(
+                    self._best_attn, current_attn.size(-1), 3)
+
+        self.is_finished = self.topk_ids.eq(self.eos)
+        # add one to account for BOS, see ensure_max_length()
+        too_long = (self.alive_seq.size(1) - self.start).eq(
+            self.max_length + 1)
+        self.is_finished[too_long] = 1
+
+    def update_finished(self):
+        self.topk_log_probs.masked_fill_(self.is_finished.view(-1), -1e10)
+        self.top_beam_finished |= self.is_finished[:, 0]
+        # tokens of each sentence so far, BOS excluded
+        self._update_best(self.alive_seq.size(1) - 1 - self.start)
+        non_finished = self._store_finished()
+        for sent_id in list(self.scores):
+            self.results[sent_id] = (self.scores.pop(sent_id),
+                                     self.predictions.pop(sent_id),
+                                     self.attention.pop(sent_id))
+
+        # Remove finished sentences for the next step.
+        self._select_sentences(non_finished, self.max_length)
+        paths = self._paths(non_finished)
+        self.select_indices = self.select_indices.index_select(0, paths)
+        self.topk_log_probs = self.topk_log_probs.index_select(0, paths)
+        self.start = self.start.index_select(0, non_finished)
+        self.alive_seq = self.alive_seq.index_select(0, paths)
+        self.select_repeated_ngram(paths)
+        if self.alive_attn is not None:
+            self.alive_attn = self.alive_attn.index_select(1, paths)
+        if len(self) == 0:
+            self.done = True
+            return
+
+        # drop the columns before the oldest live sentence
+        first = int(self.start.min())
+        if first > 0:
+            self.alive_seq = self.alive_seq[:, first:]
+            if self.alive_attn is not None:
+                self.alive_attn = self.alive_attn[first:]
+            self.start -= first
+
+    def _hypotheses(self, rows, beams, length):
+        lengths = length[rows]
+        steps = torch.arange(int(lengths.max()), device=lengths.device)
+        # the columns of their tokens in alive_seq, after their BOS,
+        # those past their lengths are not used
+        columns = (self.start[rows].unsqueeze(1) + 1 + steps).clamp(
+            max=self.alive_seq.size(1) - 1)
+        paths = rows * self.beam_size + beams
+        seq = self.alive_seq[paths].gather(1, columns).t()
+        attn = None
+        if self.alive_attn is not None:
+            # the attention of column c is at step c - 1 of alive_attn
+            attn = self.alive_attn[:, paths].gather(
+                0, (columns - 1).t().unsqueeze(2).expand(
+                    -1, -1, self.alive_attn.size(-1)))
+        return lengths, seq, attn
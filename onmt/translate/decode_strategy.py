@@ -1,6 +1,15 @@
 import torch
 
 
+def compact_buffer(buffer, length, index):
+    """Return a buffer like ``buffer`` holding the paths ``index`` (along
+    dim 1) of its first ``length`` steps."""
+    compacted = buffer.new_empty((buffer.size(0), index.size(0))
+                                 + buffer.shape[2:])
+    torch.index_select(buffer[:length], 1, index, out=compacted[:length])
+    return compacted
+
+
 class DecodeStrategy(object):
     """Base class for generation strategies.
 
@@ -50,6 +59,9 @@ class DecodeStrategy(object):
         max_length (int): See above.
         block_ngram_repeat (int): See above.
         exclusion_tokens (set[int]): See above.
+        repeated_ngram (ByteTensor or NoneType): Shape
+            ``(B x parallel_paths,)``, whether the hypothesis of each path
+            repeats an n-gram, see :func:`block_ngram_repeats()`.
         return_attention (bool): See above.
         done (bool): See above.
     """
@@ -80,6 +92,9 @@ class DecodeStrategy(object):
         self.max_length = max_length
         self.block_ngram_repeat = block_ngram_repeat
         self.exclusion_tokens = exclusion_tokens
+        self._exclusion_tensor = torch.tensor(
+            sorted(exclusion_tokens), dtype=torch.long, device=device)
+        self.repeated_ngram = None
         self.return_attention = return_attention
 
         self.done = False
@@ -87,6 +102,19 @@ class DecodeStrategy(object):
     def __len__(self):
         return self.alive_seq.shape[1]
 
+    def seq_buffer(self, n_paths, device):
+        """Preallocate a time major buffer for the predictions of
+        ``n_paths`` paths, with the BOS at step 0.
+
+        Subclasses write the steps in place and keep ``alive_seq`` as a
+        transposed view of the steps so far, so that long outputs don't
+        reallocate and copy the whole history at each step.
+        """
+        buffer = torch.full([self.max_length + 1, n_paths], self.pad,
+                            dtype=torch.long, device=device)
+        buffer[0] = self.bos
+        return buffer
+
     def ensure_min_length(self, log_probs):
         if len(self) <= self.min_length:
             log_probs[:, self.eos] = -1e20
@@ -97,26 +125,54 @@ class DecodeStrategy(object):
         if len(self) == self.max_length + 1:
             self.is_finished.fill_(1)
 
-    def block_ngram_repeats(self, log_probs):
-        cur_len = len(self)
-        if self.block_ngram_repeat > 0 and cur_len > 1:
-            for path_idx in range(self.alive_seq.shape[0]):
-                # skip BOS
-                hyp = self.alive_seq[path_idx, 1:]
-                ngrams = set()
-                fail = False
-                gram = []
-                for i in range(cur_len - 1):
-                    # Last n tokens, n = block_ngram_repeat
-                    gram = (gram + [hyp[i].item()])[-self.block_ngram_repeat:]
-                    # skip the blocking if any token in gram is excluded
-                    if set(gram) & self.exclusion_tokens:
-                        continue
-                    if tuple(gram) in ngrams:
-                        fail = True
-                    ngrams.add(tuple(gram))
-                if fail:
-                    log_probs[path_idx] = -10e20
+    def block_ngram_repeats(self, log_probs, start=None):
+        """Block the paths whose hypothesis repeats a
+        ``block_ngram_repeat``-gram.
+
+        Rather than going through each hypothesis, ``repeated_ngram``
+        remembers which paths already repeated an n-gram, so only the
+        last n-gram of each path is compared with its previous ones.
+        Subclasses reordering or dropping paths must call
+        :func:`select_repeated_ngram()` accordingly.
+
+        Args:
+            log_probs (FloatTensor): Shape ``(B x parallel_paths, vocab)``,
+                the log probs of the blocked paths are set to ``-10e20``.
+            start (LongTensor or NoneType): Shape
+                ``(B x parallel_paths,)``, column of the BOS of each path
+                in ``alive_seq``, ``0`` by default.
+        """
+        n = self.block_ngram_repeat
+        if n <= 0:
+            return
+        n_paths, cur_len = self.alive_seq.shape
+        if self.repeated_ngram is None:
+            self.repeated_ngram = torch.zeros(
+                [n_paths], dtype=torch.uint8, device=self.alive_seq.device)
+        # the n-grams after the BOS, the last one included
+        n_grams = cur_len - n
+        if n_grams > 1:
+            # (B x parallel_paths, n_grams + 1, n), the first n-gram of
+            # ``alive_seq`` starts with the BOS
+            grams = self.alive_seq.unfold(1, n, 1)
+            last = grams[:, -1:]
+            repeated = grams[:, :-1].eq(last).all(-1)
+            first = 1 if start is None else (start + 1).unsqueeze(1)
+            gram_idx = torch.arange(
+                n_grams, dtype=torch.long, device=self.alive_seq.device)
+            repeated = (repeated & gram_idx.ge(first)).any(-1)
+            if self.exclusion_tokens:
+                # grams containing excluded tokens may repeat
+                repeated &= last.view(-1, n, 1).eq(
+                    self._exclusion_tensor).any(-1).any(-1).eq(0)
+            self.repeated_ngram |= repeated
+        log_probs.masked_fill_(self.repeated_ngram.unsqueeze(1), -10e20)
+
+    def select_repeated_ngram(self, index):
+        """Keep ``repeated_ngram`` aligned with the paths of
+        ``alive_seq`` once these are reordered by ``index``."""
+        if self.repeated_ngram is not None:
+            self.repeated_ngram = self.repeated_ngram.index_select(0, index)
 
     def advance(self, log_probs, attn):
         """DecodeStrategy subclasses should override :func:`advance()`.
@@ -0,0 +1,78 @@
+""" LRU cache of encoder outputs """
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+def _nbytes(value):
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    if torch.is_tensor(value):
+        return value.element_size() * value.nelement()
+    return 0
+
+
+class EncoderCache(object):
+    """Bounded LRU cache of the encoder outputs of source batches.
+
+    Keys are ``(model_id, sources)`` where ``sources`` is the tuple of
+    tokenized source sentences of a batch, so that translating the same
+    input again, e.g. to another level, reuses the memory bank instead of
+    running the encoder. Entries are evicted least recently used first
+    once the tensors they hold take more than ``max_bytes``. The cache is
+    shared between threads.
+
+    Args:
+        max_bytes (int): memory budget of the cached tensors.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the cached value of ``key`` or ``None``."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        """Cache ``value`` (nested tuples of tensors) under ``key``."""
+        nbytes = _nbytes(value)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted_nbytes) = self._entries.popitem(last=False)
+                self.nbytes -= evicted_nbytes
+
+    def discard(self, model_id):
+        """Drop the entries of ``model_id``, e.g. when it moves to
+        another device."""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == model_id]:
+                self.nbytes -= self._entries.pop(key)[1]
+
+    def stats(self):
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self.nbytes,
+                "max_bytes": self.max_bytes}
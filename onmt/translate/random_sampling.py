@@ -1,6 +1,6 @@
 import torch
 
-from onmt.translate.decode_strategy import DecodeStrategy
+from onmt.translate.decode_strategy import DecodeStrategy, compact_buffer
 
 
 def sample_with_temperature(logits, sampling_temp, keep_topk):
@@ -100,6 +100,10 @@ class RandomSampling(DecodeStrategy):
                                            dtype=torch.long, device=device)
         self.original_batch_idx = torch.arange(self.batch_size,
                                                dtype=torch.long, device=device)
+        # preallocated buffers of alive_seq and alive_attn
+        self._seq_buffer = self.seq_buffer(batch_size, device)
+        self.alive_seq = self._seq_buffer[:1].t()
+        self._attn_buffer = None
 
     def advance(self, log_probs, attn):
         """Select next tokens randomly from the top k possible next tokens.
@@ -121,12 +125,15 @@ class RandomSampling(DecodeStrategy):
 
         self.is_finished = topk_ids.eq(self.eos)
 
-        self.alive_seq = torch.cat([self.alive_seq, topk_ids], -1)
+        step = len(self)
+        self._seq_buffer[step] = topk_ids.view(-1)
+        self.alive_seq = self._seq_buffer[:step + 1].t()
         if self.return_attention:
-            if self.alive_attn is None:
-                self.alive_attn = attn
-            else:
-                self.alive_attn = torch.cat([self.alive_attn, attn], 0)
+            if self._attn_buffer is None:
+                self._attn_buffer = attn.new_empty(
+                    (self.max_length,) + attn.shape[1:])
+            self._attn_buffer[step - 1] = attn[0]
+            self.alive_attn = self._attn_buffer[:step]
         self.ensure_max_length()
 
     def update_finished(self):
@@ -136,16 +143,22 @@ class RandomSampling(DecodeStrategy):
         for b in finished_batches.view(-1):
             b_orig = self.original_batch_idx[b]
             self.scores[b_orig].append(self.topk_scores[b, 0])
-            self.predictions[b_orig].append(self.alive_seq[b, 1:])
+            self.predictions[b_orig].append(self.alive_seq[b, 1:].clone())
             self.attention[b_orig].append(
-                self.alive_attn[:, b, :self.memory_length[b]]
+                self.alive_attn[:, b, :self.memory_length[b]].clone()
                 if self.alive_attn is not None else [])
         self.done = self.is_finished.all()
         if self.done:
             return
         is_alive = ~self.is_finished.view(-1)
-        self.alive_seq = self.alive_seq[is_alive]
-        if self.alive_attn is not None:
-            self.alive_attn = self.alive_attn[:, is_alive]
         self.select_indices = is_alive.nonzero().view(-1)
+        step = len(self)
+        self._seq_buffer = compact_buffer(
+            self._seq_buffer, step, self.select_indices)
+        self.alive_seq = self._seq_buffer[:step].t()
+        if self.alive_attn is not None:
+            self._attn_buffer = compact_buffer(
+                self._attn_buffer, step - 1, self.select_indices)
+            self.alive_attn = self._attn_buffer[:step - 1]
+        self.select_repeated_ngram(self.select_indices)
         self.original_batch_idx = self.original_batch_idx[is_alive]
@@ -31,24 +31,70 @@ class TranslationBuilder(object):
         self.replace_unk = replace_unk
         self.has_tgt = has_tgt
 
-    def _build_target_tokens(self, src, src_vocab, src_raw, pred, attn):
         tgt_field = dict(self.fields)["tgt"].base_field
-        vocab = tgt_field.vocab
-        tokens = []
-        for tok in pred:
-            if tok < len(vocab):
-                tokens.append(vocab.itos[tok])
-            else:
-                tokens.append(src_vocab.itos[tok - len(vocab)])
-            if tokens[-1] == tgt_field.eos_token:
-                tokens = tokens[:-1]
-                break
-        if self.replace_unk and attn is not None and src is not None:
-            for i in range(len(tokens)):
-                if tokens[i] == tgt_field.unk_token:
-                    _, max_index = attn[i].max(0)
-                    tokens[i] = src_raw[max_index.item()]
-        return tokens
+        self._tgt_itos = tgt_field.vocab.itos
+        self._tgt_pad_idx = tgt_field.vocab.stoi[tgt_field.pad_token]
+        self._eos_token = tgt_field.eos_token
+        self._unk_token = tgt_field.unk_token
+        self._eos_idx = tgt_field.vocab.stoi[self._eos_token]
+        self._unk_idx = tgt_field.vocab.stoi[self._unk_token]
+
+    def _copy_idx(self, src_vocab, token):
+        """Extended vocabulary id of ``token`` when copied from the source,
+        -1 if it is not in ``src_vocab``."""
+        if src_vocab is None or token not in src_vocab.stoi:
+            return -1
+        return len(self._tgt_itos) + src_vocab.stoi[token]
+
+    def _build_target_tokens(self, ids, lengths, src_vocabs, src_raws,
+                             attn=None):
+        """Turn rows of token ids into lists of tokens.
+
+        EOS, the unknown tokens to replace and their source positions are
+        found on the device for all the rows at once, the strings are only
+        looked up at the end.
+
+        Args:
+            ids (LongTensor): Shape ``(N, L)``, ids in the target vocabulary
+                extended with the source vocabulary of each row.
+            lengths (LongTensor): Shape ``(N,)``, number of ids of each row.
+            src_vocabs (list): ``N`` source vocabularies, or ``None``.
+            src_raws (list): ``N`` raw source sentences, or ``None``.
+            attn (FloatTensor or NoneType): Shape ``(N, L, src_len)``,
+                attention used to replace the unknown tokens.
+
+        Returns:
+            list[list[str]]: the tokens of each row, up to its first EOS.
+        """
+        n_tgt = len(self._tgt_itos)
+        pos = torch.arange(ids.size(1), device=ids.device)
+        copy_eos = ids.new_tensor(
+            [self._copy_idx(v, self._eos_token) for v in src_vocabs])
+        is_eos = ids.eq(self._eos_idx) | ids.eq(copy_eos.unsqueeze(1))
+        # tokens before the first EOS
+        lengths = torch.min(is_eos.long().cumsum(1).eq(0).sum(1), lengths)
+
+        replaced = []
+        if attn is not None:
+            copy_unk = ids.new_tensor(
+                [self._copy_idx(v, self._unk_token) for v in src_vocabs])
+            is_unk = (ids.eq(self._unk_idx) | ids.eq(copy_unk.unsqueeze(1))) \
+                & pos.unsqueeze(0).lt(lengths.unsqueeze(1))
+            unk_pos = is_unk.nonzero()
+            if unk_pos.size(0) > 0:
+                src_pos = attn[unk_pos[:, 0], unk_pos[:, 1]].max(1)[1]
+                replaced = zip(unk_pos.tolist(), src_pos.tolist())
+
+        itos = self._tgt_itos
+        all_tokens = []
+        for row, length, src_vocab in zip(
+                ids.tolist(), lengths.tolist(), src_vocabs):
+            all_tokens.append([
+                itos[tok] if tok < n_tgt else src_vocab.itos[tok - n_tgt]
+                for tok in row[:length]])
+        for (i, j), src_pos in replaced:
+            all_tokens[i][j] = src_raws[i][src_pos]
+        return all_tokens
 
     def from_batch(self, translation_batch):
         batch = translation_batch["batch"]
@@ -56,48 +102,62 @@ class TranslationBuilder(object):
                len(translation_batch["predictions"]))
         batch_size = batch.batch_size
 
-        preds, pred_score, attn, gold_score, indices = list(zip(
-            *sorted(zip(translation_batch["predictions"],
-                        translation_batch["scores"],
-                        translation_batch["attention"],
-                        translation_batch["gold_score"],
-                        batch.indices.data),
-                    key=lambda x: x[-1])))
-
         # Sorting
         inds, perm = torch.sort(batch.indices)
+        order = perm.tolist()
+        preds, pred_score, attn, gold_score = (
+            [translation_batch[key][i] for i in order]
+            for key in ("predictions", "scores", "attention", "gold_score"))
         if self._has_text_src:
             src = batch.src[0][:, :, 0].index_select(1, perm)
+            src_vocabs = [self.data.src_vocabs[i] for i in inds.tolist()] \
+                if self.data.src_vocabs else [None] * batch_size
+            src_raws = [self.data.example(i).src[0] for i in inds.tolist()]
         else:
             src = None
+            src_vocabs = [None] * batch_size
+            src_raws = None
         tgt = batch.tgt[:, :, 0].index_select(1, perm) \
             if self.has_tgt else None
 
+        # all the n-best predictions, padded into a single tensor
+        seqs = [pred for b in range(batch_size)
+                for pred in preds[b][:self.n_best]]
+        pred_ids = seqs[0].new_full(
+            [len(seqs), max(seq.size(0) for seq in seqs)], self._tgt_pad_idx)
+        for i, seq in enumerate(seqs):
+            pred_ids[i, :seq.size(0)] = seq
+        pred_attn = None
+        if self.replace_unk and src is not None:
+            attns = [a for b in range(batch_size)
+                     for a in attn[b][:self.n_best]]
+            pred_attn = attns[0].new_full(
+                [len(seqs), pred_ids.size(1),
+                 max(a.size(1) for a in attns)], float("-inf"))
+            for i, a in enumerate(attns):
+                pred_attn[i, :a.size(0), :a.size(1)] = a
+        pred_sents = self._build_target_tokens(
+            pred_ids, pred_ids.new_tensor([seq.size(0) for seq in seqs]),
+            [v for v in src_vocabs for _ in range(self.n_best)],
+            [r for r in src_raws for _ in range(self.n_best)]
+            if src_raws is not None else None,
+            pred_attn)
+        gold_sents = None
+        if tgt is not None:
+            gold_ids = tgt[1:].t()
+            gold_sents = self._build_target_tokens(
+                gold_ids, gold_ids.new_full([batch_size], gold_ids.size(1)),
+                src_vocabs, src_raws)
+
         translations = []
         for b in range(batch_size):
-            if self._has_text_src:
-                src_vocab = self.data.src_vocabs[inds[b]] \
-                    if self.data.src_vocabs else None
-                src_raw = self.data.examples[inds[b]].src[0]
-            else:
-                src_vocab = None
-                src_raw = None
-            pred_sents = [self._build_target_tokens(
-                src[:, b] if src is not None else None,
-                src_vocab, src_raw,
-                preds[b][n], attn[b][n])
-                for n in range(self.n_best)]
-            gold_sent = None
-            if tgt is not None:
-                gold_sent = self._build_target_tokens(
-                    src[:, b] if src is not None else None,
-                    src_vocab, src_raw,
-                    tgt[1:, b] if tgt is not None else None, None)
-
             translation = Translation(
                 src[:, b] if src is not None else None,
-                src_raw, pred_sents, attn[b], pred_score[b],
-                gold_sent, gold_score[b]
+                src_raws[b] if src_raws is not None else None,
+                pred_sents[b * self.n_best:(b + 1) * self.n_best],
+                attn[b], pred_score[b],
+                gold_sents[b] if gold_sents is not None else None,
+                gold_score[b]
             )
             translations.append(translation)
 
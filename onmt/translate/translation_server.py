@@ -3,11 +3,15 @@
 from __future__ import print_function
 import sys
 import os
+import math
 import time
 import json
 import threading
 import re
 import traceback
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, \
+    TimeoutError as FutureTimeoutError
 
 import torch
 import onmt.opts
@@ -15,7 +19,8 @@ import onmt.opts
 from onmt.utils.logging import init_logger
 from onmt.utils.misc import set_random_seed
 from onmt.utils.parse import ArgumentParser
-from onmt.translate.translator import build_translator
+from onmt.translate.translator import build_translator, load_models
+from onmt.translate.encoder_cache import EncoderCache
 
 
 def critical(func):
@@ -68,10 +73,221 @@ class ServerModelError(Exception):
     pass
 
 
+class ServerModelLoading(ServerModelError):
+    """The model is being loaded in the background, retry in
+    `retry_after` seconds."""
+
+    def __init__(self, model_id, retry_after):
+        super(ServerModelLoading, self).__init__(
+            "Model %d is loading, retry in %d s" % (model_id, retry_after))
+        self.model_id = model_id
+        self.retry_after = retry_after
+
+
+class _Request(object):
+    """Inputs of a caller waiting in a :class:`BatchingQueue`."""
+
+    def __init__(self, inputs):
+        self.inputs = inputs
+        self.n_tokens = sum(len(inp["src"].split()) for inp in inputs)
+        self.done = threading.Event()
+        self.output = None
+        self.error = None
+
+
+class BatchingQueue(object):
+    """Merge the requests of concurrent callers into larger batches.
+
+    A worker thread takes the oldest pending request, then keeps adding
+    the following ones until their source tokens would exceed
+    `max_tokens` or `max_wait` seconds have passed since it started the
+    batch. The merged inputs go through a single call to `run` and the
+    results are handed back to each caller.
+
+    Args:
+        run (callable): translates a list of inputs like
+            :func:`ServerModel.run()`
+        max_tokens (int): source token budget of a batch, 0 for no limit
+        max_wait (float): seconds to wait for more requests
+    """
+
+    def __init__(self, run, max_tokens=0, max_wait=0.01):
+        self.run = run
+        self.max_tokens = max_tokens
+        self.max_wait = max_wait
+        self.n_batches = 0
+        self.n_requests = 0
+        self.n_inputs = 0
+        self.last_batch_inputs = 0
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._worker = threading.Thread(target=self._loop, daemon=True)
+        self._worker.start()
+
+    @property
+    def depth(self):
+        """Number of requests waiting for a batch."""
+        return len(self._pending)
+
+    def submit(self, inputs):
+        """Translate `inputs` in the next batch and wait for the result.
+        """
+        request = _Request(inputs)
+        with self._cond:
+            self._pending.append(request)
+            self._cond.notify()
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.output
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            deadline = time.time() + self.max_wait
+            batch = [self._pending.popleft()]
+            n_tokens = batch[0].n_tokens
+            while True:
+                while self._pending:
+                    n_tokens += self._pending[0].n_tokens
+                    if 0 < self.max_tokens < n_tokens:
+                        return batch
+                    batch.append(self._pending.popleft())
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return batch
+                self._cond.wait(remaining)
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            inputs = [inp for request in batch for inp in request.inputs]
+            self.n_batches += 1
+            self.n_requests += len(batch)
+            self.n_inputs += len(inputs)
+            self.last_batch_inputs = len(inputs)
+            try:
+                results, scores, n_best, times = self.run(inputs)
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+                    request.done.set()
+                continue
+            start = 0
+            for request in batch:
+                end = start + len(request.inputs)
+                request.output = (results[start:end], scores[start:end],
+                                  n_best, times)
+                request.done.set()
+                start = end
+
+    def stats(self):
+        return {"depth": self.depth,
+                "batches": self.n_batches,
+                "requests": self.n_requests,
+                "inputs": self.n_inputs,
+                "last_batch_inputs": self.last_batch_inputs,
+                "avg_batch_inputs": (self.n_inputs / self.n_batches
+                                     if self.n_batches else 0)}
+
+
+def model_nbytes(model):
+    """Bytes taken by the parameters and buffers of `model`."""
+    return sum(t.element_size() * t.nelement()
+               for t in list(model.parameters()) + list(model.buffers()))
+
+
+class ModelPool(object):
+    """Memory budget shared by the models of a server.
+
+    Loaded models register the size of their parameters and buffers.
+    Before a model loads, and once its actual size is known, the least
+    recently used models are unloaded until all of them fit in
+    `max_bytes`. Moving a model to CPU does not free host memory, so
+    evicted models are always unloaded. Models that are busy
+    translating are skipped. Evictions are logged and the latest
+    `max_events` are kept in `evictions`.
+
+    Args:
+        max_bytes (int): memory budget of the loaded models.
+        max_events (int): number of eviction events kept.
+    """
+
+    def __init__(self, max_bytes, max_events=100):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.evictions = deque(maxlen=max_events)
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, model_id):
+        return model_id in self._models
+
+    def touch(self, model_id):
+        """Mark `model_id` as the most recently used model."""
+        with self._lock:
+            if model_id in self._models:
+                self._models.move_to_end(model_id)
+
+    def reserve(self, model, nbytes):
+        """Make room for `nbytes` more bytes for `model`."""
+        self._evict(model, nbytes)
+
+    def add(self, model, nbytes):
+        """Register the `nbytes` of the freshly loaded `model`."""
+        with self._lock:
+            if model.model_id in self._models:
+                self.nbytes -= self._models.pop(model.model_id)[1]
+            self._models[model.model_id] = (model, nbytes)
+            self.nbytes += nbytes
+        self._evict(model, 0)
+
+    def release(self, model_id):
+        """Forget the unloaded model `model_id`."""
+        with self._lock:
+            if model_id in self._models:
+                self.nbytes -= self._models.pop(model_id)[1]
+
+    def _evict(self, model, nbytes):
+        busy = set([model.model_id])
+        while True:
+            with self._lock:
+                if self.nbytes + nbytes <= self.max_bytes:
+                    return
+                victims = [(m, n) for m_id, (m, n) in self._models.items()
+                           if m_id not in busy]
+            if len(victims) == 0:
+                model.logger.warning(
+                    "Model pool over budget: %d/%d bytes used, nothing "
+                    "left to evict" % (self.nbytes + nbytes, self.max_bytes))
+                return
+            victim, victim_nbytes = victims[0]
+            busy.add(victim.model_id)
+            if victim.try_unload():
+                model.logger.info(
+                    "Evicted model %d (%d bytes) to make room for model %d"
+                    % (victim.model_id, victim_nbytes, model.model_id))
+                self.evictions.append({"model_id": victim.model_id,
+                                       "nbytes": victim_nbytes,
+                                       "for_model_id": model.model_id,
+                                       "time": time.time()})
+
+    def stats(self):
+        with self._lock:
+            return {"bytes": self.nbytes,
+                    "max_bytes": self.max_bytes,
+                    "models": list(self._models),
+                    "evictions": list(self.evictions)}
+
+
 class TranslationServer(object):
     def __init__(self):
         self.models = {}
         self.next_id = 0
+        self.encoder_cache = None
+        self.loader = None
+        self.pool = None
 
     def start(self, config_file):
         """Read the config file and pre-/load the models."""
@@ -80,6 +296,15 @@ class TranslationServer(object):
             self.confs = json.load(f)
 
         self.models_root = self.confs.get('models_root', './available_models')
+        encoder_cache_mb = self.confs.get('encoder_cache_mb', 0)
+        if encoder_cache_mb > 0:
+            self.encoder_cache = EncoderCache(encoder_cache_mb * 2 ** 20)
+        pool_mb = self.confs.get('pool_mb', 0)
+        if pool_mb > 0:
+            self.pool = ModelPool(pool_mb * 2 ** 20)
+        if self.confs.get('background_loading', False):
+            self.loader = ThreadPoolExecutor(
+                max_workers=self.confs.get('loading_workers', 1))
         for i, conf in enumerate(self.confs["models"]):
             if "models" not in conf:
                 if "model" in conf:
@@ -92,7 +317,10 @@ class TranslationServer(object):
                       'load': conf.get('load', None),
                       'tokenizer_opt': conf.get('tokenizer', None),
                       'on_timeout': conf.get('on_timeout', None),
-                      'model_root': conf.get('model_root', self.models_root)
+                      'model_root': conf.get('model_root', self.models_root),
+                      'batch_tokens': conf.get('batch_tokens', None),
+                      'batch_wait': conf.get('batch_wait', None),
+                      'on_loading': conf.get('on_loading', None)
                       }
             kwargs = {k: v for (k, v) in kwargs.items() if v is not None}
             model_id = conf.get("id", None)
@@ -107,10 +335,15 @@ class TranslationServer(object):
         same set of options
         """
         if model_id in self.models:
+            model = self.models[model_id]
             if opt is None:
-                opt = self.models[model_id].user_opt
-            opt["models"] = self.models[model_id].opt.models
-            return self.load_model(opt, timeout)
+                opt = dict(model.user_opt)
+            opt["models"] = [os.path.abspath(path)
+                             for path in model.opt.models]
+            return self.load_model(opt, load=True, timeout=timeout,
+                                   tokenizer_opt=model.tokenizer_opt,
+                                   model_root=model.model_root,
+                                   shared_from=model.shared_from or model)
         else:
             raise ServerModelError("No such model '%s'" % str(model_id))
 
@@ -118,7 +351,8 @@ class TranslationServer(object):
         """Load a model given a set of options
         """
         model_id = self.preload_model(opt, model_id=model_id, **model_kwargs)
-        load_time = self.models[model_id].load_time
+        # not loaded yet when loading in the background
+        load_time = getattr(self.models[model_id], 'load_time', None)
 
         return model_id, load_time
 
@@ -136,6 +370,9 @@ class TranslationServer(object):
                 model_id += 1
             self.next_id = model_id + 1
         print("Pre-loading model %d" % model_id)
+        model_kwargs.setdefault('encoder_cache', self.encoder_cache)
+        model_kwargs.setdefault('loader', self.loader)
+        model_kwargs.setdefault('pool', self.pool)
         model = ServerModel(opt, model_id, **model_kwargs)
         self.models[model_id] = model
 
@@ -146,16 +383,38 @@ class TranslationServer(object):
 
         We keep the same format as the Lua version i.e.
         ``[{"id": model_id, "src": "sequence to translate"},{ ...}]``
+        with an optional ``"level"`` giving the target level of each
+        item (see :func:`ServerModel.run()`).
 
-        We use inputs[0]["id"] as the model id
+        Items are grouped by model id (0 by default), each model
+        translating its items in one call, and the results are returned
+        in the order of `inputs`.
         """
 
-        model_id = inputs[0].get("id", 0)
-        if model_id in self.models and self.models[model_id] is not None:
+        model_inputs = OrderedDict()
+        for i, inp in enumerate(inputs):
+            model_inputs.setdefault(inp.get("id", 0), []).append(i)
+        for model_id in model_inputs:
+            if model_id not in self.models or self.models[model_id] is None:
+                print("Error No such model '%s'" % str(model_id))
+                raise ServerModelError("No such model '%s'" % str(model_id))
+
+        if len(model_inputs) == 1:
             return self.models[model_id].run(inputs)
-        else:
-            print("Error No such model '%s'" % str(model_id))
-            raise ServerModelError("No such model '%s'" % str(model_id))
+
+        results = [None] * len(inputs)
+        scores = [None] * len(inputs)
+        times = {}
+        for model_id, positions in model_inputs.items():
+            model_results, model_scores, n_best, model_times = \
+                self.models[model_id].run([inputs[i] for i in positions])
+            for i, result, score in zip(
+                    positions, model_results, model_scores):
+                results[i] = result
+                scores[i] = score
+            for name, elapsed in model_times.items():
+                times[name] = times.get(name, 0) + elapsed
+        return results, scores, n_best, times
 
     def unload_model(self, model_id):
         """Manually unload a model.
@@ -168,6 +427,34 @@ class TranslationServer(object):
         else:
             raise ServerModelError("No such model '%s'" % str(model_id))
 
+    def encoder_cache_stats(self):
+        """Return the hit/miss counters and size of the encoder cache
+        """
+        if self.encoder_cache is None:
+            return {}
+        return self.encoder_cache.stats()
+
+    def health(self):
+        """Return the loading state of each model, without waiting for
+        any of them"""
+        states = OrderedDict()
+        for model_id, model in self.models.items():
+            if model.loading:
+                states[model_id] = "loading"
+            elif model.loaded:
+                states[model_id] = "loaded"
+            else:
+                states[model_id] = "unloaded"
+        return states
+
+    def pool_stats(self):
+        """Return the memory used by the models of the pool and its
+        latest evictions
+        """
+        if self.pool is None:
+            return {}
+        return self.pool.stats()
+
     def list_models(self):
         """Return the list of available models
         """
@@ -191,11 +478,44 @@ class ServerModel(object):
             timeout (see :func:`do_timeout()`.)
         model_root (str): Path to the model directory
             it must contain the model and tokenizer file
+        encoder_cache (onmt.translate.encoder_cache.EncoderCache): Cache
+            of encoder outputs shared by the models, or None
+        batch_tokens (int): Source token budget of the batches merging
+            concurrent requests (see :class:`BatchingQueue`)
+        batch_wait (float): Seconds to wait for concurrent requests to
+            merge. 0 translates every request on its own
+        loader (concurrent.futures.Executor): Executor loading the model
+            in the background, or None to load it on the request thread
+        on_loading (str): Options are ["wait", "reject"]. What a request
+            does while the model loads in the background: wait for it or
+            fail with :class:`ServerModelLoading`
+        loading_timeout (float): Seconds a request waits for the model
+            to load
+        pool (ModelPool): Memory budget shared with the other models of
+            the server, or None
+        shared_from (ServerModel): Model whose weights and fields are
+            shared, when it is loaded from the same checkpoints, rather
+            than loading them again. Only the Translator is duplicated,
+            and the models sharing weights take turns translating since
+            the model keeps the decoding level and state
     """
 
+    # options changing the weights loaded from the checkpoints
+    model_opts = ["data_type", "gpu", "fp32"]
+
     def __init__(self, opt, model_id, tokenizer_opt=None, load=False,
-                 timeout=-1, on_timeout="to_cpu", model_root="./"):
+                 timeout=-1, on_timeout="to_cpu", model_root="./",
+                 encoder_cache=None, batch_tokens=0, batch_wait=0,
+                 loader=None, on_loading="wait", loading_timeout=30,
+                 pool=None, shared_from=None):
         self.model_root = model_root
+        self.encoder_cache = encoder_cache
+        self.pool = pool
+        self.shared_from = shared_from
+        self.clones = []
+        self.loaded_model = None
+        self.nbytes = None
+        self.n_evictions = 0
         self.opt = self.parse_opt(opt)
         if self.opt.n_best > 1:
             raise ValueError("Values of n_best > 1 are not supported")
@@ -218,12 +538,31 @@ class ServerModel(object):
 
         self.loading_lock = threading.Event()
         self.loading_lock.set()
-        self.running_lock = threading.Semaphore(value=1)
+        if shared_from is not None:
+            self.running_lock = shared_from.running_lock
+        else:
+            self.running_lock = threading.Semaphore(value=1)
+        self.loader = loader
+        self.on_loading = on_loading
+        self.loading_timeout = loading_timeout
+        self.loading_future = None
+        self._submit_lock = threading.Lock()
 
         set_random_seed(self.opt.seed, self.opt.cuda)
 
+        if shared_from is not None:
+            shared_from.clones.append(self)
+
+        self.batching_queue = None
+        if batch_wait > 0:
+            self.batching_queue = BatchingQueue(
+                self._run, max_tokens=batch_tokens, max_wait=batch_wait)
+
         if load:
-            self.load()
+            if self.loader is not None:
+                self.load_in_background()
+            else:
+                self.load()
 
     def parse_opt(self, opt):
         """Parse the option set passed by the user using `onmt.opts`
@@ -267,19 +606,92 @@ class ServerModel(object):
     def loaded(self):
         return hasattr(self, 'translator')
 
+    @property
+    def loading(self):
+        return not self.loading_lock.is_set() or (
+            self.loading_future is not None
+            and not self.loading_future.done())
+
+    @property
+    def retry_after(self):
+        """Seconds after which a rejected request should be retried."""
+        return max(1, int(math.ceil(getattr(self, 'load_time', 5))))
+
+    def load_in_background(self):
+        """Load the model on `self.loader` unless it is loaded or already
+        loading.
+
+        Returns:
+            the future of the load, or None if the model is loaded
+        """
+        with self._submit_lock:
+            if self.loaded:
+                return None
+            if self.loading_future is None or self.loading_future.done():
+                self.logger.info("Loading model %d in the background"
+                                 % self.model_id)
+                self.loading_future = self.loader.submit(self.load)
+            return self.loading_future
+
+    def can_share(self, model):
+        """Whether `model` can translate with the weights of this one."""
+        same_models = [os.path.abspath(path) for path in self.opt.models] \
+            == [os.path.abspath(path) for path in model.opt.models]
+        return same_models and all(
+            getattr(self.opt, name) == getattr(model.opt, name)
+            for name in self.model_opts)
+
+    @property
+    def shared(self):
+        """Whether another loaded model translates with the weights of
+        this one."""
+        source = self.shared_from or self
+        return self.loaded_model is not None and any(
+            model is not self and model.loaded_model is self.loaded_model
+            for model in [source] + source.clones)
+
+    @property
+    def levels(self):
+        """Levels the loaded model can translate to."""
+        return [int(level) for level in self.translator.model.decoders]
+
     def load(self):
         self.loading_lock.clear()
+        try:
+            self._load()
+        finally:
+            self.loading_lock.set()
 
+    def _load(self):
         timer = Timer()
         self.logger.info("Loading model %d" % self.model_id)
         timer.start()
 
-        try:
-            self.translator = build_translator(self.opt,
-                                               report_score=False,
-                                               out_file=open(os.devnull, "w"))
-        except RuntimeError as e:
-            raise ServerModelError("Runtime Error: %s" % str(e))
+        source = self.shared_from
+        loaded = source.loaded_model if source is not None else None
+        if loaded is not None and source.can_share(self):
+            self.logger.info("Sharing the weights of model %d"
+                             % source.model_id)
+            nbytes = 0
+        else:
+            if self.pool is not None:
+                # size of the last load, or of the checkpoints the first
+                # time
+                self.pool.reserve(self, self.nbytes or sum(
+                    os.path.getsize(path) for path in self.opt.models))
+            try:
+                loaded = load_models(self.opt)
+            except RuntimeError as e:
+                raise ServerModelError("Runtime Error: %s" % str(e))
+            nbytes = model_nbytes(loaded[1])
+
+        translator = build_translator(
+            self.opt,
+            report_score=False,
+            out_file=open(os.devnull, "w"),
+            encoder_cache=self.encoder_cache,
+            encoder_cache_id=self.model_id,
+            loaded=loaded)
 
         timer.tick("model_loading")
         if self.tokenizer_opt is not None:
@@ -321,15 +733,33 @@ class ServerModel(object):
                 raise ValueError("Invalid value for tokenizer type")
 
         self.load_time = timer.tick()
+        # only now is the model seen as loaded
+        self.translator = translator
+        self.loaded_model = loaded
+        self.nbytes = nbytes
+        if self.pool is not None:
+            self.pool.add(self, self.nbytes)
         self.reset_unload_timer()
-        self.loading_lock.set()
 
-    @critical
     def run(self, inputs):
+        """Translate `inputs` using this model, merging them with the
+        requests of other callers when batching is enabled. See
+        :func:`_run()`."""
+        if self.batching_queue is not None:
+            return self.batching_queue.submit(inputs)
+        return self._run(inputs)
+
+    @critical
+    def _run(self, inputs):
         """Translate `inputs` using this model
 
+        Items are grouped by target ``"level"``, one batched translation
+        running per level; items without a level are translated to the
+        first level of the model.
+
         Args:
-            inputs (List[dict[str, str]]): [{"src": "..."},{"src": ...}]
+            inputs (List[dict[str, str]]):
+                [{"src": "...", "level": 3},{"src": ...}]
 
         Returns:
             result (list): translations
@@ -343,6 +773,18 @@ class ServerModel(object):
 
         self.logger.info("Running translation using %d" % self.model_id)
 
+        if self.loader is not None and not self.loaded:
+            future = self.load_in_background()
+            if future is not None:
+                if self.on_loading == "reject":
+                    raise ServerModelLoading(self.model_id, self.retry_after)
+                try:
+                    future.result(timeout=self.loading_timeout)
+                except FutureTimeoutError:
+                    raise ServerModelError("Model %d loading timeout"
+                                           % self.model_id)
+                timer.tick(name="load")
+
         if not self.loading_lock.is_set():
             self.logger.info(
                 "Model #%d is being loaded by another thread, waiting"
@@ -358,6 +800,8 @@ class ServerModel(object):
             elif self.opt.cuda:
                 self.to_gpu()
                 timer.tick(name="to_gpu")
+        if self.pool is not None:
+            self.pool.touch(self.model_id)
 
         texts = []
         head_spaces = []
@@ -386,13 +830,31 @@ class ServerModel(object):
         empty_indices = [i for i, x in enumerate(texts) if x == ""]
         texts_to_translate = [x for x in texts if x != ""]
 
-        scores = []
-        predictions = []
+        # positions in texts_to_translate of the items of each level
+        default_level = self.levels[0]
+        level_positions = OrderedDict()
+        levels = [int(inp.get("level", default_level))
+                  for text, inp in zip(texts, inputs) if text != ""]
+        for i, level in enumerate(levels):
+            if level not in self.levels:
+                raise ServerModelError(
+                    "Model %d has no level %d" % (self.model_id, level))
+            level_positions.setdefault(level, []).append(i)
+
+        scores = [None] * len(texts_to_translate)
+        predictions = [None] * len(texts_to_translate)
         if len(texts_to_translate) > 0:
             try:
-                scores, predictions = self.translator.translate(
-                    texts_to_translate,
-                    batch_size=self.opt.batch_size)
+                for level, positions in level_positions.items():
+                    level_scores, level_predictions = \
+                        self.translator.translate(
+                            [texts_to_translate[i] for i in positions],
+                            level=level,
+                            batch_size=self.opt.batch_size)
+                    for i, score, prediction in zip(
+                            positions, level_scores, level_predictions):
+                        scores[i] = score
+                        predictions[i] = prediction
             except (RuntimeError, Exception) as e:
                 err = "Error: %s" % str(e)
                 self.logger.error(err)
@@ -439,18 +901,60 @@ class ServerModel(object):
         attr`self.on_timemout` value
         """
 
-        if self.on_timeout == "unload":
+        if self.on_timeout == "unload" and self.owns_shared_weights:
+            self.logger.info("Timeout: model %d shares its weights, "
+                             "keeping it loaded" % self.model_id)
+        elif self.on_timeout == "unload":
             self.logger.info("Timeout: unloading model %d" % self.model_id)
             self.unload()
-        if self.on_timeout == "to_cpu":
+        if self.on_timeout == "to_cpu" and self.shared:
+            self.logger.info("Timeout: model %d shares its weights, "
+                             "keeping them in place" % self.model_id)
+        elif self.on_timeout == "to_cpu":
             self.logger.info("Timeout: sending model %d to CPU"
                              % self.model_id)
             self.to_cpu()
 
+    @property
+    def owns_shared_weights(self):
+        """Whether the weights accounted to this model are used by
+        another loaded model, which unloading it would not free."""
+        return bool(self.nbytes) and self.shared
+
     @critical
     def unload(self):
+        if self.owns_shared_weights:
+            raise ServerModelError(
+                "Model %d shares its weights with loaded models, unload "
+                "them first" % self.model_id)
+        self._unload()
+
+    def try_unload(self):
+        """Unload the model unless it is translating or not loaded.
+
+        Returns:
+            whether the model was unloaded
+        """
+        if not self.running_lock.acquire(False):
+            return False
+        try:
+            # the clones sharing its weights would keep them in memory
+            if not self.loaded or self.owns_shared_weights:
+                return False
+            self.stop_unload_timer()
+            self._unload()
+            self.n_evictions += 1
+            return True
+        finally:
+            self.running_lock.release()
+
+    def _unload(self):
         self.logger.info("Unloading model %d" % self.model_id)
         del self.translator
+        self.loaded_model = None
+        self.discard_encoder_cache()
+        if self.pool is not None:
+            self.pool.release(self.model_id)
         if self.opt.cuda:
             torch.cuda.empty_cache()
         self.unload_timer = None
@@ -474,8 +978,15 @@ class ServerModel(object):
                      if k not in hide_opt},
              "models": self.user_opt["models"],
              "loaded": self.loaded,
+             "loading": self.loading,
              "timeout": self.timeout,
+             "nbytes": self.nbytes,
+             "shared_from": None if self.shared_from is None
+             else self.shared_from.model_id,
+             "evictions": self.n_evictions,
              }
+        if self.batching_queue is not None:
+            d["queue"] = self.batching_queue.stats()
         if self.tokenizer_opt is not None:
             d["tokenizer"] = self.tokenizer_opt
         return d
@@ -483,15 +994,26 @@ class ServerModel(object):
     @critical
     def to_cpu(self):
         """Move the model to CPU and clear CUDA cache."""
+        if self.shared:
+            raise ServerModelError(
+                "Model %d shares its weights with loaded models, they "
+                "can't be moved" % self.model_id)
         self.translator.model.cpu()
+        self.discard_encoder_cache()
         if self.opt.cuda:
             torch.cuda.empty_cache()
 
     def to_gpu(self):
-        """Move the model to GPU."""
+        """Move the model to GPU. The models sharing its weights are
+        moved too, they use the same GPU (see :func:`can_share()`)."""
         torch.cuda.set_device(self.opt.gpu)
         self.translator.model.cuda()
 
+    def discard_encoder_cache(self):
+        """Drop the cached encoder outputs of this model."""
+        if self.encoder_cache is not None:
+            self.encoder_cache.discard(self.model_id)
+
     def maybe_tokenize(self, sequence):
         """Tokenize the sequence (or not).
 
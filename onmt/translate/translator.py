@@ -5,7 +5,8 @@ import codecs
 import os
 import math
 import time
-from itertools import count
+from collections import OrderedDict, defaultdict, deque
+from itertools import count, islice
 
 import torch
 
@@ -14,12 +15,35 @@ import onmt.translate.beam
 import onmt.inputters as inputters
 import onmt.decoders.ensemble
 from onmt.translate.beam_search import BeamSearch
+from onmt.translate.continuous_beam_search import ContinuousBeamSearch
+from onmt.decoders.decoder import RNNDecoderBase
+from onmt.decoders.ensemble import EnsembleModel
 from onmt.translate.random_sampling import RandomSampling
-from onmt.utils.misc import tile, set_random_seed
+from onmt.utils.misc import tile, set_random_seed, pad_or_narrow
 from onmt.modules.copy_generator import collapse_copy_scores
 
 
-def build_translator(opt, report_score=True, logger=None, out_file=None):
+def load_models(opt):
+    """Load the checkpoints of ``opt.models``, as an ensemble if there
+    are several.
+
+    Returns:
+        (fields, model, model_opt)
+    """
+    load_test_model = onmt.decoders.ensemble.load_test_model \
+        if len(opt.models) > 1 else onmt.model_builder.load_test_model
+    return load_test_model(opt)
+
+
+def build_translator(opt, report_score=True, logger=None, out_file=None,
+                     encoder_cache=None, encoder_cache_id=None,
+                     loaded=None):
+    """Build a :class:`Translator` from the translation options `opt`.
+
+    `loaded` is the ``(fields, model, model_opt)`` of an already loaded
+    model (see :func:`load_models()`) to share instead of loading
+    ``opt.models`` again.
+    """
     if out_file is None:
         out_files = {}
         for level in opt.levels:
@@ -28,10 +52,13 @@ def build_translator(opt, report_score=True, logger=None, out_file=None):
                 os.makedirs(output_path)
             file_name = 'pred.' + str(level)
             out_files[level] = open(os.path.join(output_path, file_name), mode='w+', encoding='utf-8')
+    else:
+        # every level writes to out_file
+        out_files = defaultdict(lambda: out_file)
 
-    load_test_model = onmt.decoders.ensemble.load_test_model \
-        if len(opt.models) > 1 else onmt.model_builder.load_test_model
-    fields, model, model_opt = load_test_model(opt)
+    if loaded is None:
+        loaded = load_models(opt)
+    fields, model, model_opt = loaded
 
     scorer = onmt.translate.GNMTGlobalScorer.from_opt(opt)
 
@@ -43,7 +70,9 @@ def build_translator(opt, report_score=True, logger=None, out_file=None):
         global_scorer=scorer,
         out_files=out_files,
         report_score=report_score,
-        logger=logger
+        logger=logger,
+        encoder_cache=encoder_cache,
+        encoder_cache_id=encoder_cache_id
     )
     return translator
 
@@ -69,6 +98,9 @@ class Translator(object):
         random_sampling_temp (int): See
             :class:`onmt.translate.random_sampling.RandomSampling`.
         stepwise_penalty (bool): Whether coverage penalty is applied every step
+        early_stopping (bool): Finish the sentences of beam search once
+            their live beams can no longer make it into their ``n_best``
+            hypotheses, see :func:`onmt.translate.BeamSearch.stop_early()`.
             or not.
         dump_beam (bool): Debugging option.
         block_ngram_repeat (int): See
@@ -86,6 +118,12 @@ class Translator(object):
         out_files (TextIO or codecs.StreamReaderWriter): Output files for multiple levels.
         report_score (bool) : Whether to report scores
         logger (logging.Logger or NoneType): Logger.
+        encoder_cache (onmt.translate.encoder_cache.EncoderCache or
+            NoneType): Cache of the encoder outputs of source batches.
+        encoder_cache_id: Identifier of the model in ``encoder_cache``.
+        continuous_batching (bool): Refill the rows of the beam search
+            freed by finished sentences with the next sentences, see
+            :func:`_translate_continuous()`.
     """
 
     def __init__(
@@ -102,6 +140,7 @@ class Translator(object):
             random_sampling_topk=1,
             random_sampling_temp=1,
             stepwise_penalty=None,
+            early_stopping=False,
             dump_beam=False,
             block_ngram_repeat=0,
             ignore_when_blocking=frozenset(),
@@ -115,7 +154,10 @@ class Translator(object):
             out_files=None,
             report_score=True,
             logger=None,
-            seed=-1):
+            seed=-1,
+            encoder_cache=None,
+            encoder_cache_id=None,
+            continuous_batching=False):
         self.model = model
         self.fields = fields
         tgt_field = dict(self.fields)["tgt"].base_field
@@ -140,6 +182,7 @@ class Translator(object):
 
         self.min_length = min_length
         self.stepwise_penalty = stepwise_penalty
+        self.early_stopping = early_stopping
         self.dump_beam = dump_beam
         self.block_ngram_repeat = block_ngram_repeat
         self.ignore_when_blocking = ignore_when_blocking
@@ -166,6 +209,9 @@ class Translator(object):
         self.out_files = out_files
         self.report_score = report_score
         self.logger = logger
+        self.encoder_cache = encoder_cache
+        self.encoder_cache_id = encoder_cache_id
+        self.continuous_batching = continuous_batching
 
         self.use_filter_pred = False
         self._filter_pred = None
@@ -193,7 +239,9 @@ class Translator(object):
             out_file=None,
             out_files=None,
             report_score=True,
-            logger=None):
+            logger=None,
+            encoder_cache=None,
+            encoder_cache_id=None):
         """Alternate constructor.
 
         Args:
@@ -211,6 +259,9 @@ class Translator(object):
                 :func:`__init__()`.
             report_score (bool) : See :func:`__init__()`.
             logger (logging.Logger or NoneType): See :func:`__init__()`.
+            encoder_cache (onmt.translate.encoder_cache.EncoderCache or
+                NoneType): See :func:`__init__()`.
+            encoder_cache_id: See :func:`__init__()`.
         """
 
         src_reader = inputters.str2reader[opt.data_type].from_opt(opt)
@@ -228,6 +279,7 @@ class Translator(object):
             random_sampling_topk=opt.random_sampling_topk,
             random_sampling_temp=opt.random_sampling_temp,
             stepwise_penalty=opt.stepwise_penalty,
+            early_stopping=opt.early_stopping,
             dump_beam=opt.dump_beam,
             block_ngram_repeat=opt.block_ngram_repeat,
             ignore_when_blocking=set(opt.ignore_when_blocking),
@@ -241,7 +293,10 @@ class Translator(object):
             out_files=out_files,
             report_score=report_score,
             logger=logger,
-            seed=opt.seed)
+            seed=opt.seed,
+            encoder_cache=encoder_cache,
+            encoder_cache_id=encoder_cache_id,
+            continuous_batching=opt.continuous_batching)
 
     def _log(self, msg):
         if self.logger:
@@ -276,7 +331,11 @@ class Translator(object):
             src_dir: See :func:`self.src_reader.read()` (only relevant
                 for certain types of data).
             batch_size (int): size of examples per mini-batch
-            level: target translation level
+            level: target translation level, or list of levels to
+                translate ``src`` to in a single pass: each batch is
+                encoded once and decoded by the decoder of every level,
+                the predictions of a level going to its ``out_files``
+                entry. Gold scores are not computed for a list of levels.
             attn_debug (bool): enables the attention logging
 
         Returns:
@@ -285,12 +344,18 @@ class Translator(object):
             * all_scores is a list of `batch_size` lists of `n_best` scores
             * all_predictions is a list of `batch_size` lists
                 of `n_best` predictions
+
+            For a list of levels, both are dicts mapping each level to
+            such a list.
         """
 
         if batch_size is None:
             raise ValueError("batch_size must be set")
 
-        self.out_file = self.out_files[level]
+        multi_level = isinstance(level, (list, tuple))
+        levels = list(level) if multi_level else [level]
+        if multi_level:
+            tgt = None
 
         data = inputters.MultiLevelDataset(
             self.fields,
@@ -299,9 +364,13 @@ class Translator(object):
             data=[("src", src), ("tgt", tgt)] if tgt else [("src", src)],
             dirs=[src_dir, None] if tgt else [src_dir],
             sort_key=inputters.str2sortkey[self.data_type],
-            level=level,
+            level=levels[0],
             filter_pred=self._filter_pred
         )
+        if tgt is None:
+            # there is no target side to batch
+            data.fields = {k: f for k, f in data.fields.items()
+                           if k not in ("tgt", "alignment")}
 
         data_iter = inputters.OrderedIterator(
             dataset=data,
@@ -319,87 +388,458 @@ class Translator(object):
 
         # Statistics
         counter = count(1)
-        pred_score_total, pred_words_total = 0, 0
-        gold_score_total, gold_words_total = 0, 0
+        stats = self._init_stats(levels)
+
+        start_time = time.time()
+
+        for lvl, batch_data in self._translate_batches(
+                data_iter, data, level, batch_size, attn_debug):
+            self.out_file = self.out_files[lvl]
+            translations = xlation_builder.from_batch(batch_data)
+            self._write_translations(
+                translations, stats[lvl], counter, tgt, attn_debug)
+            self._update_stopping_stats(stats[lvl], batch_data)
+            self.out_file.flush()
+
+        end_time = time.time()
+        self._report(stats, tgt is not None, multi_level,
+                     end_time - start_time)
+
+        if multi_level:
+            return (OrderedDict((lvl, level_stats["scores"])
+                                for lvl, level_stats in stats.items()),
+                    OrderedDict((lvl, level_stats["predictions"])
+                                for lvl, level_stats in stats.items()))
+        return stats[level]["scores"], stats[level]["predictions"]
+
+    def translate_stream(
+            self,
+            src,
+            level=0,
+            src_dir=None,
+            batch_size=None,
+            window=10000,
+            attn_debug=False):
+        """Translate ``src`` window by window, in bounded memory.
 
-        all_scores = []
-        all_predictions = []
+        ``window`` lines of ``src`` are read at a time and sorted by
+        length to be batched, their predictions are then written in input
+        order and flushed. Predictions are not kept and gold scores are
+        not computed.
+
+        Args:
+            src (str or file): path of the source file, or file object
+                (e.g. ``sys.stdin.buffer``) to read the lines from.
+            level: See :func:`translate()`.
+            src_dir: See :func:`self.src_reader.read()`.
+            batch_size (int): size of examples per mini-batch
+            window (int): number of source lines translated together.
+            attn_debug (bool): enables the attention logging
+
+        Returns:
+            the number of source lines translated
+        """
+
+        if batch_size is None:
+            raise ValueError("batch_size must be set")
+
+        multi_level = isinstance(level, (list, tuple))
+        levels = list(level) if multi_level else [level]
+
+        counter = count(1)
+        stats = self._init_stats(levels)
+        n_lines = 0
 
         start_time = time.time()
 
-        for batch in data_iter:
-            batch_data = self.translate_batch(
-                batch, data.src_vocabs, attn_debug
-            )
+        src_file = open(src, "rb") if isinstance(src, str) else src
+        try:
+            while True:
+                lines = list(islice(src_file, window))
+                if not lines:
+                    break
+                n_lines += len(lines)
+                self._translate_window(lines, levels, multi_level, src_dir,
+                                       batch_size, stats, counter,
+                                       attn_debug)
+        finally:
+            if src_file is not src:
+                src_file.close()
+
+        end_time = time.time()
+        self._report(stats, False, multi_level, end_time - start_time)
+        return n_lines
+
+    def _translate_window(self, lines, levels, multi_level, src_dir,
+                          batch_size, stats, counter, attn_debug):
+        data = inputters.MultiLevelDataset(
+            self.fields,
+            readers=[self.src_reader],
+            data=[("src", lines)],
+            dirs=[src_dir],
+            sort_key=inputters.str2sortkey[self.data_type],
+            level=levels[0],
+            filter_pred=self._filter_pred
+        )
+        data.fields = {k: f for k, f in data.fields.items()
+                       if k not in ("tgt", "alignment")}
+
+        # sorting the window batches sentences of similar lengths
+        data_iter = inputters.OrderedIterator(
+            dataset=data,
+            device=self._dev,
+            batch_size=batch_size,
+            train=False,
+            sort=True,
+            sort_within_batch=True,
+            shuffle=False
+        )
+
+        xlation_builder = onmt.translate.TranslationBuilder(
+            data, self.fields, self.n_best, self.replace_unk, None
+        )
+
+        # examples may be filtered out, leaving gaps in the indices
+        window_translations = OrderedDict((lvl, {}) for lvl in levels)
+        level = levels if multi_level else levels[0]
+        for lvl, batch_data in self._translate_batches(
+                data_iter, data, level, batch_size, attn_debug):
+            indices = sorted(batch_data["batch"].indices.tolist())
             translations = xlation_builder.from_batch(batch_data)
+            for i, trans in zip(indices, translations):
+                window_translations[lvl][i] = trans
+            self._update_stopping_stats(stats[lvl], batch_data)
+
+        for lvl, translations in window_translations.items():
+            self.out_file = self.out_files[lvl]
+            self._write_translations(
+                [translations[i] for i in sorted(translations)], stats[lvl],
+                counter, None, attn_debug, keep=False)
+            self.out_file.flush()
+
+    def _translate_batches(self, data_iter, data, level, batch_size,
+                           attn_debug):
+        """Translate the batches of ``data_iter``, the iterator of
+        ``data``, to ``level``, or to each level of a list of levels.
+
+        Yields:
+            ``(level, batch_data)`` for each batch and level, in the order
+            of ``data_iter``, where ``batch_data`` is the output of
+            :func:`translate_batch()`.
+        """
+        multi_level = isinstance(level, (list, tuple))
+        if self.continuous_batching:
+            if not multi_level and self._can_refill():
+                for batch_data in self._translate_continuous(
+                        data_iter, data, batch_size, attn_debug):
+                    yield level, batch_data
+                return
+            self._log("Continuous batching is not supported with this "
+                      "model and options or with several levels, "
+                      "translating batch by batch.")
+
+        levels = level if multi_level else [level]
+        for batch in data_iter:
+            encoder_outputs = None
+            if multi_level or self.encoder_cache is not None:
+                with torch.no_grad():
+                    encoder_outputs = self._encode(batch, data)
+            for lvl in levels:
+                batch_data = self.translate_batch(
+                    batch, data.src_vocabs, attn_debug,
+                    level=lvl if multi_level else None,
+                    encoder_outputs=encoder_outputs
+                )
+                yield lvl, batch_data
+
+    def _decoder_state(self):
+        """The ``(state, dim)`` pairs of the current decoder state, in
+        :func:`map_state()` order."""
+        state = []
+        self.model.decoder().map_state(
+            lambda s, dim: state.append((s, dim)) or s)
+        return state
+
+    def _can_refill(self):
+        """Whether :func:`_translate_continuous()` supports the model and
+        the decoding options."""
+        if self.beam_size == 1 or self.copy_attn or self.dump_beam \
+                or self.global_scorer.has_cov_pen or self.early_stopping \
+                or isinstance(self.model, EnsembleModel):
+            return False
+        # the decoder states of the sentences are concatenated, this
+        # needs a state without time dimension
+        return all(isinstance(decoder, RNNDecoderBase)
+                   and not decoder._coverage
+                   for decoder in self.model.decoders.values())
+
+    def _translate_continuous(self, data_iter, data, capacity, attn_debug):
+        """Beam search over the batches of ``data_iter`` refilling the
+        rows of the finished sentences with the next sentences.
+
+        Rather than decoding each batch until its longest sentence is
+        finished, at most ``capacity`` sentences are decoded together.
+        Batches are encoded as needed, and their sentences start decoding
+        once others finish, their memory bank and decoder state being
+        concatenated to those of the live sentences.
+
+        Yields:
+            the output of :func:`translate_batch()` for each batch of
+            ``data_iter``, in order.
+        """
+        return_attention = attn_debug or self.replace_unk
+        beam = ContinuousBeamSearch(
+            self.beam_size,
+            pad=self._tgt_pad_idx,
+            bos=self._tgt_bos_idx,
+            eos=self._tgt_eos_idx,
+            n_best=self.n_best,
+            mb_device=self._dev,
+            global_scorer=self.global_scorer,
+            min_length=self.min_length,
+            max_length=self.max_length,
+            return_attention=return_attention,
+            block_ngram_repeat=self.block_ngram_repeat,
+            exclusion_tokens=self._exclusion_idxs)
 
-            for trans in translations:
-                all_scores += [trans.pred_scores[:self.n_best]]
-                pred_score_total += trans.pred_scores[0]
-                pred_words_total += len(trans.pred_sents[0])
-                if tgt is not None:
-                    gold_score_total += trans.gold_score
-                    gold_words_total += len(trans.gold_sent) + 1
-
-                n_best_preds = [" ".join(pred)
-                                for pred in trans.pred_sents[:self.n_best]]
-                all_predictions += [n_best_preds]
-                self.out_file.write('\n'.join(n_best_preds) + '\n')
-                self.out_file.flush()
-
-                if self.verbose:
-                    sent_number = next(counter)
-                    output = trans.log(sent_number)
-                    if self.logger:
-                        self.logger.info(output)
-                    else:
-                        os.write(1, output.encode('utf-8'))
-
-                if attn_debug:
-                    preds = trans.pred_sents[0]
-                    preds.append('</s>')
-                    attns = trans.attns[0].tolist()
-                    if self.data_type == 'text':
-                        srcs = trans.src_raw
+        batches = iter(data_iter)
+        # results of the batches not yielded yet, in order
+        pending_results = deque()
+        # encoded batch whose sentences are waiting for a row
+        encoded = None
+        next_sent = 0
+        sentences = {}
+        sent_ids = count()
+        memory_bank = None
+        level = None
+
+        with torch.no_grad():
+            while True:
+                free = capacity - len(beam)
+                # decoder states of the live sentences then of each chunk
+                # of new sentences, as (state, dim) lists
+                live_states = [self._decoder_state()] if len(beam) > 0 else []
+                states = list(live_states)
+                memory_banks = [memory_bank] if len(beam) > 0 else []
+                while free > 0 and (encoded is not None
+                                    or batches is not None):
+                    if encoded is None:
+                        batch = next(batches, None)
+                        if batch is None:
+                            batches = None
+                            break
+                        if level is None:
+                            self.set_model_level(batch)
+                            level = batch.level
+                        src, enc_states, batch_memory_bank, src_lengths = \
+                            self._encode(batch, data)
+                        # the gold scoring runs the decoder, the states
+                        # are all set again below
+                        self.model.decoder().init_state(
+                            src, batch_memory_bank, enc_states)
+                        results = {
+                            "predictions": [None] * batch.batch_size,
+                            "scores": [None] * batch.batch_size,
+                            "attention": [None] * batch.batch_size,
+                            "batch": batch,
+                            "gold_score": self._gold_score(
+                                batch, batch_memory_bank, src_lengths,
+                                data.src_vocabs, False, enc_states,
+                                batch.batch_size, src),
+                            "remaining": batch.batch_size}
+                        pending_results.append(results)
+                        encoded = (results, src, enc_states,
+                                   batch_memory_bank, src_lengths)
+                        next_sent = 0
+                    results, src, enc_states, batch_memory_bank, \
+                        src_lengths = encoded
+                    n_new = min(free, src_lengths.size(0) - next_sent)
+                    index = torch.arange(
+                        next_sent, next_sent + n_new, dtype=torch.long,
+                        device=src_lengths.device)
+                    ids = [next(sent_ids) for _ in range(n_new)]
+                    for i, sent_id in enumerate(ids):
+                        sentences[sent_id] = (results, next_sent + i)
+                    beam.add(ids, src_lengths.index_select(0, index))
+
+                    memory_banks.append(tile(
+                        batch_memory_bank.index_select(1, index),
+                        self.beam_size, dim=1))
+                    if isinstance(enc_states, tuple):
+                        new_enc_states = tuple(
+                            h.index_select(1, index) for h in enc_states)
                     else:
-                        srcs = [str(item) for item in range(len(attns[0]))]
-                    header_format = "{:>10.10} " + "{:>10.7} " * len(srcs)
-                    row_format = "{:>10.10} " + "{:>10.7f} " * len(srcs)
-                    output = header_format.format("", *srcs) + '\n'
-                    for word, row in zip(preds, attns):
-                        max_index = row.index(max(row))
-                        row_format = row_format.replace(
-                            "{:>10.7f} ", "{:*>10.7f} ", max_index + 1)
-                        row_format = row_format.replace(
-                            "{:*>10.7f} ", "{:>10.7f} ", max_index)
-                        output += row_format.format(word, *row) + '\n'
-                        row_format = "{:>10.10} " + "{:>10.7f} " * len(srcs)
-                    os.write(1, output.encode('utf-8'))
+                        new_enc_states = enc_states.index_select(1, index)
+                    self.model.decoder().init_state(
+                        src.index_select(1, index), None, new_enc_states)
+                    self.model.decoder().map_state(
+                        lambda state, dim: tile(state, self.beam_size,
+                                                dim=dim))
+                    states.append(self._decoder_state())
+
+                    next_sent += n_new
+                    free -= n_new
+                    if next_sent == src_lengths.size(0):
+                        encoded = None
+
+                if len(states) > len(live_states):
+                    src_len = max(m.size(0) for m in memory_banks)
+                    memory_bank = torch.cat(
+                        [pad_or_narrow(m, src_len) for m in memory_banks], 1)
+                    merged = iter([torch.cat([s[i][0] for s in states],
+                                             states[0][i][1])
+                                   for i in range(len(states[0]))])
+                    self.model.decoder().map_state(
+                        lambda state, dim: next(merged))
+
+                if len(beam) == 0:
+                    break
 
-        end_time = time.time()
+                decoder_input = beam.current_predictions.view(1, -1, 1)
+                log_probs, attn = self._decode_and_generate(
+                    decoder_input,
+                    memory_bank,
+                    None,
+                    data.src_vocabs,
+                    memory_lengths=beam.memory_lengths)
+
+                beam.advance(log_probs, attn)
+                any_beam_is_finished = beam.is_finished.any()
+                if any_beam_is_finished:
+                    beam.update_finished()
+                    for sent_id, (scores, preds, attns) in \
+                            beam.results.items():
+                        results, i = sentences.pop(sent_id)
+                        results["scores"][i] = scores
+                        results["predictions"][i] = preds
+                        results["attention"][i] = attns
+                        results["remaining"] -= 1
+                    beam.results.clear()
+                    while pending_results and \
+                            pending_results[0]["remaining"] == 0:
+                        results = pending_results.popleft()
+                        del results["remaining"]
+                        yield results
+
+                select_indices = beam.current_origin
+                if any_beam_is_finished:
+                    # Reorder states, dropping the padding of the memory
+                    # bank no live sentence needs anymore.
+                    src_len = int(beam.memory_lengths.max()) \
+                        if len(beam) > 0 else 0
+                    memory_bank = memory_bank.index_select(
+                        1, select_indices)[:src_len]
 
-        if self.report_score:
-            msg = self._report_score('PRED', pred_score_total,
-                                     pred_words_total)
+                self.model.decoder().map_state(
+                    lambda state, dim: state.index_select(dim, select_indices))
+
+    @staticmethod
+    def _init_stats(levels):
+        return OrderedDict(
+            (lvl, {"pred_score": 0, "pred_words": 0,
+                   "gold_score": 0, "gold_words": 0, "n_sents": 0,
+                   "n_stopped_early": 0, "steps_saved": 0,
+                   "scores": [], "predictions": []})
+            for lvl in levels)
+
+    @staticmethod
+    def _update_stopping_stats(level_stats, batch_data):
+        for key in ["n_stopped_early", "steps_saved"]:
+            level_stats[key] += batch_data.get(key, 0)
+
+    def _report(self, stats, gold, multi_level, total_time):
+        """Log the scores and speed of a translation given its ``stats``
+        per level."""
+        pred_words_total = 0
+        for lvl, level_stats in stats.items():
+            pred_words_total += level_stats["pred_words"]
+            if not self.report_score:
+                continue
+            if multi_level:
+                self._log("Level %s:" % lvl)
+            msg = self._report_score('PRED', level_stats["pred_score"],
+                                     level_stats["pred_words"])
             self._log(msg)
-            if tgt is not None:
-                msg = self._report_score('GOLD', gold_score_total,
-                                         gold_words_total)
+            if gold:
+                msg = self._report_score('GOLD', level_stats["gold_score"],
+                                         level_stats["gold_words"])
                 self._log(msg)
 
         if self.report_time:
-            total_time = end_time - start_time
+            n_predictions = sum(level_stats["n_sents"]
+                                for level_stats in stats.values())
             self._log("Total translation time (s): %f" % total_time)
             self._log("Average translation time (s): %f" % (
-                total_time / len(all_predictions)))
+                total_time / n_predictions))
             self._log("Tokens per second: %f" % (
                 pred_words_total / total_time))
 
+        if self.early_stopping:
+            for lvl, level_stats in stats.items():
+                self._log("%sEarly stopping finished %d of %d sentences, "
+                          "saving at most %d beam steps." % (
+                              "Level %s: " % lvl if multi_level else "",
+                              level_stats["n_stopped_early"],
+                              level_stats["n_sents"],
+                              level_stats["steps_saved"]))
+
         if self.dump_beam:
             import json
             json.dump(self.translator.beam_accum,
                       codecs.open(self.dump_beam, 'w', 'utf-8'))
-        return all_scores, all_predictions
+
+    def _write_translations(self, translations, stats, counter, tgt,
+                            attn_debug, keep=True):
+        """Write ``translations`` to ``self.out_file`` and add them to
+        the ``stats`` of their level, keeping their scores and
+        predictions unless ``keep`` is False."""
+        lines = []
+        for trans in translations:
+            stats["n_sents"] += 1
+            if keep:
+                stats["scores"] += [trans.pred_scores[:self.n_best]]
+            stats["pred_score"] += trans.pred_scores[0]
+            stats["pred_words"] += len(trans.pred_sents[0])
+            if tgt is not None:
+                stats["gold_score"] += trans.gold_score
+                stats["gold_words"] += len(trans.gold_sent) + 1
+
+            n_best_preds = [" ".join(pred)
+                            for pred in trans.pred_sents[:self.n_best]]
+            if keep:
+                stats["predictions"] += [n_best_preds]
+            lines += n_best_preds
+
+            if self.verbose:
+                sent_number = next(counter)
+                output = trans.log(sent_number)
+                if self.logger:
+                    self.logger.info(output)
+                else:
+                    os.write(1, output.encode('utf-8'))
+
+            if attn_debug:
+                preds = trans.pred_sents[0]
+                preds.append('</s>')
+                attns = trans.attns[0].tolist()
+                if self.data_type == 'text':
+                    srcs = trans.src_raw
+                else:
+                    srcs = [str(item) for item in range(len(attns[0]))]
+                header_format = "{:>10.10} " + "{:>10.7} " * len(srcs)
+                row_format = "{:>10.10} " + "{:>10.7f} " * len(srcs)
+                output = header_format.format("", *srcs) + '\n'
+                for word, row in zip(preds, attns):
+                    max_index = row.index(max(row))
+                    row_format = row_format.replace(
+                        "{:>10.7f} ", "{:*>10.7f} ", max_index + 1)
+                    row_format = row_format.replace(
+                        "{:*>10.7f} ", "{:>10.7f} ", max_index)
+                    output += row_format.format(word, *row) + '\n'
+                    row_format = "{:>10.10} " + "{:>10.7f} " * len(srcs)
+                os.write(1, output.encode('utf-8'))
+        if lines:
+            self.out_file.write('\n'.join(lines) + '\n')
 
     def _translate_random_sampling(
             self,
@@ -409,7 +849,8 @@ class Translator(object):
             min_length=0,
             sampling_temp=1.0,
             keep_topk=-1,
-            return_attention=False):
+            return_attention=False,
+            encoder_outputs=None):
         """Alternative to beam search. Do random sampling at each step."""
 
         assert self.beam_size == 1
@@ -420,7 +861,8 @@ class Translator(object):
         batch_size = batch.batch_size
 
         # Encoder forward.
-        src, enc_states, memory_bank, src_lengths = self._run_encoder(batch)
+        src, enc_states, memory_bank, src_lengths = encoder_outputs \
+            if encoder_outputs is not None else self._run_encoder(batch)
         self.model.decoder().init_state(src, memory_bank, enc_states)
 
         use_src_map = self.copy_attn
@@ -500,12 +942,26 @@ class Translator(object):
         return levels_list[0]
 
     def set_model_level(self, batch):
-        level = self._get_level(batch.levels)
+        level = getattr(batch, "level", None)
+        if level is None:
+            level = self._get_level(batch.levels)
         self.model.set_level(level)
 
-    def translate_batch(self, batch, src_vocabs, attn_debug):
-        """Translate a batch of sentences."""
-        self.set_model_level(batch)
+    def translate_batch(self, batch, src_vocabs, attn_debug, level=None,
+                        encoder_outputs=None):
+        """Translate a batch of sentences.
+
+        Args:
+            level (int or NoneType): level to translate to, the level of
+                ``batch`` by default.
+            encoder_outputs (tuple or NoneType): output of
+                :func:`_run_encoder()` for ``batch``, to reuse it for
+                several levels.
+        """
+        if level is None:
+            self.set_model_level(batch)
+        else:
+            self.model.set_level(level)
 
         with torch.no_grad():
             if self.beam_size == 1:
@@ -516,7 +972,8 @@ class Translator(object):
                     min_length=self.min_length,
                     sampling_temp=self.random_sampling_temp,
                     keep_topk=self.sample_from_topk,
-                    return_attention=attn_debug or self.replace_unk)
+                    return_attention=attn_debug or self.replace_unk,
+                    encoder_outputs=encoder_outputs)
             else:
                 return self._translate_batch(
                     batch,
@@ -524,7 +981,22 @@ class Translator(object):
                     self.max_length,
                     min_length=self.min_length,
                     n_best=self.n_best,
-                    return_attention=attn_debug or self.replace_unk)
+                    return_attention=attn_debug or self.replace_unk,
+                    encoder_outputs=encoder_outputs)
+
+    def _encode(self, batch, data):
+        """:func:`_run_encoder()` going through ``self.encoder_cache``,
+        if any. ``data`` is the dataset of ``batch``."""
+        if self.encoder_cache is None:
+            return self._run_encoder(batch)
+        key = (self.encoder_cache_id,
+               tuple(tuple(tuple(tokens) for tokens in data.example(i).src)
+                     for i in batch.indices.tolist()))
+        encoder_outputs = self.encoder_cache.get(key)
+        if encoder_outputs is None:
+            encoder_outputs = self._run_encoder(batch)
+            self.encoder_cache.put(key, encoder_outputs)
+        return encoder_outputs
 
     def _run_encoder(self, batch):
         src, src_lengths = batch.src if isinstance(batch.src, tuple) \
@@ -605,7 +1077,8 @@ class Translator(object):
             max_length,
             min_length=0,
             n_best=1,
-            return_attention=False):
+            return_attention=False,
+            encoder_outputs=None):
         # TODO: support these blacklisted features.
         assert not self.dump_beam
 
@@ -615,7 +1088,8 @@ class Translator(object):
         batch_size = batch.batch_size
 
         # (1) Run the encoder on the src.
-        src, enc_states, memory_bank, src_lengths = self._run_encoder(batch)
+        src, enc_states, memory_bank, src_lengths = encoder_outputs \
+            if encoder_outputs is not None else self._run_encoder(batch)
         self.model.decoder().init_state(src, memory_bank, enc_states)
 
         results = {
@@ -658,7 +1132,8 @@ class Translator(object):
             stepwise_penalty=self.stepwise_penalty,
             block_ngram_repeat=self.block_ngram_repeat,
             exclusion_tokens=self._exclusion_idxs,
-            memory_lengths=memory_lengths)
+            memory_lengths=src_lengths,
+            early_stopping=self.early_stopping)
 
         for step in range(max_length):
             decoder_input = beam.current_predictions.view(1, -1, 1)
@@ -701,6 +1176,8 @@ class Translator(object):
         results["scores"] = beam.scores
         results["predictions"] = beam.predictions
         results["attention"] = beam.attention
+        results["n_stopped_early"] = int(beam.n_stopped_early)
+        results["steps_saved"] = int(beam.steps_saved)
         return results
 
     # This is left in the code for now, but unsued
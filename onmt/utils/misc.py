@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 
+import os
 import torch
 import random
 import inspect
+from array import array
 from itertools import islice
 
 
@@ -11,6 +13,40 @@ def read_lines(path):
         return f.readlines()
 
 
+def read_line_index(path, line):
+    """ Byte offset of line `line` of `path` in the `.idx` file written
+    next to it by `preprocess.py -split_line_index`: the byte offset of
+    every line of `path` followed by its size. None when there is no
+    index, or when it is out of date, its last entry not being the size
+    of `path`. """
+    index_path = path + ".idx"
+    offsets = array("q")
+    if not os.path.exists(index_path) or \
+            os.path.getsize(index_path) < offsets.itemsize:
+        return None
+    with open(index_path, "rb") as f:
+        f.seek(-offsets.itemsize, os.SEEK_END)
+        offsets.frombytes(f.read(offsets.itemsize))
+        n_lines = f.tell() // offsets.itemsize - 1
+        if offsets[0] != os.path.getsize(path) or line > n_lines:
+            return None
+        f.seek(line * offsets.itemsize)
+        offsets.frombytes(f.read(offsets.itemsize))
+    return offsets[1]
+
+
+def read_line_range(path, start, end):
+    """ Read lines `start` to `end` (excluded) of `path` as bytes,
+    seeking straight to `start` when a `.idx` line index of `path`
+    exists, see `read_line_index`. """
+    offset = read_line_index(path, start)
+    with open(path, "rb") as f:
+        if offset is not None:
+            f.seek(offset)
+            return list(islice(f, end - start))
+        return list(islice(f, start, end))
+
+
 def read_lines_string(path):
     with open(path, "r", encoding='utf-8') as f:
         return f.readlines()
@@ -72,6 +108,19 @@ def tile(x, count, dim=0):
     return x
 
 
+def pad_or_narrow(x, size, dim=0):
+    """
+    Zero pads or narrows x to size on dimension dim.
+    """
+    if x.size(dim) > size:
+        return x.narrow(dim, 0, size)
+    if x.size(dim) < size:
+        pad_size = list(x.size())
+        pad_size[dim] = size - x.size(dim)
+        return torch.cat([x, x.new_zeros(pad_size)], dim)
+    return x
+
+
 def use_gpu(opt):
     """
     Creates a boolean if gpu used
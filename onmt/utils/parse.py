@@ -85,6 +85,11 @@ class ArgumentParser(cfargparse.ArgumentParser):
                 "-epochs is deprecated please use -train_steps.")
         if opt.truncated_decoder > 0 and opt.accum_count > 1:
             raise AssertionError("BPTT is not compatible with -accum > 1")
+        if opt.mix_levels and (opt.level_batches > 0 or opt.copy_attn
+                               or opt.decoder_type == "cnn"):
+            raise AssertionError(
+                "-mix_levels is not compatible with -level_batches, "
+                "-copy_attn and the cnn decoder")
         if opt.gpuid:
             raise AssertionError("gpuid is deprecated \
                   see world_size and gpu_ranks")
@@ -96,6 +101,13 @@ class ArgumentParser(cfargparse.ArgumentParser):
     def validate_translate_opts(cls, opt):
         if opt.beam_size != 1 and opt.random_sampling_topk != 1:
             raise ValueError('Can either do beam search OR random sampling.')
+        if opt.stream and opt.data_type != "text":
+            raise ValueError('-stream only supports text data.')
+        if opt.src == "-" and not opt.stream:
+            raise ValueError('Reading -src from stdin needs -stream.')
+        if opt.early_stopping and opt.coverage_penalty != "none":
+            raise ValueError('-early_stopping does not support '
+                             '-coverage_penalty.')
 
     @classmethod
     def validate_preprocess_args(cls, opt):
@@ -106,6 +118,11 @@ class ArgumentParser(cfargparse.ArgumentParser):
             "-shuffle is not implemented. Please shuffle \
             your data before pre-processing."
 
+        if opt.shard_format == "compact":
+            assert opt.data_type == "text" and not opt.dynamic_dict, \
+                "-shard_format compact only supports text data " \
+                "without -dynamic_dict."
+
         for level in opt.levels:
             assert os.path.isfile(concate_level(opt.src, level)) \
                 and os.path.isfile(concate_level(opt.tgt, level)), \
@@ -15,6 +15,7 @@ class Statistics(object):
     * accuracy
     * perplexity
     * elapsed time
+    * time spent waiting for the next batch
     """
 
     def __init__(self, loss=0, n_words=0, n_correct=0):
@@ -22,6 +23,7 @@ class Statistics(object):
         self.n_words = n_words
         self.n_correct = n_correct
         self.n_src_words = 0
+        self.data_time = 0
         self.start_time = time.time()
 
     @staticmethod
@@ -81,6 +83,7 @@ class Statistics(object):
         self.loss += stat.loss
         self.n_words += stat.n_words
         self.n_correct += stat.n_correct
+        self.data_time += stat.data_time
 
         if update_n_src_words:
             self.n_src_words += stat.n_src_words
@@ -101,6 +104,11 @@ class Statistics(object):
         """ compute elapsed time """
         return time.time() - self.start_time
 
+    def data_wait(self):
+        """ compute the percentage of the elapsed time spent waiting
+        for batches """
+        return 100 * self.data_time / (self.elapsed_time() + 1e-5)
+
     def output(self, step, num_steps, learning_rate, start):
         """Write out statistics to stdout.
 
@@ -115,7 +123,7 @@ class Statistics(object):
             step_fmt = "%s/%5d" % (step_fmt, num_steps)
         logger.info(
             ("Step %s; acc: %6.2f; ppl: %5.2f; xent: %4.2f; " +
-             "lr: %7.5f; %3.0f/%3.0f tok/s; %6.0f sec")
+             "lr: %7.5f; %3.0f/%3.0f tok/s; data wait: %4.1f%%; %6.0f sec")
             % (step_fmt,
                self.accuracy(),
                self.ppl(),
@@ -123,6 +131,7 @@ class Statistics(object):
                learning_rate,
                self.n_src_words / (t + 1e-5),
                self.n_words / (t + 1e-5),
+               self.data_wait(),
                time.time() - start))
         sys.stdout.flush()
 
@@ -134,3 +143,4 @@ class Statistics(object):
         writer.add_scalar(prefix + "/accuracy", self.accuracy(), step)
         # writer.add_scalar(prefix + "/tgtper", self.n_words / t, step)
         writer.add_scalar(prefix + "/lr", learning_rate, step)
+        writer.add_scalar(prefix + "/data_wait", self.data_wait(), step)
@@ -8,12 +8,17 @@ import glob
 import os
 import sys
 import gc
+import multiprocessing
 import torch
+from array import array
+from collections import Counter, defaultdict
 from functools import partial
+from itertools import islice
 
+from onmt.inputters.compact_dataset import CompactDataset
 from onmt.inputters.multi_level_dataset import MultiLevelDataset
 from onmt.utils.logging import init_logger, logger
-from onmt.utils.misc import concate_level, read_lines
+from onmt.utils.misc import concate_level, read_line_range
 import onmt.inputters as inputters
 import onmt.opts as opts
 from onmt.utils.parse import ArgumentParser
@@ -40,49 +45,175 @@ def append_prefix(side_file_path, prefix):
     return os.path.join(head, tail)
 
 
+def count_lines(path, chunk_size=1 << 20):
+    """ Count the lines of `path` as `readlines` would, reading it
+    in fixed-size chunks. """
+    count, last = 0, b"\n"
+    with open(path, "rb") as f:
+        for chunk in iter(partial(f.read, chunk_size), b""):
+            count += chunk.count(b"\n")
+            last = chunk[-1:]
+    return count + (last != b"\n")
+
+
+def split_file(side_file_path, sizes, line_index=False):
+    """ Stream `side_file_path` into its train / valid / test files.
+
+    Args:
+        side_file_path (str): file of one side of one level.
+        sizes (list[int]): number of lines of the train and valid
+            splits; the test split gets the remaining lines.
+        line_index (bool): also write, next to each split, a
+            `.idx` file holding the int64 byte offset of every line
+            followed by the size of the split. Otherwise the `.idx`
+            files of a previous split are removed.
+    """
+    prefixes = [train_prefix, valid_prefix, test_prefix]
+    with open(side_file_path, "rb") as f:
+        for prefix, size in zip(prefixes, sizes + [None]):
+            split_path = append_prefix(side_file_path, prefix)
+            if not line_index and os.path.exists(split_path + ".idx"):
+                os.remove(split_path + ".idx")
+            index_file = open(split_path + ".idx", "wb") \
+                if line_index else None
+            offsets, offset = array("q"), 0
+            with open(split_path, "wb") as split_out:
+                for line in islice(f, size):
+                    split_out.write(line)
+                    if index_file is not None:
+                        offsets.append(offset)
+                        if len(offsets) >= 65536:
+                            offsets.tofile(index_file)
+                            del offsets[:]
+                    offset += len(line)
+            if index_file is not None:
+                offsets.append(offset)
+                offsets.tofile(index_file)
+                index_file.close()
+
+
+def split_level(opt, level):
+    src_file_path = concate_level(opt.src, level)
+    tgt_file_path = concate_level(opt.tgt, level)
+    n_lines = count_lines(src_file_path)
+    assert n_lines == count_lines(tgt_file_path)
+
+    train_size, valid_size, test_size = [
+        int(percent * n_lines) for percent in opt.train_valid_test_split]
+
+    for side_file_path in [src_file_path, tgt_file_path]:
+        split_file(side_file_path, [train_size, valid_size],
+                   line_index=opt.split_line_index)
+    return train_size, valid_size, test_size
+
+
 def split_train_valid_test(opt):
     train_valid_test_percent = opt.train_valid_test_split
     assert(sum(train_valid_test_percent) == 1.0)
 
     train_valid_test_sent_count = {"train": 0, "valid": 0, "test": 0}
 
-    for level in opt.levels:
-        src_file_path = concate_level(opt.src, level)
-        tgt_file_path = concate_level(opt.tgt, level)
-        src_lines = read_lines(src_file_path)
-        tgt_lines = read_lines(tgt_file_path)
-        assert len(src_lines) == len(tgt_lines)
-
-        train_size = int(train_valid_test_percent[0] * len(src_lines))
-        valid_size = int(train_valid_test_percent[1] * len(src_lines))
-        test_size = int(train_valid_test_percent[2] * len(src_lines))
-
-        train_valid_test_sent_count["train"] = train_valid_test_sent_count["train"] + train_size
-        train_valid_test_sent_count["valid"] = train_valid_test_sent_count["valid"] + valid_size
-        train_valid_test_sent_count["test"] = train_valid_test_sent_count["test"] + test_size
-
-        for (side_file_path, lines) \
-                in zip([src_file_path, tgt_file_path],
-                       [src_lines, tgt_lines]):
-            train_path = append_prefix(side_file_path, train_prefix)
-            train_file = open(train_path, "wb")
-            train_file.writelines(lines[:train_size])
-            train_file.close()
-
-            valid_path = append_prefix(side_file_path, valid_prefix)
-            valid_file = open(valid_path, "wb")
-            valid_file.writelines(lines[train_size: train_size + valid_size])
-            valid_file.close()
-
-            test_path = append_prefix(side_file_path, test_prefix)
-            test_file = open(test_path, "wb")
-            test_file.writelines(lines[train_size + valid_size:])
-            test_file.close()
+    if opt.num_workers > 1 and len(opt.levels) > 1:
+        with multiprocessing.Pool(
+                min(opt.num_workers, len(opt.levels))) as pool:
+            level_sizes = pool.map(partial(split_level, opt), opt.levels)
+    else:
+        level_sizes = [split_level(opt, level) for level in opt.levels]
+
+    for train_size, valid_size, test_size in level_sizes:
+        train_valid_test_sent_count["train"] += train_size
+        train_valid_test_sent_count["valid"] += valid_size
+        train_valid_test_sent_count["test"] += test_size
 
     print("number of sentences: " + str(train_valid_test_sent_count))
 
 
+def level_shards(corpus_type, src, tgt, opt):
+    """ Cut every level of `corpus_type` into shards of at most
+    `opt.shard_size` lines.
+
+    Returns:
+        list of (level, src_path, tgt_path, start, end, data_path).
+    """
+    shards = []
+    for level in opt.levels:
+        src_path = concate_level(src, level)
+        tgt_path = concate_level(tgt, level)
+        n_lines = count_lines(src_path)
+        shard_size = opt.shard_size if opt.shard_size > 0 else n_lines
+        starts = range(0, max(n_lines, 1), max(shard_size, 1))
+        for shard_id, start in enumerate(starts):
+            if len(starts) == 1:
+                data_path = "{:s}.{:s}.{:d}.pt".format(
+                    opt.save_data, corpus_type, level)
+            else:
+                data_path = "{:s}.{:s}.{:d}.{:d}.pt".format(
+                    opt.save_data, corpus_type, level, shard_id)
+            shards.append((level, src_path, tgt_path, start,
+                           min(start + shard_size, n_lines), data_path))
+    return shards
+
+
+def build_save_shard(corpus_type, fields, src_reader, tgt_reader, opt,
+                     shard):
+    """ Build and save the dataset of one level shard.
+
+    Returns:
+        the saved path and, for the train corpus, the token counts of
+        the shard.
+    """
+    level, src_path, tgt_path, start, end, data_path = shard
+    logger.info("Reading source and target files: %s %s. of level %s "
+                "(lines %d to %d)" % (src_path, tgt_path, level, start, end))
+
+    src_lines = read_line_range(src_path, start, end)
+    tgt_lines = read_line_range(tgt_path, start, end)
+    if (corpus_type == "train" or opt.filter_valid) and tgt_path is not None:
+        filter_pred = partial(
+            inputters.filter_example, use_src_len=opt.data_type == "text",
+            max_src_len=opt.src_seq_length, max_tgt_len=opt.tgt_seq_length)
+    else:
+        filter_pred = None
+
+    assert len(src_lines) == len(tgt_lines)
+    dataset = MultiLevelDataset(
+        fields,
+        readers=[src_reader, tgt_reader] if tgt_reader else [src_reader],
+        data=([("src", src_lines), ("tgt", tgt_lines)] if tgt_reader else [("src", src_lines)]),
+        dirs=[opt.src_dir, None] if tgt_reader else [opt.src_dir],
+        sort_key=inputters.str2sortkey[opt.data_type],
+        level=level,
+        filter_pred=filter_pred
+    )
+    del src_lines, tgt_lines
+
+    counters = inputters.count_tokens(dataset, fields) \
+        if corpus_type == "train" else None
+
+    logger.info(" * saving level %s %s data shard to %s."
+                % (level, corpus_type, data_path))
+
+    if opt.shard_format == "compact":
+        CompactDataset.from_dataset(dataset, fields).save(data_path)
+    else:
+        dataset.save(data_path)
+
+    del dataset.examples
+    gc.collect()
+    del dataset
+    gc.collect()
+
+    return data_path, counters
+
+
 def build_save_dataset(corpus_type, fields, src_reader, tgt_reader, opt):
+    """ Build and save the shards of every level, on a pool of
+    `opt.num_workers` processes if greater than 1.
+
+    Returns:
+        the list of saved shard paths and the merged token counters of
+        the shards (empty for the valid corpus).
+    """
     assert corpus_type in ['train', 'valid']
 
     if corpus_type == 'train':
@@ -92,52 +223,55 @@ def build_save_dataset(corpus_type, fields, src_reader, tgt_reader, opt):
         src = append_prefix(opt.src, valid_prefix)
         tgt = append_prefix(opt.tgt, valid_prefix)
 
+    shards = level_shards(corpus_type, src, tgt, opt)
+    build_shard = partial(build_save_shard, corpus_type, fields,
+                          src_reader, tgt_reader, opt)
+
     dataset_paths = []
-    for level in opt.levels:
-        logger.info("Reading source and target files: %s %s. of level %s" % (src, tgt, level))
-
-        src_lines = read_lines(concate_level(src, level))
-        tgt_lines = read_lines(concate_level(tgt, level))
-        if (corpus_type == "train" or opt.filter_valid) and tgt is not None:
-            filter_pred = partial(
-                inputters.filter_example, use_src_len=opt.data_type == "text",
-                max_src_len=opt.src_seq_length, max_tgt_len=opt.tgt_seq_length)
-        else:
-            filter_pred = None
-
-        assert len(src_lines) == len(tgt_lines)
-        dataset = MultiLevelDataset(
-            fields,
-            readers=[src_reader, tgt_reader] if tgt_reader else [src_reader],
-            data=([("src", src_lines), ("tgt", tgt_lines)] if tgt_reader else [("src", src_lines)]),
-            dirs=[opt.src_dir, None] if tgt_reader else [opt.src_dir],
-            sort_key=inputters.str2sortkey[opt.data_type],
-            level=level,
-            filter_pred=filter_pred
-        )
-
-        data_path = "{:s}.{:s}.{:d}.pt".format(opt.save_data, corpus_type, level)
-        dataset_paths.append(data_path)
-
-        logger.info(" * saving level %s %s data shard to %s."
-                    % (level, corpus_type, data_path))
+    counters = defaultdict(Counter)
 
-        dataset.save(data_path)
+    def _collect(results):
+        for data_path, shard_counters in results:
+            dataset_paths.append(data_path)
+            for name, counter in (shard_counters or {}).items():
+                counters[name].update(counter)
+
+    if opt.num_workers > 1 and len(shards) > 1:
+        with multiprocessing.Pool(min(opt.num_workers, len(shards))) as pool:
+            _collect(pool.imap(build_shard, shards))
+    else:
+        _collect(map(build_shard, shards))
+
+    return dataset_paths, counters
 
-        del dataset.examples
-        gc.collect()
-        del dataset
-        gc.collect()
 
-    return dataset_paths
+def numericalize_shard(fields, data_path):
+    """ Remap the ids of a compact shard to the vocab of `fields`. """
+    dataset = CompactDataset.load(data_path)
+    dataset.numericalize(fields)
+    dataset.save(data_path)
+    return data_path
 
 
-def build_save_vocab(train_dataset, fields, opt):
+def numericalize_shards(dataset_paths, fields, opt):
+    numericalize = partial(numericalize_shard, fields)
+    if opt.num_workers > 1 and len(dataset_paths) > 1:
+        with multiprocessing.Pool(
+                min(opt.num_workers, len(dataset_paths))) as pool:
+            for data_path in pool.imap(numericalize, dataset_paths):
+                logger.info(" * numericalized %s." % data_path)
+    else:
+        for data_path in map(numericalize, dataset_paths):
+            logger.info(" * numericalized %s." % data_path)
+
+
+def build_save_vocab(train_dataset, fields, opt, counters=None):
     fields = inputters.build_vocab(
         train_dataset, fields, opt.data_type, opt.share_vocab,
         opt.src_vocab, opt.src_vocab_size, opt.src_words_min_frequency,
         opt.tgt_vocab, opt.tgt_vocab_size, opt.tgt_words_min_frequency,
-        vocab_size_multiple=opt.vocab_size_multiple
+        vocab_size_multiple=opt.vocab_size_multiple,
+        dataset_counters=counters
     )
 
     vocab_path = opt.save_data + '.vocab.pt'
@@ -184,14 +318,20 @@ def main(opt):
     tgt_reader = inputters.str2reader["text"].from_opt(opt)
 
     logger.info("Building & saving training data...")
-    train_dataset_files = build_save_dataset(
+    train_dataset_files, counters = build_save_dataset(
         'train', fields, src_reader, tgt_reader, opt)
 
     logger.info("Building & saving validation data...")
-    build_save_dataset('valid', fields, src_reader, tgt_reader, opt)
+    valid_dataset_files, _ = build_save_dataset(
+        'valid', fields, src_reader, tgt_reader, opt)
 
     logger.info("Building & saving vocabulary...")
-    build_save_vocab(train_dataset_files, fields, opt)
+    build_save_vocab(train_dataset_files, fields, opt, counters)
+
+    if opt.shard_format == "compact":
+        logger.info("Numericalizing compact shards...")
+        numericalize_shards(
+            train_dataset_files + valid_dataset_files, fields, opt)
 
 
 def _get_parser():
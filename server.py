@@ -2,10 +2,12 @@
 import configargparse
 
 from flask import Flask, jsonify, request
-from onmt.translate import TranslationServer, ServerModelError
+from onmt.translate import TranslationServer, ServerModelError, \
+    ServerModelLoading
 
 STATUS_OK = "ok"
 STATUS_ERROR = "error"
+STATUS_LOADING = "loading"
 
 
 def start(config_file,
@@ -28,6 +30,12 @@ def start(config_file,
         out = translation_server.list_models()
         return jsonify(out)
 
+    @app.route('/health', methods=['GET'])
+    def health():
+        out = {'status': STATUS_OK,
+               'models': translation_server.health()}
+        return jsonify(out)
+
     @app.route('/clone_model/<int:model_id>', methods=['POST'])
     def clone_model(model_id):
         out = {}
@@ -77,12 +85,30 @@ def start(config_file,
                      "n_best": n_best,
                      "pred_score": scores[i]}
                     for i in range(len(translation))]]
+        except ServerModelLoading as e:
+            out['error'] = str(e)
+            out['status'] = STATUS_LOADING
+            out['retry_after'] = e.retry_after
+            response = jsonify(out)
+            response.status_code = 503
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response
         except ServerModelError as e:
             out['error'] = str(e)
             out['status'] = STATUS_ERROR
 
         return jsonify(out)
 
+    @app.route('/encoder_cache', methods=['GET'])
+    def encoder_cache():
+        out = translation_server.encoder_cache_stats()
+        return jsonify(out)
+
+    @app.route('/pool', methods=['GET'])
+    def pool():
+        out = translation_server.pool_stats()
+        return jsonify(out)
+
     @app.route('/to_cpu/<int:model_id>', methods=['GET'])
     def to_cpu(model_id):
         out = {'model_id': model_id}
@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+import argparse
+import torch
+
+from onmt.model_builder import fix_state_dict
+from onmt.models.inference_checkpoint import save_inference_checkpoint
+from onmt.utils.parse import ArgumentParser
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Converts a PyTorch model to the inference checkpoint "
+                    "format, whose weights are memory-mapped when "
+                    "translating. The optim data is dropped.")
+    parser.add_argument("--model", "-m",
+                        help="The model filename (*.pt)", required=True)
+    parser.add_argument("--output", "-o",
+                        help="The output filename (*.pt), the weights are "
+                             "written to <output>.bin", required=True)
+    opt = parser.parse_args()
+
+    checkpoint = torch.load(opt.model,
+                            map_location=lambda storage, loc: storage)
+    model_opt = ArgumentParser.ckpt_model_opts(checkpoint['opt'])
+    ArgumentParser.update_model_opts(model_opt)
+    checkpoint['model'] = fix_state_dict(checkpoint['model'], model_opt)
+    save_inference_checkpoint(checkpoint, opt.output)
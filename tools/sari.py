@@ -21,6 +21,8 @@ from __future__ import division
 from collections import Counter
 import sys
 
+import numpy as np
+
 
 def ReadInFile(filename):
     with open(filename) as f:
@@ -175,17 +177,152 @@ def SARIsent(ssent, csent, rsents):
     return finalscore
 
 
-def main(src_path, tgt_path):
+def _intern_ngrams(token_ids, lengths, max_order):
+    """Give every n-gram of the corpus an integer id.
+
+    ``token_ids`` is the concatenation of all sentences (as integer token
+    ids) and ``lengths`` holds the length of each sentence. The id of an
+    (n+1)-gram is derived from the id of its n-gram prefix and its last
+    token, so ids stay dense and never overflow.
+
+    Returns:
+        list of ``(positions, ids, num_ids)`` for orders 1 to ``max_order``
+        where ``positions`` indexes the first token of each n-gram.
+    """
+    starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    offsets = np.arange(len(token_ids)) - starts
+    remaining = np.repeat(lengths, lengths) - offsets
+
+    vocab_size = int(token_ids.max()) + 1 if len(token_ids) else 1
+    positions = np.arange(len(token_ids))
+    ids, num_ids = token_ids, vocab_size
+    grams = [(positions, ids, num_ids)]
+    for n in range(2, max_order + 1):
+        valid = remaining[positions] >= n
+        positions, ids = positions[valid], ids[valid]
+        keys = ids * vocab_size + token_ids[positions + n - 1]
+        uniq, ids = np.unique(keys, return_inverse=True)
+        ids = ids.reshape(-1)
+        num_ids = len(uniq)
+        grams.append((positions, ids, num_ids))
+    return grams
+
+
+def _f1(precision, recall):
+    denom = precision + recall
+    return np.divide(2 * precision * recall, denom,
+                     out=np.zeros_like(denom), where=denom > 0)
+
+
+def _ratio(num, denom):
+    return np.divide(num, denom, out=np.zeros_like(num, dtype=float),
+                     where=denom > 0)
+
+
+def SARIcorpus(ssents, csents, rsentslist, tokenized=False, max_order=4):
+    """Sentence-level SARI of a whole corpus, computed with array operations.
+
+    Gives the same numbers as calling :func:`SARIsent` on every sentence.
+
+    Args:
+        ssents (list[str]): Source sentences.
+        csents (list[str]): System output sentences.
+        rsentslist (list[list[str]]): One list of sentences per reference
+            set, each aligned with ``ssents``.
+        tokenized (bool): Sentences are already lists of lowercased tokens.
+        max_order (int): Highest n-gram order.
+
+    Returns:
+        numpy.ndarray: the SARI score of each sentence.
+    """
+    num_sents = min([len(ssents), len(csents)] + [len(r) for r in rsentslist])
+    numref = len(rsentslist)
+    if not tokenized:
+        def tokenize(sents):
+            return [sent.lower().split(" ") for sent in sents[:num_sents]]
+    else:
+        def tokenize(sents):
+            return sents[:num_sents]
+    # rows: sources, system outputs, then each reference set
+    sides = [tokenize(ssents), tokenize(csents)] + \
+        [tokenize(rsents) for rsents in rsentslist]
+
+    token_vocab = {}
+    token_ids = np.array(
+        [token_vocab.setdefault(tok, len(token_vocab))
+         for sents in sides for sent in sents for tok in sent],
+        dtype=np.int64)
+    lengths = np.array([len(sent) for sents in sides for sent in sents],
+                       dtype=np.int64)
+    row_sent = np.tile(np.arange(num_sents), len(sides))
+    row_side = np.repeat(np.arange(len(sides)), num_sents)
+    tok_sent = np.repeat(row_sent, lengths)
+    tok_side = np.repeat(row_side, lengths)
+
+    scores = np.zeros(num_sents)
+    for positions, ids, num_ids in _intern_ngrams(
+            token_ids, lengths, max_order):
+        keys = tok_sent[positions] * num_ids + ids
+        side = np.minimum(tok_side[positions], 2)  # all references together
+        uniq, inverse = np.unique(keys, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        sgram, cgram, rgram = [
+            np.bincount(inverse[side == k], minlength=len(uniq))
+            for k in range(3)]
+        sent = uniq // num_ids
+
+        def per_sent(values):
+            return np.bincount(sent, weights=values, minlength=num_sents)
+
+        sgram_rep = sgram * numref
+        cgram_rep = cgram * numref
+
+        # KEEP
+        keepgram_rep = np.minimum(sgram_rep, cgram_rep)
+        keepgramgood_rep = np.minimum(keepgram_rep, rgram)
+        keepgramall_rep = np.minimum(sgram_rep, rgram)
+        keeptmpscore1 = per_sent(_ratio(keepgramgood_rep, keepgram_rep))
+        keeptmpscore2 = per_sent(_ratio(keepgramgood_rep, keepgramall_rep))
+        keepscore_precision = _ratio(keeptmpscore1,
+                                     per_sent(keepgram_rep > 0))
+        keepscore_recall = _ratio(keeptmpscore2,
+                                  per_sent(keepgramall_rep > 0))
+        keepscore = _f1(keepscore_precision, keepscore_recall)
+
+        # DELETION
+        delgram_rep = np.maximum(sgram_rep - cgram_rep, 0)
+        delgramgood_rep = np.maximum(delgram_rep - rgram, 0)
+        deltmpscore1 = per_sent(_ratio(delgramgood_rep, delgram_rep))
+        delscore_precision = _ratio(deltmpscore1, per_sent(delgram_rep > 0))
+
+        # ADDITION
+        addgram = (cgram > 0) & (sgram == 0)
+        addgramgood = addgram & (rgram > 0)
+        addgramall = (rgram > 0) & (sgram == 0)
+        addtmpscore = per_sent(addgramgood)
+        addscore_precision = _ratio(addtmpscore, per_sent(addgram))
+        addscore_recall = _ratio(addtmpscore, per_sent(addgramall))
+        addscore = _f1(addscore_precision, addscore_recall)
+
+        scores += keepscore + delscore_precision + addscore
+
+    return scores / (3 * max_order)
+
+
+def main(src_path, tgt_paths):
     system_output_sentences = [line for line in sys.stdin]
     src_sentences = ReadInFile(src_path)
-    tgt_sentences = ReadInFile(tgt_path)
-    sari_sum = 0
-    for (system_output, src, tgt) in zip(system_output_sentences, src_sentences, tgt_sentences):
-        sari_sum += SARIsent(src, system_output, [tgt])
+    tgt_sentences_list = [ReadInFile(tgt_path) for tgt_path in tgt_paths]
+    sari_sum = SARIcorpus(
+        src_sentences, system_output_sentences, tgt_sentences_list).sum()
 
     sari_avg = 100 * sari_sum / len(system_output_sentences)
     print("SARI = %f" % sari_avg)
 
 
 if __name__ == '__main__':
-    main(sys.argv[1], sys.argv[2])
+    if len(sys.argv) < 3:
+        sys.stderr.write(
+            "usage: sari.py source reference [reference ...] < output\n")
+        sys.exit(1)
+    main(sys.argv[1], sys.argv[2:])
@@ -3,7 +3,7 @@
 
 from __future__ import unicode_literals
 
-
+import sys
 from datetime import datetime
 
 from onmt.utils.logging import init_logger
@@ -19,6 +19,21 @@ def main(opt):
     logger = init_logger(opt.log_file)
 
     translator = build_translator(opt, report_score=True)
+    if opt.stream:
+        stream(opt, translator, logger)
+        return
+    if opt.shared_src:
+        logger.info("Translating %s to levels %s in a single pass."
+                    % (opt.src, " ".join(str(level) for level in opt.levels)))
+        translator.translate(
+            src=opt.src,
+            level=opt.levels,
+            src_dir=opt.src_dir,
+            batch_size=opt.batch_size,
+            attn_debug=opt.attn_debug
+            )
+        return
+
     for level in opt.levels:
         logger.info("Reading source and target files: %s %s. of level %s" % (opt.src, opt.tgt, level))
 
@@ -36,6 +51,28 @@ def main(opt):
             )
 
 
+def stream(opt, translator, logger):
+    if opt.shared_src:
+        sources = [(opt.src, opt.levels)]
+    else:
+        if opt.src == "-" and len(opt.levels) > 1:
+            raise ValueError("Streaming stdin to several -levels needs "
+                             "-shared_src.")
+        sources = [(opt.src if opt.src == "-"
+                    else concate_level(opt.src, level), level)
+                   for level in opt.levels]
+    for src, level in sources:
+        logger.info("Streaming %s to level(s) %s." % (src, level))
+        translator.translate_stream(
+            src=sys.stdin.buffer if src == "-" else src,
+            level=level,
+            src_dir=opt.src_dir,
+            batch_size=opt.batch_size,
+            window=opt.stream_window,
+            attn_debug=opt.attn_debug
+            )
+
+
 def _get_parser():
     parser = ArgumentParser(description='translate.py')
 